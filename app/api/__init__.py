@@ -9,6 +9,7 @@ from .main import router as main_router
 from .middlewares import setup_middlewares
 from .route_generation import router as route_router
 from .strava_routes import router as strava_router
+from .tiles import router as tiles_router
 from .user import router as user_router
 
 __all__ = ["setup_middlewares", "include_routers", "init_sentry"]
@@ -21,6 +22,7 @@ def include_routers(app: FastAPI):
     api_router.include_router(strava_router)
     api_router.include_router(gpx_router)
     api_router.include_router(geocode_router)
+    api_router.include_router(tiles_router)
     api_router.include_router(user_router)
 
     app.include_router(api_router)
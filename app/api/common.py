@@ -1,15 +1,42 @@
+import os
+from pathlib import Path
+
 import osmnx as ox
+from fastapi import HTTPException
 from loguru import logger
 from networkx import MultiDiGraph
+from osmnx._errors import InsufficientResponseError
 
 from app import utils
+from app.generator.executor import RouteExecutor
+from app.graph.cache import GraphCache
+from app.graph.compiled import prepare_graph
+from app.graph.singleflight import SingleFlight
+from app.graph.store import GraphStore
+from app.graph.tiles import Tile, bbox_around, stitch_tiles, tiles_bbox, tiles_for_bbox
 from app.serializers.geocode import BoundingBox
-
-graphs = {}
+from app.settings import settings
+
+graphs = GraphCache(max_bytes=settings.GRAPH_CACHE_MAX_MB * 1024**2)
+graph_store = GraphStore(utils.ROOT_PATH / Path(settings.GRAPH_STORE_DIR))
+route_executor = RouteExecutor(
+    store_root=graph_store.root,
+    workers=settings.ROUTE_WORKERS or os.cpu_count() or 1,
+    queue_size=settings.ROUTE_QUEUE_SIZE,
+    timeout=settings.ROUTE_JOB_TIMEOUT,
+)
+graph_fetches: SingleFlight[MultiDiGraph] = SingleFlight(
+    lock_prefix="lock:graph:", lock_timeout=settings.GRAPH_FETCH_LOCK_TIMEOUT
+)
 
 DEFAULT_START_X = 19.1999532
 DEFAULT_START_Y = 51.6101241
 CITY_BBOX_DEFAULT_SIZE = 0.03
+# Generated routes may overshoot the requested distance by the tolerance
+ROUTE_REACH_FACTOR = 1.2
+# Meters; about the default city bbox, so long routes load a dozen tiles at
+# most instead of hundreds
+MAX_GRAPH_RADIUS = 4_000
 
 BBox = tuple[float, float, float, float]
 
@@ -49,41 +76,130 @@ def bbox_to_tuple(bbox: BoundingBox) -> tuple[float, float, float, float]:
     return (bbox.west, bbox.south, bbox.east, bbox.north)
 
 
+def graph_area(
+    start_x: float,
+    start_y: float,
+    distance: int | None = None,
+    end_x: float | None = None,
+    end_y: float | None = None,
+) -> BBox:
+    """Area a route of ``distance`` meters from the start (to the end) can reach.
+
+    Every point of a closed walk of length L is within L/2 of its start, and
+    every point of an A->B walk is within L/2 of A or of B.
+    """
+    if distance is None:
+        return get_city_bbox(start_x, start_y)
+
+    radius = min(distance * ROUTE_REACH_FACTOR / 2, MAX_GRAPH_RADIUS)
+    west, south, east, north = bbox_around(start_x, start_y, radius)
+    if end_x is not None and end_y is not None:
+        e_west, e_south, e_east, e_north = bbox_around(end_x, end_y, radius)
+        west, south = min(west, e_west), min(south, e_south)
+        east, north = max(east, e_east), max(north, e_north)
+    return (west, south, east, north)
+
+
+def graph_bbox(area: BBox) -> BBox:
+    """Bbox of the graph actually loaded for ``area``, i.e. of its covering tiles."""
+    return tiles_bbox(tiles_for_bbox(area, settings.GRAPH_TILE_DEG))
+
+
+def load_or_fetch_tile(tile: Tile, network_type: str) -> MultiDiGraph:
+    """Unsimplified graph of one tile, from the on-disk store or downloaded."""
+    tile_type = f"{network_type}_tile"
+    return graph_fetches.do(
+        graph_store.key(tile.bbox, tile_type),
+        lambda: _load_or_fetch_tile(tile, tile_type, network_type),
+    )
+
+
+def _load_or_fetch_tile(tile: Tile, tile_type: str, network_type: str) -> MultiDiGraph:
+    G = graph_store.load(tile.bbox, tile_type)
+    if G is not None:
+        return G
+
+    if settings.GRAPH_STORE_OFFLINE:
+        logger.warning("Tile {} not in store and offline mode is on", tile.bbox)
+        raise HTTPException(
+            status_code=503, detail="Graph for this area is not available offline."
+        )
+
+    with utils.time_measure("ox.graph_from_bbox took: "):
+        try:
+            G = ox.graph_from_bbox(
+                tile.bbox,
+                network_type=network_type,
+                simplify=False,
+                retain_all=True,
+                truncate_by_edge=True,
+            )
+        except InsufficientResponseError:
+            logger.info("No streets in tile {}", tile.bbox)
+            G = MultiDiGraph(crs="epsg:4326")
+    graph_store.save(tile.bbox, tile_type, G)
+    return G
+
+
+def load_or_stitch_graph(area: BBox, network_type: str) -> MultiDiGraph:
+    """Graph covering ``area``, stitched from its tiles on a store miss."""
+    tiles = tiles_for_bbox(area, settings.GRAPH_TILE_DEG)
+    bbox = tiles_bbox(tiles)
+    G = graph_store.load(bbox, network_type)
+    if G is not None:
+        return G
+
+    tile_graphs = [load_or_fetch_tile(tile, network_type) for tile in tiles]
+    with utils.time_measure(f"Stitching {len(tiles)} tiles took: "):
+        G = stitch_tiles(tile_graphs)
+    G.graph.update(bbox=bbox, network_type=network_type)
+    prepare_graph(G)
+    graph_store.save(bbox, network_type, G)
+    return G
+
+
 def get_or_create_graph(
     start_x: float | None = None,
     start_y: float | None = None,
     nominatim_id: int | None = None,
     bbox: BoundingBox | None = None,
+    distance: int | None = None,
+    end_x: float | None = None,
+    end_y: float | None = None,
 ) -> MultiDiGraph:
     if start_x is not None and start_y is not None:
-        key = f"{start_x}_{start_y}"
-        if G := graphs.get(key):
-            logger.debug("Using cached graph for coords {}", key)
-            return G
-
-        logger.info("Fetching graph for coords {},{}", start_x, start_y)
-        with utils.time_measure("ox.graph_from_bbox took: "):
-            CITY_BBOX = get_city_bbox(start_x, start_y)
-            G = ox.graph_from_bbox(CITY_BBOX, network_type="walk")
-            graphs[key] = G
-            return G
-
-    if bbox is not None:
-        if g := graphs.get(bbox):
-            logger.debug("Using cached graph for bbox {}", bbox)
-            return g
-
-        logger.info("Fetching graph for bbox {}", bbox)
-        with utils.time_measure("ox.graph_from_bbox took: "):
-            # TODO: check which network_type is better
-            G = ox.graph_from_bbox(bbox_to_tuple(bbox), network_type="walk")
-        graphs[bbox] = G
+        logger.debug("Graph for coords {},{}", start_x, start_y)
+        area = graph_area(start_x, start_y, distance, end_x, end_y)
+        network_type = "walk"
+    elif bbox is not None:
+        logger.debug("Graph for bbox {}", bbox)
+        # TODO: check which network_type is better
+        area = bbox_to_tuple(bbox)
+        network_type = "walk"
+    elif nominatim_id is not None:
+        logger.debug("Graph for nominatim_id={}", nominatim_id)
+        area = get_city_bbox()
+        network_type = "drive"
+    else:
+        area = get_city_bbox()
+        network_type = "walk"
+
+    key = graph_store.key(graph_bbox(area), network_type)
+    G = graphs.get(key)
+    if G is not None:
+        logger.debug("Using cached graph {}", key)
+        return G
+
+    return graph_fetches.do(key, lambda: _load_and_cache(key, area, network_type))
+
+
+def _load_and_cache(key: str, area: BBox, network_type: str) -> MultiDiGraph:
+    # Another thread may have finished loading it just before we got the flight
+    G = graphs.get(key)
+    if G is not None:
         return G
 
-    if nominatim_id is not None:
-        logger.info("Fetching graph for nominatim_id={}", nominatim_id)
-        with utils.time_measure("ox.graph_from_bbox took: "):
-            CITY_BBOX = get_city_bbox(start_x, start_y)
-            G = ox.graph_from_bbox(CITY_BBOX, network_type="drive")
-            graphs["refactor"] = G
-            return G
+    logger.info("Fetching graph {}", key)
+    G = load_or_stitch_graph(area, network_type)
+    graphs.put(key, G)
+    return G
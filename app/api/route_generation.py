@@ -1,24 +1,55 @@
-import osmnx as ox
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response
 from loguru import logger
+from networkx import MultiDiGraph
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from app import utils
 from app.api.common import (
     DEFAULT_START_X,
     DEFAULT_START_Y,
+    BBox,
     bbox_to_tuple,
     get_city_bbox,
     get_or_create_graph,
+    graph_area,
+    graph_bbox,
+    graph_store,
     graphs,
+    route_executor,
 )
+from app.dependencies import get_current_user, get_visited
 from app.generator.all_streets_random import AllStreetsRoute
-from app.generator.astar import AStarRoute
+from app.generator.astar import AStarLandmarkRoute, AStarRoute
+from app.generator.base import NoRouteError, RouteBudgetExceeded, RouteGenerator
+from app.generator.chinese_postman import ChinesePostmanRoute
 from app.generator.dfs import DfsRoute
+from app.generator.executor import (
+    GraphNotStored,
+    RouteJob,
+    RouteJobCancelled,
+    RouteJobTimeout,
+    RouteQueueFull,
+    RouteWorkerLost,
+)
 from app.generator.random_route import RandomRoute
-from app.models import Route
+from app.graph.compiled import CompiledGraph, get_compiled_graph
+from app.graph.elevation import get_edge_elevation, route_edges
+from app.graph.spatial import get_spatial_index, nearest_nodes
+from app.models import Route, UserModel
 from app.serializers.geocode import BoundingBox
+from app.serializers.route import (
+    RouteFormat,
+    encode_polyline,
+    negotiate_format,
+    route_response,
+)
 from app.services.elevation import ElevationService
-from app.visited_edges import visited_edges
+from app.visited_edges import VisitedEdges, visited_store
 
 router = APIRouter(tags=["Routes"])
 
@@ -39,14 +70,180 @@ def _build_bbox(
 
 
 @router.get("/clear")
-def clear():
+def clear(
+    key: str | None = None,
+    everything: bool = False,
+    user: UserModel = Depends(get_current_user),
+):
+    """Evict one cached graph by key, or all graphs and the user's visited edges."""
+    if key is not None:
+        logger.info("Evicting graph {}", key)
+        if not graphs.evict(key):
+            raise HTTPException(status_code=404, detail=f"Graph {key} is not cached")
+        return
+
+    if not everything:
+        raise HTTPException(
+            status_code=422, detail="Pass a graph key or everything=true"
+        )
+
     logger.info("Clearing graphs and visited edges")
     graphs.clear()
-    visited_edges.clear()
+    visited_store.clear(visited_store.get(user.id))
+
+
+class CachedGraph(BaseModel):
+    key: str
+    nodes: int
+    edges: int
+    megabytes: float
+    hits: int
+    loaded_at: datetime
+    last_used_at: datetime
+
+
+class GraphCacheResponse(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    megabytes: float
+    max_megabytes: float
+    graphs: list[CachedGraph]
+
+
+@router.get("/graphs", dependencies=[Depends(get_current_user)])
+def get_cached_graphs() -> GraphCacheResponse:
+    """Graph cache counters and resident graphs, least recently used first."""
+    return GraphCacheResponse(
+        hits=graphs.hits,
+        misses=graphs.misses,
+        evictions=graphs.evictions,
+        megabytes=graphs.nbytes / 1024**2,
+        max_megabytes=graphs.max_bytes / 1024**2,
+        graphs=[
+            CachedGraph(
+                key=entry.key,
+                nodes=entry.graph.number_of_nodes(),
+                edges=entry.graph.number_of_edges(),
+                megabytes=entry.nbytes / 1024**2,
+                hits=entry.hits,
+                loaded_at=entry.loaded_at,
+                last_used_at=entry.last_used_at,
+            )
+            for entry in graphs.entries()
+        ],
+    )
+
+
+def _load_graph_and_nodes(
+    nominatim_id: int,
+    start_x: float,
+    start_y: float,
+    end_x: float | None,
+    end_y: float | None,
+    bbox: BoundingBox | None,
+    distance: int,
+) -> tuple[MultiDiGraph, BBox, int, int | None]:
+    if bbox is not None:
+        G = get_or_create_graph(bbox=bbox)
+        CITY_BBOX = graph_bbox(bbox_to_tuple(bbox))
+    elif nominatim_id:
+        G = get_or_create_graph(nominatim_id=nominatim_id)
+        CITY_BBOX = graph_bbox(get_city_bbox())
+    else:
+        G = get_or_create_graph(
+            start_x, start_y, distance=distance, end_x=end_x, end_y=end_y
+        )
+        CITY_BBOX = graph_bbox(graph_area(start_x, start_y, distance, end_x, end_y))
+
+    if end_x and end_y:
+        start_node, end_node = nearest_nodes(G, [start_x, end_x], [start_y, end_y])
+    else:
+        start_node, end_node = nearest_nodes(G, [start_x], [start_y])[0], None
+    return G, CITY_BBOX, start_node, end_node
+
+
+async def _generate(
+    G: MultiDiGraph,
+    generator_class: type[RouteGenerator],
+    visited: VisitedEdges,
+    request: Request,
+    **kwargs,
+) -> list[int]:
+    """Run the generator in a worker process, or in a thread for unstored graphs.
+
+    A graph can be cached here but missing from the store, e.g. when saving
+    it failed; workers can't load it, so it is generated in a thread too.
+    """
+    try:
+        if "bbox" in G.graph and graph_store.contains(
+            G.graph["bbox"], G.graph["network_type"]
+        ):
+            job = RouteJob(
+                generator_class=generator_class,
+                bbox=G.graph["bbox"],
+                network_type=G.graph["network_type"],
+                visited=visited,
+                **kwargs,
+            )
+            try:
+                return await route_executor.run(job, request)
+            except GraphNotStored as e:
+                logger.warning("{}, generating the route in a thread", e)
+
+        return await run_in_threadpool(generator_class(G, visited).generate, **kwargs)
+    except NoRouteError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RouteBudgetExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RouteQueueFull:
+        raise HTTPException(
+            status_code=503, detail="Too many routes are being generated, retry later."
+        )
+    except RouteWorkerLost:
+        raise HTTPException(
+            status_code=503, detail="Route generation failed, retry later."
+        )
+    except RouteJobTimeout:
+        raise HTTPException(status_code=504, detail="Route generation took too long.")
+    except RouteJobCancelled:
+        raise HTTPException(status_code=499, detail="Client closed request.")
+
+
+def _build_route(
+    G: MultiDiGraph,
+    route: list[int],
+    visited: VisitedEdges,
+    CITY_BBOX: BBox,
+    algorithm_type: str,
+) -> Route:
+    x, y = utils.route_to_x_y(G, route)
+    route_distance = utils.get_route_distance(G, route)
+    segments = visited.get_visited_segments(G, route)
+    visited_store.mark_route(visited, route)
+
+    result = Route(
+        rec=CITY_BBOX,
+        x=x,
+        y=y,
+        distance=route_distance,
+        segments=segments,
+        elevation=[],
+        total_gain=0,
+        total_lose=0,
+    )
+    logger.info(
+        "Route generated: algorithm={} distance={:.0f}m new={:.0f}%",
+        algorithm_type,
+        route_distance,
+        result.percent_of_new,
+    )
+    return result
 
 
-@router.get("/route/{algorithm_type}")
-def route(
+@router.get("/route/{algorithm_type}", response_model=Route)
+async def route(
+    request: Request,
     algorithm_type: str,
     nominatim_id: int = 0,
     start_x: float = DEFAULT_START_X,
@@ -64,8 +261,11 @@ def route(
     distance: int = 6000,
     prefer_new: bool = False,
     skip_elevation: bool = True,
+    format: RouteFormat | None = None,
     elevation_service: ElevationService = Depends(get_elevation_service),
-) -> Route:
+    visited: VisitedEdges = Depends(get_visited),
+) -> Route | Response:
+    """A generated route, in the format asked for by ``format`` or Accept."""
     logger.info(
         "GET /route/{} start=({}, {}) distance={} prefer_new={}",
         algorithm_type,
@@ -75,26 +275,13 @@ def route(
         prefer_new,
     )
 
-    start_bbox = _build_bbox(
-        start_bbox_south, start_bbox_north, start_bbox_west, start_bbox_east
-    )
-    bbox = start_bbox
-
-    if bbox is not None:
-        G = get_or_create_graph(bbox=bbox)
-        CITY_BBOX = bbox_to_tuple(bbox)
-    elif nominatim_id:
-        G = get_or_create_graph(nominatim_id=nominatim_id)
-        CITY_BBOX = get_city_bbox(start_x, start_y)
-    else:
-        G = get_or_create_graph(start_x, start_y)
-        CITY_BBOX = get_city_bbox(start_x, start_y)
-
     algorithm_map = {
         "allstreet": AllStreetsRoute,
+        "allstreet-postman": ChinesePostmanRoute,
         "random": RandomRoute,
         "dfs": DfsRoute,
         "astar": AStarRoute,
+        "astar-alt": AStarLandmarkRoute,
     }
 
     generator_class = algorithm_map.get(algorithm_type.lower())
@@ -103,90 +290,106 @@ def route(
             status_code=422, detail=f"Unsupported algorithm type: {algorithm_type}"
         )
 
-    start_node = ox.nearest_nodes(G, X=start_x, Y=start_y)
-    if end_x and end_y:
-        end_node = ox.nearest_nodes(G, X=end_x, Y=end_y)
-    else:
-        end_node = None
+    start_bbox = _build_bbox(
+        start_bbox_south, start_bbox_north, start_bbox_west, start_bbox_east
+    )
+    G, CITY_BBOX, start_node, end_node = await run_in_threadpool(
+        _load_graph_and_nodes,
+        nominatim_id,
+        start_x,
+        start_y,
+        end_x,
+        end_y,
+        start_bbox,
+        distance,
+    )
 
     with utils.time_measure("Generating route took: "):
-        route = generator_class(G, visited_edges).generate(
+        route = await _generate(
+            G,
+            generator_class,
+            visited,
+            request,
             start_node=start_node,
             end_node=end_node,
             distance=distance,
             prefer_new=prefer_new,
         )
 
-    x, y = utils.route_to_x_y(G, route)
-    route_distance = utils.get_route_distance(G, route)
-    segments = visited_edges.get_visited_segments(G, route)
-    visited_edges.mark_edges_visited(route)
-    if skip_elevation:
-        elevation = []
-    else:
-        elevation = elevation_service.get(utils.zip_x_y(x, y))
-        elevation = elevation_service.covert_to_list(elevation)
-
-    total_gain, total_lose = elevation_service.calculate_total_gain_lose(elevation)
-
-    logger.info(
-        "Route generated: algorithm={} distance={:.0f}m new={:.0f}%",
+    fmt = negotiate_format(request.headers.get("accept"), format)
+    result = await run_in_threadpool(
+        _build_route,
+        G,
+        route,
+        visited,
+        CITY_BBOX,
         algorithm_type,
-        route_distance,
-        Route(
-            rec=CITY_BBOX,
-            x=x,
-            y=y,
-            distance=route_distance,
-            segments=segments,
-            elevation=elevation,
-            total_gain=total_gain,
-            total_lose=total_lose,
-        ).percent_of_new,
-    )
-    return Route(
-        rec=CITY_BBOX,
-        x=x,
-        y=y,
-        distance=route_distance,
-        segments=segments,
-        elevation=elevation,
-        total_gain=total_gain,
-        total_lose=total_lose,
     )
+    if not skip_elevation:
+        compiled = get_compiled_graph(G)
+        key = (G.graph["bbox"], G.graph["network_type"]) if "bbox" in G.graph else None
+        elevation = await get_edge_elevation(
+            compiled, elevation_service, graph_store, key
+        )
+        if elevation is not None:
+            edges = route_edges(compiled, route)
+            result.elevation = elevation.profile(compiled, edges)
+            result.total_gain, result.total_lose = elevation.totals(edges)
+    return route_response(result, fmt)
 
 
-@router.get("/visited-routes")
-def get_visited_edges() -> list[list[tuple[float, float]]]:
-    G = get_or_create_graph()
-    result = []
+def _visible_streets(
+    visited: VisitedEdges,
+    south: float | None,
+    north: float | None,
+    west: float | None,
+    east: float | None,
+) -> tuple[CompiledGraph, np.ndarray]:
+    """Visited streets of the default graph, only those in the bbox if given."""
+    compiled = get_compiled_graph(get_or_create_graph())
+    bbox = _build_bbox(south, north, west, east)
+    if bbox is None:
+        return compiled, visited.streets(compiled)
+    edges = get_spatial_index(compiled).edges_in_bbox(*bbox_to_tuple(bbox))
+    return compiled, visited.streets(compiled, edges)
 
-    for u, v in visited_edges:
-        # TODO remove this try, init-data logic for parsing route needs update
-        try:
-            data = min(G.get_edge_data(u, v).values(), key=lambda d: d["length"])
-            if "geometry" in data:
-                xs, ys = data["geometry"].xy
-                result.append([[y, x] for (x, y) in zip(xs, ys)])
-            else:
-                result.append(
-                    [
-                        [G.nodes[u]["y"], G.nodes[u]["x"]],
-                        [G.nodes[v]["y"], G.nodes[v]["x"]],
-                    ]
-                )
-        except Exception:
-            ...
-    return result
 
+@router.get("/visited-routes")
+def get_visited_edges(
+    visited: VisitedEdges = Depends(get_visited),
+    format: RouteFormat | None = None,
+    south: float | None = None,
+    north: float | None = None,
+    west: float | None = None,
+    east: float | None = None,
+) -> list[list[tuple[float, float]]] | list[str]:
+    """Geometry of the visited streets: [lat, lng] lists, or encoded polylines.
 
-@router.get("/visited-edges-as-points")
-def get_visited_edges_as_points() -> list[tuple[float, float]]:
-    G = get_or_create_graph()
+    With a full ``south``/``north``/``west``/``east`` bbox, only the streets
+    crossing it are returned.
+    """
+    compiled, edges = _visible_streets(visited, south, north, west, east)
     result = []
+    for edge in edges.tolist():
+        xs, ys = compiled.edge_geometry(edge)
+        if format == RouteFormat.polyline:
+            result.append(encode_polyline(ys, xs))
+        else:
+            result.append([[y, x] for (x, y) in zip(xs, ys)])
+    return result
 
-    for u, v in visited_edges:
-        result.append((G.nodes[u]["y"], G.nodes[u]["x"]))
-        result.append((G.nodes[v]["y"], G.nodes[v]["x"]))
 
-    return result
+@router.get("/visited-edges-as-points")
+def get_visited_edges_as_points(
+    visited: VisitedEdges = Depends(get_visited),
+    south: float | None = None,
+    north: float | None = None,
+    west: float | None = None,
+    east: float | None = None,
+) -> list[tuple[float, float]]:
+    """[lat, lng] of both ends of every visited street, optionally in a bbox."""
+    compiled, edges = _visible_streets(visited, south, north, west, east)
+    nodes = np.column_stack((compiled.sources[edges], compiled.targets[edges]))
+    return list(
+        zip(compiled.y[nodes].ravel().tolist(), compiled.x[nodes].ravel().tolist())
+    )
@@ -1,27 +1,89 @@
-import gpxpy
-import osmnx as ox
-from fastapi import APIRouter
-from loguru import logger
+import os
+from collections.abc import AsyncIterator
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from app.db import strava_db
-from app.models import StravaRoute
-from app.utils import ROOT_PATH, get_graph_distance
-from app.visited_edges import visited_edges
+from app.dependencies import get_strava_route_repository, get_visited
+from app.infrastructure.repositories.strava_route import MongoStravaRouteRepository
+from app.models import ImportJob, StravaRoute
+from app.settings import settings
+from app.strava_import import GpxImporter
+from app.utils import ROOT_PATH
+from app.visited_edges import VisitedEdges, visited_store
 
 from . import common
 
 router = APIRouter(prefix="/strava", tags=["Strava"])
 
 INIT_DATA_PATH = ROOT_PATH / "init_data"
+MAX_PAGE_SIZE = 1000
+
+gpx_importer = GpxImporter(
+    routes=strava_db["routes"],
+    jobs=strava_db["import_jobs"],
+    store_root=common.graph_store.root,
+    workers=settings.IMPORT_WORKERS or os.cpu_count() or 1,
+)
+
+
+class StravaRouteSummary(BaseModel):
+    id: int
+    type: str
+    name: str
+
+
+class StravaRoutePage(BaseModel):
+    items: list[StravaRouteSummary]
+    # Pass as ``after`` for the next page; None on the last one
+    next_cursor: int | None
 
 
 @router.get("/routes")
-def get_strava_routes() -> list[StravaRoute]:
-    collection = strava_db["routes"]
-    routes = collection.find()
-    result = [StravaRoute(**route) for route in routes]  # type: ignore[missing-argument]
-    return result
+async def get_strava_routes(
+    after: int | None = None,
+    limit: int = Query(default=100, ge=1, le=MAX_PAGE_SIZE),
+    routes: MongoStravaRouteRepository = Depends(get_strava_route_repository),
+) -> StravaRoutePage:
+    docs = await routes.page(after, limit)
+    return StravaRoutePage(
+        items=[StravaRouteSummary(**doc) for doc in docs],
+        next_cursor=docs[-1]["id"] if len(docs) == limit else None,
+    )
+
+
+@router.get("/routes/all")
+async def stream_strava_routes(
+    routes: MongoStravaRouteRepository = Depends(get_strava_route_repository),
+) -> StreamingResponse:
+    """Every route with coordinates, as one JSON array streamed route by route."""
+
+    async def body() -> AsyncIterator[bytes]:
+        yield b"["
+        first = True
+        async for doc in routes.stream():
+            if not first:
+                yield b","
+            first = False
+            yield StravaRoute(**doc).model_dump_json().encode()
+        yield b"]"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
+@router.get("/routes/{route_id}")
+async def get_strava_route(
+    route_id: int,
+    routes: MongoStravaRouteRepository = Depends(get_strava_route_repository),
+) -> StravaRoute:
+    doc = await routes.get(route_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Route not found.")
+    return StravaRoute(**doc)
 
 
 class MarkAsVisitedResponse(BaseModel):
@@ -31,121 +93,44 @@ class MarkAsVisitedResponse(BaseModel):
 
 
 @router.get("/mark-as-visited")
-def mark_as_visited() -> MarkAsVisitedResponse:
-    G = common.get_or_create_graph()
-
-    collection = strava_db["routes"]
-    routes = collection.find()
-    result = [StravaRoute(**route) for route in routes]  # type: ignore[missing-argument]
-    for strava_route in result:
-        visited_edges.mark_edges_visited(strava_route.nodes)
-
-    graph_distance = get_graph_distance(G)
-    visited_routes_distance = visited_edges.get_visited_distance(G)
-
+async def mark_as_visited(
+    visited: VisitedEdges = Depends(get_visited),
+    routes: MongoStravaRouteRepository = Depends(get_strava_route_repository),
+) -> MarkAsVisitedResponse:
+    G = await run_in_threadpool(common.get_or_create_graph)
+
+    # One union for all imported routes instead of one per route
+    pairs = []
+    async for nodes in routes.nodes():
+        if len(nodes) > 1:
+            nodes = np.asarray(nodes, dtype=np.int64)
+            pairs.append(np.column_stack((nodes[:-1], nodes[1:])))
+    if pairs:
+        await run_in_threadpool(visited_store.visit, visited, np.concatenate(pairs))
+
+    stats = await run_in_threadpool(visited.coverage_stats, G)
     return MarkAsVisitedResponse(
-        graph_distance=int(graph_distance),
-        visited_routes_distance=int(visited_routes_distance),
-        visited_percent=float(f"{visited_routes_distance / graph_distance * 100:.2f}"),
+        graph_distance=int(stats.total_distance),
+        visited_routes_distance=int(stats.visited_distance),
+        visited_percent=round(stats.visited_percent, 2),
     )
 
 
-class InitDataResponse(BaseModel):
-    inserted: list[int]
-    already_saved: list[int]
-    errors: dict[str, str]
+@router.post("/import", status_code=202)
+def start_import() -> ImportJob:
+    """Import ``init_data/*.gpx`` in the background; poll the job for progress."""
+    G = common.get_or_create_graph()
+    return gpx_importer.start(G, sorted(INIT_DATA_PATH.glob("*.gpx")))
 
 
-@router.get("/init-data")
-def load_init_data() -> InitDataResponse:
-    G = common.get_or_create_graph()
-    collection = strava_db["routes"]
-    collection.delete_many({})
-
-    saved_ids = {doc["id"] for doc in collection.find({}, {"id": 1, "_id": 0})}
-
-    already_saved: list[int] = []
-    inserted: list[int] = []
-    errors: dict[str, str] = {}
-
-    for path in sorted(INIT_DATA_PATH.glob("*.gpx")):
-        file_id = int(path.stem)
-        logger.info(f"Processing {file_id}.")
-
-        if file_id in saved_ids:
-            already_saved.append(file_id)
-            continue
-
-        try:
-            with path.open("r", encoding="utf-8") as f:
-                gpx = gpxpy.parse(f)
-
-            name = (
-                (gpx.name.strip() if gpx.name else None)
-                or next((t.name.strip() for t in gpx.tracks if t.name), None)
-                or next((r.name.strip() for r in gpx.routes if r.name), None)
-                or f"Route {file_id}"
-            )
-
-            points: list[tuple[float, float]] = []
-            if gpx.tracks:
-                for trk in gpx.tracks:
-                    for seg in trk.segments:
-                        for p in seg.points:
-                            points.append((float(p.longitude), float(p.latitude)))
-            elif gpx.routes:
-                for rte in gpx.routes:
-                    for p in rte.points:
-                        points.append((float(p.longitude), float(p.latitude)))
-            else:
-                raise ValueError("No tracks or routes found in GPX")
-
-            x: list[float] = []
-            y: list[float] = []
-            prev = None
-            for lon, lat in points:
-                pair = (lon, lat)
-                if pair != prev:
-                    x.append(lon)
-                    y.append(lat)
-                    prev = pair
-
-            if not x or not y:
-                raise ValueError("No coordinate points extracted from GPX")
-
-            nodes = ox.nearest_nodes(G, x, y)
-            nodes = list(dict.fromkeys(nodes))
-
-            filtered_nodes = []
-            _nodes = nodes[:]
-            current_node = _nodes.pop(0)
-            next_node = _nodes.pop(0)
-            while _nodes:
-                if G.get_edge_data(current_node, next_node):
-                    filtered_nodes.append(current_node)
-                    filtered_nodes.append(next_node)
-                    current_node = next_node
-                    if _nodes:
-                        next_node = _nodes.pop(0)
-                else:
-                    # TODO
-                    # Move tail few time (50?) until it finds edge otherwise move head
-                    current_node = next_node
-                    if _nodes:
-                        next_node = _nodes.pop(0)
-                    continue
-
-            doc = StravaRoute(
-                id=file_id, x=x, y=y, type="gpx", name=name, nodes=filtered_nodes
-            )
-            collection.insert_one(doc.model_dump())
-            inserted.append(file_id)
-
-        except Exception as e:
-            errors[str(file_id)] = f"{type(e).__name__}: {e}"
-
-    return InitDataResponse(
-        inserted=inserted,
-        already_saved=already_saved,
-        errors=errors,
-    )
+@router.get("/import/{job_id}")
+def get_import_job(job_id: str) -> ImportJob:
+    job = gpx_importer.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found.")
+    return job
+
+
+@router.get("/init-data", deprecated=True)
+def load_init_data() -> ImportJob:
+    return start_import()
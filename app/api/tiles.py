@@ -0,0 +1,47 @@
+from fastapi import APIRouter, Depends, HTTPException, Path
+from fastapi.responses import Response
+from loguru import logger
+
+from app.api.common import get_or_create_graph, graph_store
+from app.dependencies import get_visited
+from app.graph.compiled import get_compiled_graph
+from app.settings import settings
+from app.vector_tiles import MAX_ZOOM, TileCache, visited_tile
+from app.visited_edges import VisitedEdges
+
+router = APIRouter(prefix="/tiles", tags=["Tiles"])
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+tile_cache = TileCache(max_tiles=settings.TILE_CACHE_SIZE)
+
+
+@router.get("/visited/{z}/{x}/{y}.mvt")
+def get_visited_tile(
+    z: int = Path(ge=0, le=MAX_ZOOM),
+    x: int = Path(ge=0),
+    y: int = Path(ge=0),
+    visited: VisitedEdges = Depends(get_visited),
+) -> Response:
+    """Mapbox Vector Tile of the visited streets in one XYZ tile."""
+    if x >= 2**z or y >= 2**z:
+        raise HTTPException(status_code=404, detail="Tile out of range.")
+
+    G = get_or_create_graph()
+    compiled = get_compiled_graph(G)
+    if "bbox" in G.graph:
+        graph_key = graph_store.key(G.graph["bbox"], G.graph["network_type"])
+    else:
+        graph_key = str(id(compiled))
+
+    key = (graph_key, visited.key, z, x, y)
+    data = tile_cache.get(key, visited.version)
+    if data is None:
+        data = visited_tile(compiled, visited, z, x, y)
+        tile_cache.put(key, visited.version, data)
+        logger.debug("Rendered visited tile {}/{}/{}: {} bytes", z, x, y, len(data))
+
+    # Tiles change with every walked route; browsers must always revalidate
+    return Response(
+        data, media_type=MVT_MEDIA_TYPE, headers={"Cache-Control": "no-cache"}
+    )
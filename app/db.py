@@ -1,7 +1,7 @@
 from typing import AsyncIterator
 
 from loguru import logger
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import create_engine
@@ -12,6 +12,11 @@ from app.settings import settings
 logger.info("Connecting to MongoDB at {}", settings.MONGO_URL)
 client = MongoClient(settings.MONGO_URL)
 strava_db = client["strava_db"]
+# Request handlers read through this one, without holding a threadpool thread
+async_client = AsyncMongoClient(
+    settings.MONGO_URL, maxPoolSize=settings.MONGO_MAX_POOL_SIZE
+)
+async_strava_db = async_client["strava_db"]
 
 logger.info("Creating SQL engines: sync={}", settings.DB_CONNECTION_STR)
 engine = create_engine(settings.DB_CONNECTION_STR, echo=False)
@@ -5,12 +5,14 @@ from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from loguru import logger
 
-from app.db import async_session
+from app.db import async_session, async_strava_db
 from app.domain.ports import UnitOfWork
+from app.infrastructure.repositories.strava_route import MongoStravaRouteRepository
 from app.infrastructure.uow import SqlAlchemyUoW
 from app.jwt import decode_jwt
 from app.models import UserModel
 from app.settings import settings
+from app.visited_edges import VisitedEdges, visited_store
 
 # TODO remove it from there
 ACCESS_COOKIE_NAME = "access_token"
@@ -81,3 +83,25 @@ async def get_current_user(
 
     logger.debug("Auth: user {} authenticated successfully", user_id)
     return user
+
+
+async def get_optional_user(
+    request: Request,
+    bearer_token: Optional[str] = Depends(oauth2_scheme),
+    uow: UnitOfWork = Depends(get_uow),
+) -> Optional[UserModel]:
+    """The authenticated user, or None when the request carries no token."""
+    if not (bearer_token or request.cookies.get(ACCESS_COOKIE_NAME)):
+        return None
+    return await get_current_user(request, bearer_token, uow)
+
+
+def get_visited(
+    user: Optional[UserModel] = Depends(get_optional_user),
+) -> VisitedEdges:
+    """Visited edges of the current user; anonymous requests share one set."""
+    return visited_store.get(user.id if user else None)
+
+
+def get_strava_route_repository() -> MongoStravaRouteRepository:
+    return MongoStravaRouteRepository(async_strava_db["routes"])
@@ -6,6 +6,9 @@ from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 from redis import asyncio as aioredis
 
+from app.api.common import route_executor
+from app.db import async_client
+from app.services.elevation import close_elevation_backend
 from app.settings import settings
 
 
@@ -14,3 +17,6 @@ async def lifespan(_: FastAPI) -> AsyncIterator[None]:
     redis = aioredis.from_url(settings.REDIS_URL)
     FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
     yield
+    route_executor.shutdown()
+    await close_elevation_backend()
+    await async_client.close()
@@ -1,54 +1,78 @@
+import heapq
 import math
+from collections.abc import Iterator
 from dataclasses import dataclass
 
 import networkx as nx
+import numpy as np
 from loguru import logger
 
 from app.generator.base import RouteGenerator
+from app.graph.compiled import CompiledGraph
 from app.visited_edges import VisitedEdges
 
 
-def _bearing(graph: nx.MultiDiGraph, u: int, v: int) -> float:
-    """Compass-ish bearing (radians) of the edge u -> v from node coordinates."""
-    x1, y1 = graph.nodes[u]["x"], graph.nodes[u]["y"]
-    x2, y2 = graph.nodes[v]["x"], graph.nodes[v]["y"]
-    return math.atan2(y2 - y1, x2 - x1)
-
-
 def _angle_diff(a: float, b: float) -> float:
     """Smallest absolute angle between two bearings (radians, 0..pi)."""
     d = abs(a - b) % (2 * math.pi)
     return min(d, 2 * math.pi - d)
 
 
+class UnvisitedEdges:
+    """Unvisited edge ids plus a running count of unvisited out-edges per node.
+
+    The counts tell in O(1) whether a node still has streets to walk, so
+    recovery never has to rescan all remaining edges.
+    """
+
+    def __init__(self, graph: CompiledGraph) -> None:
+        self._graph = graph
+        self._flags = bytearray(b"\x01") * graph.num_edges
+        self._count = graph.num_edges
+        self.degree: list[int] = np.diff(graph.offsets).tolist()
+
+    def __contains__(self, edge: int) -> bool:
+        return self._flags[edge] == 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[int]:
+        return (e for e, unvisited in enumerate(self._flags) if unvisited)
+
+    def discard(self, edge: int) -> None:
+        if self._flags[edge]:
+            self._flags[edge] = 0
+            self._count -= 1
+            self.degree[self._graph.source(edge)] -= 1
+
+
 def remove_edge_both_directions(
-    graph: nx.MultiDiGraph,
-    unvisited_edges: set[tuple[int, int, int]],
-    u: int,
-    v: int,
+    graph: CompiledGraph,
+    unvisited_edges: UnvisitedEdges,
+    edge: int,
 ) -> None:
-    """Mark the street between u and v covered in *both* directions.
+    """Mark the street behind ``edge`` covered in *both* directions.
 
     In an OSMnx drive graph a two-way street is two directed edges,
     (u, v, k) and (v, u, k). Driving it once physically covers the street,
-    so we drop every parallel edge between u and v regardless of direction;
-    otherwise the reverse edge lingers as "unvisited" and the walk later
-    deadheads back over a street it already drove.
+    so we drop the reverse edge too; otherwise it lingers as "unvisited" and
+    the walk later deadheads back over a street it already drove. Parallel
+    edges are already collapsed in the compiled graph.
     """
-    for a, b in ((u, v), (v, u)):
-        data = graph.get_edge_data(a, b)
-        if data:
-            for k in data:
-                unvisited_edges.discard((a, b, k))
+    unvisited_edges.discard(edge)
+    reverse = graph.reverse_edge(edge)
+    if reverse >= 0:
+        unvisited_edges.discard(reverse)
 
 
 def choose_next_edge(
-    graph: nx.MultiDiGraph,
+    graph: CompiledGraph,
     current: int,
-    outgoing: list[tuple[int, int, int]],
-    previous_edge: tuple[int, int, int] | None,
-    unvisited_edges: set[tuple[int, int, int]],
-) -> tuple[int, int, int]:
+    outgoing: list[int],
+    previous_edge: int | None,
+    unvisited_edges: UnvisitedEdges,
+) -> int:
     """Pick the next unvisited outgoing edge.
 
     Heuristic (in priority order):
@@ -62,30 +86,30 @@ def choose_next_edge(
     candidates = outgoing
 
     if len(candidates) > 1 and previous_edge is not None:
-        prev_node = previous_edge[0]
-        no_uturn = [e for e in candidates if e[1] != prev_node]
+        prev_node = graph.source(previous_edge)
+        no_uturn = [e for e in candidates if graph.target(e) != prev_node]
         if no_uturn:
             candidates = no_uturn
 
     if len(candidates) == 1:
         return candidates[0]
 
-    def onward_count(edge: tuple[int, int, int]) -> int:
-        target = edge[1]
+    def onward_count(edge: int) -> int:
+        target = graph.target(edge)
         return sum(
             1
-            for oe in graph.out_edges(target, keys=True)
-            if oe in unvisited_edges and oe[1] != current
+            for oe in graph.out_edges(target)
+            if oe in unvisited_edges and graph.target(oe) != current
         )
 
     incoming_bearing = None
     if previous_edge is not None:
-        incoming_bearing = _bearing(graph, previous_edge[0], previous_edge[1])
+        incoming_bearing = graph.bearing(previous_edge)
 
-    def turn_penalty(edge: tuple[int, int, int]) -> float:
+    def turn_penalty(edge: int) -> float:
         if incoming_bearing is None:
             return 0.0
-        return _angle_diff(incoming_bearing, _bearing(graph, current, edge[1]))
+        return _angle_diff(incoming_bearing, graph.bearing(edge))
 
     # Maximise onward options first, then prefer the straightest continuation.
     return max(
@@ -99,6 +123,49 @@ class AllStreetsRoute(RouteGenerator):
     graph: nx.MultiDiGraph
     v_edges: VisitedEdges
 
+    def _path_to_unvisited(
+        self, source: int, unvisited_edges: UnvisitedEdges
+    ) -> list[int] | None:
+        """Shortest path (by length) to the nearest node with unvisited edges.
+
+        Dijkstra from ``source`` that stops at the first settled node whose
+        unvisited out-degree is non-zero.
+        """
+        compiled = self.compiled
+        offsets, targets, lengths = (
+            compiled._offsets,
+            compiled._targets,
+            compiled._lengths,
+        )
+        degree = unvisited_edges.degree
+
+        dist = {source: 0.0}
+        parent = {source: source}
+        heap = [(0.0, source)]
+        settled: set[int] = set()
+        checkpoint = self.checkpoint
+        while heap:
+            checkpoint()
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if degree[u]:
+                path = [u]
+                while u != source:
+                    u = parent[u]
+                    path.append(u)
+                path.reverse()
+                return path
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + lengths[e]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    parent[v] = u
+                    heapq.heappush(heap, (nd, v))
+        return None
+
     def generate(
         self,
         start_node: int,
@@ -112,40 +179,38 @@ class AllStreetsRoute(RouteGenerator):
         ignored_nodes: list[int] | None = None,
         middle_nodes: list[int] | None = None,
     ) -> list[int]:
+        compiled = self.compiled
         logger.info(
             "AllStreets start={} distance={} unvisited={}",
             start_node,
             distance,
-            len(self.graph.edges(keys=True)),
+            compiled.num_edges,
         )
 
-        unvisited_edges = set(self.graph.edges(keys=True))
+        unvisited_edges = UnvisitedEdges(compiled)
 
-        route: list[int] = [start_node]
-        current = start_node
-        previous_edge = None  # Track the actual edge we came from (u, v, k)
+        current = compiled.dense(start_node)
+        route: list[int] = [current]
+        previous_edge = None  # Track the actual edge we came from
 
         while unvisited_edges:
+            self.checkpoint()
             logger.debug(
                 "AllStreets at node={}, unvisited={}, route_len={}",
                 current,
                 len(unvisited_edges),
                 len(route),
             )
-            outgoing = [
-                e for e in self.graph.neighbors(current) if e in unvisited_edges
-            ]
+            outgoing = [e for e in compiled.out_edges(current) if e in unvisited_edges]
 
             if outgoing:
                 chosen_edge = choose_next_edge(
-                    self.graph, current, outgoing, previous_edge, unvisited_edges
+                    compiled, current, outgoing, previous_edge, unvisited_edges
                 )
-                next_node = chosen_edge[1]
+                next_node = compiled.target(chosen_edge)
 
                 # Mark the street visited in both directions
-                remove_edge_both_directions(
-                    self.graph, unvisited_edges, current, next_node
-                )
+                remove_edge_both_directions(compiled, unvisited_edges, chosen_edge)
 
                 route.append(next_node)
                 previous_edge = chosen_edge  # Remember the edge we just took
@@ -155,44 +220,9 @@ class AllStreetsRoute(RouteGenerator):
                 # RECOVERY STEP: We are stuck. All immediate streets are visited,
                 # but 'unvisited_edges' is not empty. We must "deadhead".
 
-                # Identify all nodes in the graph that still have unvisited outgoing streets
-                nodes_with_unvisited = {e[0] for e in unvisited_edges}
-
-                try:
-                    # Find the shortest path lengths from 'current' to all other nodes
-                    lengths = nx.single_source_shortest_path_length(self.graph, current)
-
-                    # Filter for only the nodes that have unvisited streets, and find the closest one
-                    closest_recovery_node = min(
-                        (n for n in nodes_with_unvisited if n in lengths),
-                        key=lambda n: lengths[n],
-                    )
-
-                    # Calculate the actual path to get to that closest node
-                    recovery_path = nx.shortest_path(
-                        self.graph, source=current, target=closest_recovery_node
-                    )
-
-                    # Add the recovery path to our route (skip index 0 as it's our 'current' node)
-                    route.extend(recovery_path[1:])
-                    for i in range(len(recovery_path) - 1):
-                        u, v = recovery_path[i], recovery_path[i + 1]
-                        remove_edge_both_directions(self.graph, unvisited_edges, u, v)
-
-                    # Track the last edge in the recovery path
-                    if len(recovery_path) >= 2:
-                        u, v = recovery_path[-2], recovery_path[-1]
-                        edge_data = self.graph.get_edge_data(u, v)
-                        if edge_data:
-                            k = list(edge_data.keys())[0]
-                            previous_edge = (u, v, k)
-                        else:
-                            previous_edge = None
-                    else:
-                        previous_edge = None
-                    current = closest_recovery_node
-
-                except ValueError:
+                # Walk to the closest node that still has unvisited outgoing streets
+                recovery_path = self._path_to_unvisited(current, unvisited_edges)
+                if recovery_path is None:
                     logger.warning(
                         "AllStreets cannot recover at node={}, {} unvisited remain",
                         current,
@@ -200,9 +230,18 @@ class AllStreetsRoute(RouteGenerator):
                     )
                     break
 
+                # Add the recovery path to our route (skip index 0 as it's our 'current' node)
+                route.extend(recovery_path[1:])
+                for u, v in zip(recovery_path, recovery_path[1:]):
+                    previous_edge = compiled.edge_id(u, v)
+                    remove_edge_both_directions(
+                        compiled, unvisited_edges, previous_edge
+                    )
+                current = recovery_path[-1]
+
         logger.info(
             "AllStreets done: route={} nodes, visited={} edges",
             len(route),
-            len(self.graph.edges(keys=True)) - len(unvisited_edges),
+            compiled.num_edges - len(unvisited_edges),
         )
-        return route
+        return compiled.to_osm(route)
@@ -1,41 +1,24 @@
 import heapq
 from dataclasses import dataclass
-from math import atan2, cos, radians, sin, sqrt
+from typing import ClassVar
 
 import networkx as nx
+import numpy as np
 from loguru import logger
 
-from app import utils
-from app.generator.base import RouteGenerator
+from app.generator.base import NoRouteError, RouteGenerator
+from app.graph.landmarks import get_landmarks
 from app.visited_edges import VisitedEdges
 
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000  # promień Ziemi w metrach
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = (
-        sin(dlat / 2) ** 2
-        + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-    )
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return R * c
-
-
-def heuristic(graph: nx.MultiDiGraph, a: int, b: int) -> float:
-    # Uwaga: w OSMnx x=lon, y=lat. Haversine(lat, lon, ...)
-    lon1 = graph.nodes[a]["x"]
-    lat1 = graph.nodes[a]["y"]
-    lon2 = graph.nodes[b]["x"]
-    lat2 = graph.nodes[b]["y"]
-    return haversine(lat1, lon1, lat2, lon2)
-
-
 @dataclass
 class AStarRoute(RouteGenerator):
     graph: nx.MultiDiGraph
     v_edges: VisitedEdges
 
+    # Guide the search with landmark (ALT) bounds instead of straight-line ones
+    use_landmarks: ClassVar[bool] = False
+
     def _reconstruct_path(self, came_from: dict[int, int], current: int) -> list[int]:
         path = [current]
         while current in came_from:
@@ -45,10 +28,49 @@ class AStarRoute(RouteGenerator):
         return path
 
     def _segment_distance(self, path: list[int]) -> float:
-        dist = 0.0
-        for u, v in zip(path, path[1:]):
-            dist += utils.get_distance_between(self.graph, u, v)
-        return dist
+        return self.compiled.path_length(path)
+
+    def _lower_bounds(self, t: int) -> list[float]:
+        """Lower bound of the distance from every node to ``t``."""
+        bounds = self.compiled.distances_to(t)
+        if self.use_landmarks:
+            bounds = np.maximum(bounds, get_landmarks(self.compiled).lower_bounds(t))
+        return bounds.tolist()
+
+    def _neighbour_edges(
+        self,
+        u: int,
+        prev: int | None,
+        prefer_new: bool,
+        prefer_new_v2: bool,
+        ignored_edges: set[tuple[int, int]],
+        ignored_nodes: set[int],
+    ) -> list[tuple[int, float]]:
+        """(neighbour, edge length) pairs of ``u`` that the search may take."""
+        compiled = self.compiled
+        if prefer_new or prefer_new_v2:
+            # Visited-edge preferences only change the order of equal-cost paths
+            # (or, for v2, prune to the two least visited streets).
+            neighbors = self.get_neighbours_and_sort(
+                u,
+                prefer_new,
+                [prev] if prev is not None else None,
+                v2=prefer_new_v2,
+                ignored_edges=ignored_edges,
+                ignored_nodes=ignored_nodes,
+            )
+            if prefer_new_v2:
+                neighbors = neighbors[:2]
+            return [(v, compiled.length(u, v)) for v in neighbors]
+
+        targets, lengths = compiled._targets, compiled._lengths
+        return [
+            (targets[e], lengths[e])
+            for e in compiled.out_edges(u)
+            if targets[e] not in ignored_nodes
+            and (u, targets[e]) not in ignored_edges
+            and (targets[e], u) not in ignored_edges
+        ]
 
     def _astar_segment(
         self,
@@ -57,49 +79,53 @@ class AStarRoute(RouteGenerator):
         max_remaining: float,
         prefer_new: bool,
         prefer_new_v2: bool,
-        ignored_edges: list[tuple[int, int]],
-        ignored_nodes: list[int],
+        ignored_edges: set[tuple[int, int]],
+        ignored_nodes: set[int],
     ) -> list[int]:
-        open_set: list[tuple[float, int]] = []
-        heapq.heappush(open_set, (heuristic(self.graph, s, t), s))
+        bound = self._lower_bounds(t)
+        open_set: list[tuple[float, int]] = [(bound[s], s)]
 
         came_from: dict[int, int] = {}
         g_score: dict[int, float] = {s: 0.0}
+        # Both bounds are consistent, so a node popped once is settled for good
+        closed: set[int] = set()
 
+        checkpoint = self.checkpoint
         while open_set:
+            checkpoint()
             _, u = heapq.heappop(open_set)
+            if u in closed:
+                continue  # stale entry left behind by a later improvement
 
             if u == t:
                 return self._reconstruct_path(came_from, u)
+            closed.add(u)
 
-            prev = came_from.get(u)
-
-            neighbors = self.get_neighbours_and_sort(
+            g_u = g_score[u]
+            for v, length in self._neighbour_edges(
                 u,
+                came_from.get(u),
                 prefer_new,
-                [prev] if prev is not None else None,
-                v2=prefer_new_v2,
-                ignored_edges=ignored_edges,
-                ignored_nodes=ignored_nodes,
-            )
-            if prefer_new_v2:
-                neighbors = neighbors[:2]
-
-            for v in neighbors:
-                tentative_g = g_score[u] + utils.get_distance_between(self.graph, u, v)
-                if tentative_g > max_remaining:
+                prefer_new_v2,
+                ignored_edges,
+                ignored_nodes,
+            ):
+                if v in closed:
+                    continue
+                tentative_g = g_u + length
+                # Can't reach t from v within the budget, even in a straight line
+                if tentative_g + bound[v] > max_remaining:
                     continue
 
                 if tentative_g < g_score.get(v, float("inf")):
                     came_from[v] = u
                     g_score[v] = tentative_g
-                    f = tentative_g + heuristic(self.graph, v, t)
-                    heapq.heappush(open_set, (f, v))
+                    heapq.heappush(open_set, (tentative_g + bound[v], v))
 
         logger.warning(
             "A* no path for segment {} -> {} (budget {:.1f}m)", s, t, max_remaining
         )
-        raise Exception(f"Brak ścieżki dla odcinka {s} -> {t} (limit długości?).")
+        raise NoRouteError(f"Brak ścieżki dla odcinka {s} -> {t} (limit długości?).")
 
     def generate(
         self,
@@ -114,9 +140,10 @@ class AStarRoute(RouteGenerator):
         ignored_nodes: list[int] | None = None,
         middle_nodes: list[int] | None = None,
     ) -> list[int]:
-        ignored_edges = ignored_edges or []
-        ignored_nodes = ignored_nodes or []
-        middle_nodes = middle_nodes or []
+        compiled = self.compiled
+        blocked_edges = compiled.dense_edges(ignored_edges or [])
+        blocked_nodes = compiled.dense_nodes(ignored_nodes or [])
+        middle_nodes = [compiled.dense(n) for n in middle_nodes or []]
 
         min_length, max_length = self.calculate_min_max_length(tolerance, distance)
         logger.info(
@@ -130,15 +157,15 @@ class AStarRoute(RouteGenerator):
 
         targets: list[int] = middle_nodes[:]
         if end_node is not None:
-            targets.append(end_node)
+            targets.append(compiled.dense(end_node))
 
-        route: list[int] = [start_node]
+        route: list[int] = [compiled.dense(start_node)]
         used = 0.0
 
         for t in targets:
             max_remaining = max_length - used
             if max_remaining <= 0:
-                raise Exception(
+                raise NoRouteError(
                     "Przekroczony maksymalny dozwolony dystans (max_length)."
                 )
 
@@ -148,8 +175,8 @@ class AStarRoute(RouteGenerator):
                 max_remaining,
                 prefer_new=prefer_new,
                 prefer_new_v2=prefer_new_v2,
-                ignored_edges=ignored_edges,
-                ignored_nodes=ignored_nodes,
+                ignored_edges=blocked_edges,
+                ignored_nodes=blocked_nodes,
             )
 
             if route[-1] == seg[0]:
@@ -166,4 +193,11 @@ class AStarRoute(RouteGenerator):
             )
 
         logger.info("A* route generated: {} nodes, {:.1f}m", len(route), used)
-        return route
+        return compiled.to_osm(route)
+
+
+@dataclass
+class AStarLandmarkRoute(AStarRoute):
+    """A* with landmark (ALT) lower bounds, for routes across large graphs."""
+
+    use_landmarks: ClassVar[bool] = True
@@ -1,13 +1,27 @@
 import random
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from functools import cached_property
 
 import networkx as nx
-from loguru import logger
 
+from app.graph.compiled import CompiledGraph, get_compiled_graph
 from app.visited_edges import VisitedEdges
 
 
+class NoRouteError(Exception):
+    """No route can satisfy the request on this graph."""
+
+
+class RouteBudgetExceeded(Exception):
+    """The generator ran out of time or steps before finding a route."""
+
+
+def _no_checkpoint() -> None:
+    pass
+
+
 def keep_largest_component(graph: nx.MultiDiGraph) -> nx.MultiDiGraph:
     components = list(nx.weakly_connected_components(graph))
     if not components:
@@ -23,8 +37,22 @@ def remove_isolated_nodes(graph: nx.MultiDiGraph):
 
 @dataclass
 class RouteGenerator(ABC):
+    """Base for route generators.
+
+    ``generate`` takes and returns OSM node ids; everything below it walks
+    ``self.compiled`` and works on its dense node ids.
+
+    Search loops call ``checkpoint`` on every step; the route executor passes
+    one that raises when the job is cancelled or over time, so jobs stop
+    between steps rather than at an arbitrary point.
+    """
+
     graph: nx.MultiDiGraph
     v_edges: VisitedEdges
+    compiled: CompiledGraph = field(init=False, repr=False)
+    checkpoint: Callable[[], None] = field(
+        default=_no_checkpoint, repr=False, compare=False
+    )
 
     @abstractmethod
     def generate(
@@ -42,20 +70,14 @@ class RouteGenerator(ABC):
     ) -> list[int]: ...
 
     def __post_init__(self):
-        logger.info(
-            "Preprocessing graph: {} nodes, {} edges",
-            self.graph.number_of_nodes(),
-            self.graph.number_of_edges(),
-        )
+        # Shared graphs are pruned once when cached (see prepare_graph); the
+        # graph itself is never modified here, only read.
+        self.compiled = get_compiled_graph(self.graph)
 
-        remove_isolated_nodes(self.graph)
-        # self.graph = keep_largest_component(self.graph)
-
-        logger.info(
-            "Graph after preprocessing: {} nodes, {} edges",
-            self.graph.number_of_nodes(),
-            self.graph.number_of_edges(),
-        )
+    @cached_property
+    def visits(self) -> list[int]:
+        """How many times every edge's street was walked before, by edge id."""
+        return self.v_edges.edge_visits(self.compiled).tolist()
 
     def calculate_min_max_length(self, tolerance, distance) -> tuple[float, float]:
         min_length = distance * (1 - tolerance)
@@ -68,7 +90,7 @@ class RouteGenerator(ABC):
         exclude = exclude or []
         neighbors = [
             neighbor
-            for neighbor in self.graph.neighbors(current_node)
+            for neighbor in self.compiled.successors(current_node)
             if neighbor not in exclude
         ]
         return neighbors
@@ -82,28 +104,15 @@ class RouteGenerator(ABC):
         if not prefer_new:
             return n
 
-        n.sort(
-            key=lambda node: (current_node, node) not in self.v_edges
-            and (node, current_node) not in self.v_edges,
-            reverse=True,
-        )
+        visits, edge_id = self.visits, self.compiled.edge_id
+        n.sort(key=lambda node: not visits[edge_id(current_node, node)], reverse=True)
         return n
 
     def sort_by_occurrance(self, neighbors: list[int], current_node: int) -> list[int]:
         n = neighbors.copy()
         random.shuffle(n)
-
-        def _sort(node: int):
-            if (current_node, node) in self.v_edges:
-                v = self.v_edges[current_node, node]
-            elif (node, current_node) in self.v_edges:
-                v = self.v_edges[node, current_node]
-            else:
-                v = 0
-
-            return v
-
-        n.sort(key=_sort)
+        visits, edge_id = self.visits, self.compiled.edge_id
+        n.sort(key=lambda node: visits[edge_id(current_node, node)])
         return n
 
     def get_neighbours_and_sort(
@@ -112,8 +121,8 @@ class RouteGenerator(ABC):
         prefer_new,
         exclude,
         v2,
-        ignored_edges,
-        ignored_nodes: list[int],
+        ignored_edges: set[tuple[int, int]],
+        ignored_nodes: set[int],
     ):
         neighbors = self.get_neighbours(current_node, exclude)
 
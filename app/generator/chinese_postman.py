@@ -0,0 +1,235 @@
+from dataclasses import dataclass
+
+import networkx as nx
+import numpy as np
+from loguru import logger
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+from app.generator.base import NoRouteError, RouteGenerator
+from app.graph.compiled import CompiledGraph
+from app.visited_edges import VisitedEdges
+
+# Blossom matching is cubic; above this many odd nodes pair them greedily
+EXACT_MATCHING_LIMIT = 300
+# Candidate partners per odd node, searched for within this many meters first
+MATCHING_CANDIDATES = 8
+MATCHING_RADIUS = 1000.0
+DIJKSTRA_CHUNK = 64
+
+
+def street_matrix(compiled: CompiledGraph) -> tuple[csr_array, np.ndarray]:
+    """Undirected street graph: one entry per street, both directions merged.
+
+    Returns the symmetric length matrix and the (k, 3) array of streets
+    ``(a, b, length)`` with ``a <= b``.
+    """
+    n = compiled.num_nodes
+    u, v = compiled.sources.astype(np.int64), compiled.targets.astype(np.int64)
+    a, b = np.minimum(u, v), np.maximum(u, v)
+    # Shortest direction first, then keep one entry per street
+    order = np.lexsort((compiled.lengths, a * n + b))
+    keys = (a * n + b)[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    keep = order[first]
+    streets = np.column_stack((a[keep], b[keep], compiled.lengths[keep]))
+
+    rows = np.concatenate((streets[:, 0], streets[:, 1])).astype(np.int64)
+    cols = np.concatenate((streets[:, 1], streets[:, 0])).astype(np.int64)
+    data = np.maximum(np.concatenate((streets[:, 2], streets[:, 2])), 1e-6)
+    return csr_array((data, (rows, cols)), shape=(n, n)), streets
+
+
+def _candidate_pairs(
+    matrix: csr_array, odd: np.ndarray, radius: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Each odd node with its nearest odd nodes within ``radius``: (a, b, distance).
+
+    ``a`` and ``b`` index into ``odd``.
+    """
+    k = min(MATCHING_CANDIDATES, len(odd) - 1)
+    rows, columns, distances = [], [], []
+    for start in range(0, len(odd), DIJKSTRA_CHUNK):
+        chunk = odd[start : start + DIJKSTRA_CHUNK]
+        to_odd = dijkstra(matrix, directed=False, indices=chunk, limit=radius)
+        to_odd = to_odd[:, odd]
+        # Column 0 is the node itself
+        nearest = np.argsort(to_odd, axis=1)[:, 1 : k + 1]
+        rows.append(np.repeat(np.arange(start, start + len(chunk)), k))
+        columns.append(nearest.ravel())
+        distances.append(np.take_along_axis(to_odd, nearest, axis=1).ravel())
+    rows, columns, distances = map(np.concatenate, (rows, columns, distances))
+    finite = np.isfinite(distances)
+    return rows[finite], columns[finite], distances[finite]
+
+
+def _greedy_matching(matrix: csr_array, odd: np.ndarray) -> list[tuple[int, int]]:
+    """Pair odd nodes shortest candidate pair first, retrying leftovers.
+
+    Leftovers with no odd node within the search radius get a wider one.
+    """
+    pairs: list[tuple[int, int]] = []
+    remaining = odd
+    radius = MATCHING_RADIUS
+    while len(remaining):
+        rows, columns, distances = _candidate_pairs(matrix, remaining, radius)
+        matched = np.zeros(len(remaining), dtype=bool)
+        for i in np.argsort(distances, kind="stable").tolist():
+            a, b = rows[i], columns[i]
+            if matched[a] or matched[b]:
+                continue
+            matched[a] = matched[b] = True
+            pairs.append((int(remaining[a]), int(remaining[b])))
+
+        if not matched.any():
+            if np.isinf(radius):
+                raise NoRouteError("Odd-degree nodes can't be paired on this graph.")
+            radius = radius * 4 if len(pairs) else np.inf
+        remaining = remaining[~matched]
+    return pairs
+
+
+def match_odd_nodes(matrix: csr_array, odd: np.ndarray) -> list[tuple[int, int]]:
+    """Pair odd-degree nodes so the total shortest-path distance is small.
+
+    Up to ``EXACT_MATCHING_LIMIT`` nodes get a min-weight perfect matching
+    over each node's ``MATCHING_CANDIDATES`` nearest odd nodes, which on
+    street networks is practically always the optimum over all pairs. Nodes
+    left without a partner, and everything above the limit, are paired
+    greedily.
+    """
+    if not len(odd):
+        return []
+    if len(odd) > EXACT_MATCHING_LIMIT:
+        return _greedy_matching(matrix, odd)
+
+    rows, columns, distances = _candidate_pairs(matrix, odd, MATCHING_RADIUS)
+    candidates = nx.Graph()
+    candidates.add_weighted_edges_from(
+        zip(odd[rows].tolist(), odd[columns].tolist(), distances.tolist())
+    )
+    pairs = [(int(a), int(b)) for a, b in nx.min_weight_matching(candidates)]
+
+    matched = {node for pair in pairs for node in pair}
+    leftover = np.array([node for node in odd.tolist() if node not in matched])
+    return pairs + (_greedy_matching(matrix, leftover) if len(leftover) else [])
+
+
+def _path(predecessors: np.ndarray, source: int, target: int) -> list[int]:
+    """Walk ``predecessors`` (of a Dijkstra from ``source``) back from ``target``."""
+    path = [target]
+    while path[-1] != source:
+        previous = predecessors[path[-1]]
+        if previous < 0:
+            raise NoRouteError(f"No path between {source} and {target}.")
+        path.append(int(previous))
+    path.reverse()
+    return path
+
+
+@dataclass
+class ChinesePostmanRoute(RouteGenerator):
+    """Walks every street of the start's component, with minimal repetition.
+
+    Solves the (undirected) route inspection problem: odd-degree nodes are
+    paired by shortest-path distance, the streets on those paths are doubled,
+    and the now Eulerian street graph is walked along an Euler circuit. A
+    step against a one-way street is replaced by the shortest legal detour.
+    """
+
+    graph: nx.MultiDiGraph
+    v_edges: VisitedEdges
+
+    def _detours(
+        self, steps: list[tuple[int, int]]
+    ) -> dict[tuple[int, int], list[int]]:
+        """Shortest legal paths for steps ``u -> v`` against one-way streets."""
+        compiled = self.compiled
+        n = compiled.num_nodes
+        # csgraph may drop explicit zeros, which would disconnect the graph
+        weights = np.maximum(compiled.lengths, 1e-6)
+        matrix = csr_array((weights, compiled.targets, compiled.offsets), (n, n))
+
+        sources = sorted({u for u, _ in steps})
+        detours = {}
+        for start in range(0, len(sources), DIJKSTRA_CHUNK):
+            self.checkpoint()
+            chunk = sources[start : start + DIJKSTRA_CHUNK]
+            _, predecessors = dijkstra(matrix, indices=chunk, return_predecessors=True)
+            rows = dict(zip(chunk, predecessors))
+            for u, v in steps:
+                if u in rows:
+                    detours[(u, v)] = _path(rows[u], u, v)
+        return detours
+
+    def generate(
+        self,
+        start_node: int,
+        end_node: int | None = None,
+        distance: int = 6000,
+        tolerance: float = 0.15,
+        prefer_new: bool = False,
+        prefer_new_v2: bool = False,
+        depth_limit: int = 100,
+        ignored_edges: list[tuple[int, int]] | None = None,
+        ignored_nodes: list[int] | None = None,
+        middle_nodes: list[int] | None = None,
+    ) -> list[int]:
+        compiled = self.compiled
+        source = compiled.dense(start_node)
+        matrix, streets = street_matrix(compiled)
+
+        _, labels = connected_components(matrix, directed=False)
+        streets = streets[labels[streets[:, 0].astype(np.int64)] == labels[source]]
+        if not len(streets):
+            return [start_node]
+
+        a = streets[:, 0].astype(np.int64)
+        b = streets[:, 1].astype(np.int64)
+        degree = np.bincount(np.concatenate((a, b)), minlength=compiled.num_nodes)
+        odd = np.flatnonzero(degree % 2)
+        logger.info(
+            "ChinesePostman start={} streets={} odd_nodes={}",
+            start_node,
+            len(streets),
+            len(odd),
+        )
+
+        multigraph = nx.MultiGraph()
+        multigraph.add_edges_from(zip(a.tolist(), b.tolist()))
+        # Walking the shortest path between each matched pair a second time
+        # makes every node even, i.e. the street graph Eulerian.
+        pairs = match_odd_nodes(matrix, odd)
+        for start in range(0, len(pairs), DIJKSTRA_CHUNK):
+            self.checkpoint()
+            chunk = pairs[start : start + DIJKSTRA_CHUNK]
+            _, predecessors = dijkstra(
+                matrix,
+                directed=False,
+                indices=[s for s, _ in chunk],
+                return_predecessors=True,
+            )
+            for row, (s, t) in zip(predecessors, chunk):
+                path = _path(row, s, t)
+                multigraph.add_edges_from(zip(path, path[1:]))
+
+        circuit = list(nx.eulerian_circuit(multigraph, source=source))
+        # The circuit can be walked either way; take the one with fewer steps
+        # against one-way streets.
+        against = sum(v not in compiled.successors(u) for u, v in circuit)
+        if 2 * against > len(circuit):
+            circuit = [(v, u) for u, v in reversed(circuit)]
+        detours = self._detours(
+            [(u, v) for u, v in circuit if v not in compiled.successors(u)]
+        )
+        route = [source]
+        for u, v in circuit:
+            route.extend(detours[(u, v)][1:] if (u, v) in detours else [v])
+
+        logger.info(
+            "ChinesePostman done: route={} nodes, {:.1f}m",
+            len(route),
+            compiled.path_length(route),
+        )
+        return compiled.to_osm(route)
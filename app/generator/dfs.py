@@ -3,8 +3,7 @@ from dataclasses import dataclass
 import networkx as nx
 from loguru import logger
 
-from app import utils
-from app.generator.base import RouteGenerator
+from app.generator.base import NoRouteError, RouteGenerator
 from app.visited_edges import VisitedEdges
 
 
@@ -14,10 +13,7 @@ class DfsRoute(RouteGenerator):
     v_edges: VisitedEdges
 
     def _segment_distance(self, path: list[int]) -> float:
-        dist = 0.0
-        for u, v in zip(path, path[1:]):
-            dist += utils.get_distance_between(self.graph, u, v)
-        return dist
+        return self.compiled.path_length(path)
 
     def _dfs_segment(
         self,
@@ -26,54 +22,76 @@ class DfsRoute(RouteGenerator):
         max_remaining: float,
         prefer_new: bool,
         prefer_new_v2: bool,
-        ignored_edges: list[tuple[int, int]],
-        ignored_nodes: list[int],
+        ignored_edges: set[tuple[int, int]],
+        ignored_nodes: set[int],
         depth_limit: int,
         used: float,
         min_length: float,
         len_targets: int,
     ) -> list[int]:
+        """Depth-first search for a path from ``s`` that satisfies the segment.
+
+        Iterative, with one shared path buffer: ``pending[d]`` holds the not yet
+        tried neighbours of ``path[d]``. When there is a target, a node is cut
+        as soon as its straight-line distance to ``t`` can't fit in what is
+        left of ``max_remaining``.
+        """
+        length = self.compiled.length
+        lower_bound = self.compiled.distances_to(t).tolist() if t is not None else None
+
+        path = [s]
+        so_far = [0.0]
+        pending: list[list[int]] = []
         result: list[int] | None = None
-        # if len_targets > 1:
-        #     min_length = 0
-
-        def dfs(
-            current: int, path: list[int], length_so_far: float, depth: int
-        ) -> None:
-            nonlocal result
-            if result is not None:
-                return
-            if length_so_far > max_remaining:
-                return
-            if depth > depth_limit:
-                return
-
-            if t is None:
-                if used + length_so_far > min_length:
-                    result = path
-                    return
-
-            if current == t and used + length_so_far > min_length / len_targets:
-                result = path
-                return
-
-            previous = path[-2] if len(path) >= 2 else None
-            neighbors = self.get_neighbours_and_sort(
-                current,
-                prefer_new,
-                [previous] if previous is not None else None,
-                v2=prefer_new_v2,
-                ignored_edges=ignored_edges,
-                ignored_nodes=ignored_nodes,
-            )
-            if prefer_new_v2:
-                neighbors = neighbors[:2]
 
-            for nb in neighbors:
-                step = utils.get_distance_between(self.graph, current, nb)
-                dfs(nb, path + [nb], length_so_far + step, depth + 1)
-
-        dfs(s, [s], 0.0, 0)
+        checkpoint = self.checkpoint
+        while path:
+            checkpoint()
+            current = path[-1]
+            length_so_far = so_far[-1]
+            depth = len(path) - 1
+
+            if (
+                length_so_far > max_remaining
+                or depth > depth_limit
+                or (
+                    lower_bound is not None
+                    and length_so_far + lower_bound[current] > max_remaining
+                )
+            ):
+                path.pop()
+                so_far.pop()
+            elif t is None and used + length_so_far > min_length:
+                result = path
+                break
+            elif current == t and used + length_so_far > min_length / len_targets:
+                result = path
+                break
+            else:
+                previous = path[-2] if depth >= 1 else None
+                neighbors = self.get_neighbours_and_sort(
+                    current,
+                    prefer_new,
+                    [previous] if previous is not None else None,
+                    v2=prefer_new_v2,
+                    ignored_edges=ignored_edges,
+                    ignored_nodes=ignored_nodes,
+                )
+                if prefer_new_v2:
+                    neighbors = neighbors[:2]
+                neighbors.reverse()  # pop() from the end keeps the sorted order
+                pending.append(neighbors)
+
+            # Backtrack out of exhausted nodes, then step into the next neighbour
+            while pending and not pending[-1]:
+                pending.pop()
+                path.pop()
+                so_far.pop()
+            if not pending:
+                break
+            nb = pending[-1].pop()
+            so_far.append(so_far[-1] + length(path[-1], nb))
+            path.append(nb)
 
         if result is None:
             logger.warning(
@@ -83,7 +101,7 @@ class DfsRoute(RouteGenerator):
                 max_remaining,
                 depth_limit,
             )
-            raise Exception(
+            raise NoRouteError(
                 f"Brak ścieżki DFS dla odcinka {s} -> {t} (limit długości/głębokości?)."
             )
         return result
@@ -101,9 +119,10 @@ class DfsRoute(RouteGenerator):
         ignored_nodes: list[int] | None = None,
         middle_nodes: list[int] | None = None,
     ) -> list[int]:
-        ignored_edges = ignored_edges or []
-        ignored_nodes = ignored_nodes or []
-        middle_nodes = middle_nodes or []
+        compiled = self.compiled
+        blocked_edges = compiled.dense_edges(ignored_edges or [])
+        blocked_nodes = compiled.dense_nodes(ignored_nodes or [])
+        middle_nodes = [compiled.dense(n) for n in middle_nodes or []]
 
         min_length, max_length = self.calculate_min_max_length(tolerance, distance)
         logger.info(
@@ -116,16 +135,16 @@ class DfsRoute(RouteGenerator):
         )
 
         targets: list[int | None] = middle_nodes[:]
-        targets.append(end_node)
+        targets.append(compiled.dense(end_node) if end_node is not None else None)
         len_targets = len(targets)
 
-        route: list[int] = [start_node]
+        route: list[int] = [compiled.dense(start_node)]
         used = 0.0
 
         for t in targets:
             max_remaining = (max_length - used) / len(targets)
             if max_remaining <= 0:
-                raise Exception(
+                raise NoRouteError(
                     "Przekroczony maksymalny dozwolony dystans (max_length)."
                 )
 
@@ -138,8 +157,8 @@ class DfsRoute(RouteGenerator):
                 max_remaining=max_remaining,
                 prefer_new=prefer_new,
                 prefer_new_v2=prefer_new_v2,
-                ignored_edges=ignored_edges,
-                ignored_nodes=ignored_nodes,
+                ignored_edges=blocked_edges,
+                ignored_nodes=blocked_nodes,
                 depth_limit=depth_limit,
             )
 
@@ -157,4 +176,4 @@ class DfsRoute(RouteGenerator):
             )
 
         logger.info("DFS route generated: {} nodes, {:.1f}m", len(route), used)
-        return route
+        return compiled.to_osm(route)
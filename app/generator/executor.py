@@ -0,0 +1,284 @@
+import asyncio
+import multiprocessing as mp
+import signal
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from ctypes import Array, c_byte
+from dataclasses import dataclass
+from pathlib import Path
+
+import networkx as nx
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.requests import Request
+
+from app.generator.base import RouteGenerator
+from app.graph.compiled import prepare_graph
+from app.graph.store import GraphStore
+from app.visited_edges import VisitedEdges
+
+BBox = tuple[float, float, float, float]
+
+# How often a running job checks whether its client is still there
+DISCONNECT_POLL_SECONDS = 0.5
+WORKER_GRAPHS = 4
+# Generator steps between cancel/deadline checks; the first step checks too
+CHECKPOINT_STEPS = 64
+# Past the timeout, a job stuck outside any generator loop is interrupted by
+# a timer signal, at whatever point it is
+HARD_TIMEOUT_GRACE_SECONDS = 5.0
+
+ROUTE_QUEUE_DEPTH = Gauge(
+    "route_queue_depth",
+    "Route jobs waiting for a generation worker",
+    multiprocess_mode="livesum",
+)
+ROUTE_QUEUE_SECONDS = Histogram(
+    "route_queue_seconds", "Time route jobs spend waiting for a worker"
+)
+ROUTE_JOB_SECONDS = Histogram(
+    "route_job_seconds",
+    "Time route jobs spend running in a worker",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+ROUTE_JOBS = Counter(
+    "route_jobs", "Finished route jobs by outcome", ["algorithm", "outcome"]
+)
+
+
+class RouteQueueFull(Exception):
+    """All workers are busy and the wait queue is full."""
+
+
+class RouteJobTimeout(Exception):
+    """The job ran longer than the executor's timeout and was stopped."""
+
+
+class RouteJobCancelled(Exception):
+    """The client went away, so the job was dropped or stopped."""
+
+
+class RouteWorkerLost(Exception):
+    """A worker process died, e.g. killed for memory; the pool is restarted."""
+
+
+class GraphNotStored(Exception):
+    """The job's graph is not in the graph store, so workers can't load it."""
+
+
+@dataclass(frozen=True)
+class RouteJob:
+    """Everything a worker needs to generate a route on a stored graph."""
+
+    generator_class: type[RouteGenerator]
+    bbox: BBox
+    network_type: str
+    visited: VisitedEdges
+    start_node: int
+    end_node: int | None
+    distance: int
+    prefer_new: bool
+
+    @property
+    def algorithm(self) -> str:
+        return self.generator_class.__name__
+
+
+# Worker process state, set up by _init_worker.
+_store: GraphStore | None = None
+_graphs: OrderedDict[tuple[BBox, str], nx.MultiDiGraph] = OrderedDict()
+_cancel_flags: Array[c_byte] | None = None
+
+
+def _init_worker(store_root: Path, cancel_flags) -> None:
+    global _store, _cancel_flags
+    _store = GraphStore(store_root)
+    _cancel_flags = cancel_flags
+    signal.signal(signal.SIGALRM, _on_timeout)
+
+
+def _on_timeout(signum, frame) -> None:
+    raise RouteJobTimeout()
+
+
+def _checkpoint(slot: int, deadline: float) -> Callable[[], None]:
+    """Generator checkpoint that stops the job when cancelled or over time."""
+    steps = 0
+
+    def check() -> None:
+        nonlocal steps
+        steps += 1
+        if steps % CHECKPOINT_STEPS != 1:
+            return
+        if _cancel_flags[slot]:
+            raise RouteJobCancelled()
+        if time.monotonic() > deadline:
+            raise RouteJobTimeout()
+
+    return check
+
+
+def _worker_graph(bbox: BBox, network_type: str) -> nx.MultiDiGraph:
+    key = (bbox, network_type)
+    G = _graphs.get(key)
+    if G is None:
+        G = _store.load(bbox, network_type)
+        if G is None:
+            raise GraphNotStored(f"Graph {bbox} {network_type} is not in the store")
+        prepare_graph(G)
+        _graphs[key] = G
+        while len(_graphs) > WORKER_GRAPHS:
+            _graphs.popitem(last=False)
+    _graphs.move_to_end(key)
+    return G
+
+
+def _run_job(slot: int, job: RouteJob, timeout: float) -> list[int]:
+    deadline = time.monotonic() + timeout
+    signal.setitimer(signal.ITIMER_REAL, timeout + HARD_TIMEOUT_GRACE_SECONDS)
+    try:
+        if _cancel_flags[slot]:
+            raise RouteJobCancelled()
+        G = _worker_graph(job.bbox, job.network_type)
+        generator = job.generator_class(
+            G, job.visited, checkpoint=_checkpoint(slot, deadline)
+        )
+        return generator.generate(
+            start_node=job.start_node,
+            end_node=job.end_node,
+            distance=job.distance,
+            prefer_new=job.prefer_new,
+        )
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class RouteExecutor:
+    """Runs route generation in a pool of worker processes.
+
+    At most ``workers`` jobs run at once, one per slot, and at most
+    ``queue_size`` more wait for a slot; further jobs are rejected with
+    ``RouteQueueFull``. Workers load graphs memory-mapped from the graph store,
+    so only jobs on stored graphs can run here; others fail with
+    ``GraphNotStored``.
+
+    A running job checks its slot's cancel flag and deadline between
+    generator steps, so it stops cleanly once it runs longer than ``timeout``
+    seconds or its client disconnects; a waiting job is just dropped. A timer
+    signal interrupts jobs still running ``HARD_TIMEOUT_GRACE_SECONDS`` past
+    the timeout. If a worker dies, the pool is replaced and the jobs it was
+    running fail with ``RouteWorkerLost``.
+    """
+
+    def __init__(
+        self, store_root: Path, workers: int, queue_size: int, timeout: float
+    ) -> None:
+        self.store_root = store_root
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.waiting = 0
+        self._context = mp.get_context("spawn")
+        self._cancel_flags = self._context.Array("b", workers, lock=False)
+        self._free_slots = list(range(workers))
+        self._slot_available = asyncio.Semaphore(workers)
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            logger.info("Starting {} route generation workers", self.workers)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(self.store_root, self._cancel_flags),
+            )
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def run(self, job: RouteJob, request: Request | None = None) -> list[int]:
+        if self._slot_available.locked() and self.waiting >= self.queue_size:
+            ROUTE_JOBS.labels(job.algorithm, "rejected").inc()
+            raise RouteQueueFull()
+
+        queued_at = time.perf_counter()
+        await self._acquire_slot(job, request)
+        slot = self._free_slots.pop()
+        ROUTE_QUEUE_SECONDS.observe(time.perf_counter() - queued_at)
+
+        started_at = time.perf_counter()
+        outcome = "error"
+        try:
+            route = await self._run_in_slot(slot, job, request)
+            outcome = "ok"
+            return route
+        except RouteJobTimeout:
+            outcome = "timeout"
+            raise
+        except RouteJobCancelled:
+            outcome = "cancelled"
+            raise
+        except RouteWorkerLost:
+            outcome = "lost"
+            raise
+        finally:
+            self._free_slots.append(slot)
+            self._slot_available.release()
+            ROUTE_JOB_SECONDS.observe(time.perf_counter() - started_at)
+            ROUTE_JOBS.labels(job.algorithm, outcome).inc()
+
+    async def _acquire_slot(self, job: RouteJob, request: Request | None) -> None:
+        self.waiting += 1
+        ROUTE_QUEUE_DEPTH.inc()
+        acquire = asyncio.ensure_future(self._slot_available.acquire())
+        try:
+            while not await self._wait(acquire):
+                if request is not None and await request.is_disconnected():
+                    acquire.cancel()
+                    if acquire.done() and not acquire.cancelled():
+                        self._slot_available.release()
+                    ROUTE_JOBS.labels(job.algorithm, "cancelled").inc()
+                    raise RouteJobCancelled()
+        finally:
+            self.waiting -= 1
+            ROUTE_QUEUE_DEPTH.dec()
+
+    async def _run_in_slot(
+        self, slot: int, job: RouteJob, request: Request | None
+    ) -> list[int]:
+        self._cancel_flags[slot] = 0
+        pool = self._get_pool()
+        try:
+            future = asyncio.wrap_future(pool.submit(_run_job, slot, job, self.timeout))
+            while not await self._wait(future):
+                if request is not None and await request.is_disconnected():
+                    logger.info("Client disconnected, stopping {} job", job.algorithm)
+                    self._cancel_flags[slot] = 1
+                    break
+            # The slot is only free again once its worker has finished.
+            return await asyncio.shield(future)
+        except BrokenProcessPool as e:
+            self._discard_pool(pool)
+            raise RouteWorkerLost() from e
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Drop a broken pool; the next job starts a new one."""
+        if self._pool is not pool:
+            return  # another job on the same pool got here first
+        logger.error("A route generation worker died, restarting the pool")
+        self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        for slot in range(self.workers):
+            self._cancel_flags[slot] = 0
+
+    @staticmethod
+    async def _wait(future: asyncio.Future) -> bool:
+        done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_SECONDS)
+        return bool(done)
@@ -1,99 +1,186 @@
+import time
 from dataclasses import dataclass
 
 import networkx as nx
 from loguru import logger
 
-from app import utils
-from app.generator.base import RouteGenerator
+from app.generator.base import NoRouteError, RouteBudgetExceeded, RouteGenerator
 from app.visited_edges import VisitedEdges
 
 
 @dataclass
 class RandomRoute(RouteGenerator):
+    """Random walks, sampled in batches under a per-request time/step budget.
+
+    Each segment collects up to ``BATCH_SIZE`` walks that reach their target
+    and keeps the one closest to the wanted length (and, with ``prefer_new``,
+    with the most new streets). Walks that can no longer reach the target
+    within the remaining length are abandoned early.
+    """
+
     graph: nx.MultiDiGraph
     v_edges: VisitedEdges
 
     SEG_MAX_STEPS: int = 300
-    SEG_RESTARTS: int = 1000_0000_00
+    BATCH_SIZE: int = 16
+    TIME_BUDGET: float = 5.0
+    STEP_BUDGET: int = 1_000_000
 
-    def _random_segment(
+    def _walk(
         self,
         s: int,
         t: int | None,
         min_length: float,
-        len_targets: int,
         max_remaining: float,
+        bound: list[float] | None,
         prefer_new: bool,
         prefer_new_v2: bool,
-        ignored_edges: list[tuple[int, int]],
-        ignored_nodes: list[int],
-    ) -> list[int]:
-        if len_targets > 1:
-            min_length = 0
-
-        for _restart in range(self.SEG_RESTARTS + 1):
-            path = [s]
-            used = 0.0
-            current = s
-            prev = None
-
-            for _step in range(self.SEG_MAX_STEPS):
-                if t is None:
-                    if min_length:
-                        if used > min_length:
-                            return path
-
-                if current == t:
-                    if min_length:
-                        if used > min_length:
-                            return path
-                    else:
-                        return path
-
-                neighbors = self.get_neighbours_and_sort(
-                    current,
-                    prefer_new,
-                    [prev] if prev is not None else None,
-                    v2=prefer_new_v2,
-                    ignored_edges=ignored_edges,
-                    ignored_nodes=ignored_nodes,
-                )
-
-                if not neighbors:
-                    if prev is None:
-                        break
-                    next_node = prev
+        ignored_edges: set[tuple[int, int]],
+        ignored_nodes: set[int],
+    ) -> tuple[list[int] | None, float]:
+        """One random walk; (path, length) or (None, 0) if it failed."""
+        path = [s]
+        used = 0.0
+        current = s
+        prev = None
+
+        for _step in range(self.SEG_MAX_STEPS):
+            self._steps_left -= 1
+            if t is None:
+                if min_length:
+                    if used > min_length:
+                        return path, used
+
+            if current == t:
+                if min_length:
+                    if used > min_length:
+                        return path, used
                 else:
-                    next_node = neighbors[0]
+                    return path, used
 
-                next_node = int(next_node)
-                step_len = utils.get_distance_between(self.graph, current, next_node)
-                if step_len <= 0:
-                    break
+            if bound is not None and used + bound[current] > max_remaining:
+                break
+
+            neighbors = self.get_neighbours_and_sort(
+                current,
+                prefer_new,
+                [prev] if prev is not None else None,
+                v2=prefer_new_v2,
+                ignored_edges=ignored_edges,
+                ignored_nodes=ignored_nodes,
+            )
 
-                if used + step_len > max_remaining:
+            if not neighbors:
+                if prev is None:
                     break
+                next_node = prev
+            else:
+                next_node = neighbors[0]
+
+            step_len = self.compiled.length(current, next_node)
+            if step_len <= 0:
+                break
+
+            if used + step_len > max_remaining:
+                break
+
+            path.append(next_node)
+            used += step_len
+            prev, current = current, next_node
+
+        return None, 0.0
+
+    def _new_share(self, path: list[int]) -> float:
+        """Fraction of the path's streets that are not visited yet."""
+        if len(path) < 2:
+            return 0.0
+        visits, edge_id = self.visits, self.compiled.edge_id
+        new = sum(1 for u, v in zip(path, path[1:]) if not visits[edge_id(u, v)])
+        return new / (len(path) - 1)
+
+    def _check_reachable(self, s: int, t: int, max_remaining: float) -> list[float]:
+        """Lower bounds to ``t``; raises NoRouteError if ``t`` is out of reach."""
+        compiled = self.compiled
+        if not compiled.reachable(s, t):
+            raise NoRouteError(f"Node {compiled.osm_ids[t]} is not reachable.")
+
+        bound = compiled.distances_to(t).tolist()
+        if bound[s] > max_remaining:
+            raise NoRouteError(
+                f"Node {compiled.osm_ids[t]} is {bound[s]:.0f} m away, "
+                f"more than the remaining {max_remaining:.0f} m."
+            )
+        return bound
 
-                path.append(next_node)
-                used += step_len
-                prev, current = current, next_node
+    def _random_segment(
+        self,
+        s: int,
+        t: int | None,
+        min_length: float,
+        len_targets: int,
+        max_remaining: float,
+        target_length: float,
+        prefer_new: bool,
+        prefer_new_v2: bool,
+        ignored_edges: set[tuple[int, int]],
+        ignored_nodes: set[int],
+    ) -> list[int]:
+        if len_targets > 1:
+            min_length = 0
 
-        logger.warning(
-            "Random no segment {} -> {} in budget {:.1f}m after {} restarts",
+        bound = self._check_reachable(s, t, max_remaining) if t is not None else None
+
+        best: list[int] | None = None
+        best_score = float("inf")
+        found = walks = 0
+        while found < self.BATCH_SIZE:
+            self.checkpoint()
+            if self._steps_left <= 0 or time.monotonic() > self._deadline:
+                break
+            walks += 1
+            path, length = self._walk(
+                s,
+                t,
+                min_length,
+                max_remaining,
+                bound,
+                prefer_new,
+                prefer_new_v2,
+                ignored_edges,
+                ignored_nodes,
+            )
+            if path is None:
+                continue
+
+            found += 1
+            score = abs(length - target_length) / target_length
+            if prefer_new:
+                score -= self._new_share(path)
+            if score < best_score:
+                best, best_score = path, score
+
+        logger.debug(
+            "Random segment {} -> {}: {} of {} walks succeeded",
             s,
             t,
-            max_remaining,
-            self.SEG_RESTARTS,
-        )
-        raise Exception(
-            f"Nie udało się znaleźć segmentu {s} -> {t} w budżecie {max_remaining:.1f} m."
+            found,
+            walks,
         )
+        if best is None:
+            logger.warning(
+                "Random no segment {} -> {} in budget {:.1f}m after {} walks",
+                s,
+                t,
+                max_remaining,
+                walks,
+            )
+            raise RouteBudgetExceeded(
+                f"Nie udało się znaleźć segmentu {s} -> {t} w budżecie {max_remaining:.1f} m."
+            )
+        return best
 
     def _path_length(self, path: list[int]) -> float:
-        dist = 0.0
-        for u, v in zip(path, path[1:]):
-            dist += utils.get_distance_between(self.graph, u, v)
-        return dist
+        return self.compiled.path_length(path)
 
     def generate(
         self,
@@ -108,9 +195,10 @@ class RandomRoute(RouteGenerator):
         ignored_nodes: list[int] | None = None,
         middle_nodes: list[int] | None = None,
     ) -> list[int]:
-        ignored_edges = ignored_edges or []
-        ignored_nodes = ignored_nodes or []
-        middle_nodes = middle_nodes or []
+        compiled = self.compiled
+        blocked_edges = compiled.dense_edges(ignored_edges or [])
+        blocked_nodes = compiled.dense_nodes(ignored_nodes or [])
+        middle_nodes = [compiled.dense(n) for n in middle_nodes or []]
 
         min_length, max_length = self.calculate_min_max_length(tolerance, distance)
         logger.info(
@@ -122,16 +210,18 @@ class RandomRoute(RouteGenerator):
         )
 
         targets: list[int | None] = middle_nodes[:]
-        targets.append(end_node)
+        targets.append(compiled.dense(end_node) if end_node is not None else None)
         len_targets = len(targets)
 
-        route: list[int] = [start_node]
+        route: list[int] = [compiled.dense(start_node)]
         used_total = 0.0
+        self._deadline = time.monotonic() + self.TIME_BUDGET
+        self._steps_left = self.STEP_BUDGET
 
-        for t in targets:
+        for i, t in enumerate(targets):
             max_remaining = max_length - used_total
             if max_remaining <= 0:
-                raise Exception(
+                raise NoRouteError(
                     "Przekroczony maksymalny dozwolony dystans (max_length)."
                 )
 
@@ -141,10 +231,11 @@ class RandomRoute(RouteGenerator):
                 min_length=min_length,
                 len_targets=len_targets,
                 max_remaining=max_remaining,
+                target_length=max(distance - used_total, 1.0) / (len_targets - i),
                 prefer_new=prefer_new,
                 prefer_new_v2=prefer_new_v2,
-                ignored_edges=ignored_edges,
-                ignored_nodes=ignored_nodes,
+                ignored_edges=blocked_edges,
+                ignored_nodes=blocked_nodes,
             )
 
             if route[-1] == seg[0]:
@@ -161,4 +252,4 @@ class RandomRoute(RouteGenerator):
             )
 
         logger.info("RandomRoute generated: {} nodes, {:.1f}m", len(route), used_total)
-        return route
+        return compiled.to_osm(route)
@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timezone
+
+import networkx as nx
+from loguru import logger
+
+from app.graph.compiled import get_compiled_graph, prepare_graph
+from app.graph.spatial import get_spatial_index
+
+# Rough per-item cost of networkx dict-of-dicts with OSMnx attributes.
+NX_NODE_BYTES = 400
+NX_EDGE_BYTES = 800
+
+
+def graph_nbytes(graph: nx.MultiDiGraph) -> int:
+    """Estimated resident size of a graph together with its compiled form."""
+    compiled = get_compiled_graph(graph)
+    arrays = sum(getattr(compiled, f.name).nbytes for f in fields(compiled))
+    return (
+        arrays
+        + graph.number_of_nodes() * NX_NODE_BYTES
+        + graph.number_of_edges() * NX_EDGE_BYTES
+    )
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    graph: nx.MultiDiGraph
+    nbytes: int
+    hits: int = 0
+    loaded_at: datetime = field(default_factory=_now)
+    last_used_at: datetime = field(default_factory=_now)
+
+
+class GraphCache:
+    """Size-bounded LRU of street graphs.
+
+    Graphs are prepared (pruned, compiled and frozen) when they are put, so
+    everything reading them afterwards shares them safely.
+
+    Least recently used graphs are evicted once the estimated total size goes
+    over ``max_bytes``. The most recently inserted graph is always kept, even
+    if it alone is over budget.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        return sum(e.nbytes for e in self._entries.values())
+
+    def get(self, key: str) -> nx.MultiDiGraph | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            entry.hits += 1
+            entry.last_used_at = _now()
+            return entry.graph
+
+    def put(self, key: str, graph: nx.MultiDiGraph) -> None:
+        # Built here once, so requests only ever query the index
+        get_spatial_index(prepare_graph(graph))
+        nbytes = graph_nbytes(graph)
+        with self._lock:
+            self._entries[key] = CacheEntry(key=key, graph=graph, nbytes=nbytes)
+            self._entries.move_to_end(key)
+            self._evict_over_budget()
+        logger.info(
+            "Cached graph {} ({:.1f} MB), {} graphs, {:.1f} MB total",
+            key,
+            nbytes / 1024**2,
+            len(self._entries),
+            self.nbytes / 1024**2,
+        )
+
+    def _evict_over_budget(self) -> None:
+        total = sum(e.nbytes for e in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry.nbytes
+            self.evictions += 1
+            logger.info("Evicted graph {} ({:.1f} MB)", key, entry.nbytes / 1024**2)
+
+    def evict(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.evictions += 1
+        logger.info("Evicted graph {} on request", key)
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self.evictions += len(self._entries)
+            self._entries.clear()
+
+    def entries(self) -> list[CacheEntry]:
+        """Resident graphs, least recently used first."""
+        with self._lock:
+            return list(self._entries.values())
@@ -0,0 +1,371 @@
+import threading
+import time
+from dataclasses import dataclass
+from functools import cached_property
+from weakref import WeakKeyDictionary
+
+import networkx as nx
+import numpy as np
+from loguru import logger
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import connected_components
+
+# Slightly below OSMnx's 6371009 m, so distances stay lower bounds of lengths.
+EARTH_RADIUS = 6_371_000
+
+
+@dataclass(frozen=True, eq=False)
+class CompiledGraph:
+    """Array-backed (CSR) view of an OSMnx street graph.
+
+    Nodes are remapped to dense ints ``0..n-1`` and parallel edges are
+    collapsed to the shortest one, which is what every generator picks anyway.
+    Out-edges of node ``i`` are ``offsets[i]:offsets[i + 1]`` in the edge arrays.
+    """
+
+    node_ids: np.ndarray  # int64, dense id -> OSM id
+    x: np.ndarray  # float64, lon
+    y: np.ndarray  # float64, lat
+    offsets: np.ndarray  # int64, n + 1
+    targets: np.ndarray  # int32, dense target node per edge
+    lengths: np.ndarray  # float64, min length per collapsed edge
+    bearings: np.ndarray  # float64, atan2(dy, dx) of the straight u -> v line
+    keys: np.ndarray  # int64, key of the parallel edge that was kept
+    geometry_offsets: np.ndarray  # int64, m + 1, into geometry_x/geometry_y
+    geometry_x: np.ndarray  # float64, lon of every edge's polyline, flattened
+    geometry_y: np.ndarray  # float64, lat of every edge's polyline, flattened
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.targets)
+
+    @cached_property
+    def index(self) -> dict[int, int]:
+        return {node: i for i, node in enumerate(self.node_ids.tolist())}
+
+    @cached_property
+    def osm_ids(self) -> list[int]:
+        return self.node_ids.tolist()
+
+    @cached_property
+    def edge_index(self) -> dict[tuple[int, int], int]:
+        """(u, v) OSM ids -> collapsed edge id."""
+        ids = self.osm_ids
+        return {
+            (ids[u], ids[v]): e
+            for e, (u, v) in enumerate(zip(self._sources, self._targets))
+        }
+
+    @cached_property
+    def sources(self) -> np.ndarray:
+        return np.repeat(
+            np.arange(self.num_nodes, dtype=np.int32), np.diff(self.offsets)
+        )
+
+    @cached_property
+    def reverse(self) -> np.ndarray:
+        """Edge id of ``v -> u`` for every edge ``u -> v``, or -1."""
+        if not self.num_edges:
+            return np.empty(0, dtype=np.int64)
+        n = np.int64(self.num_nodes)
+        forward = self.sources.astype(np.int64) * n + self.targets
+        backward = self.targets.astype(np.int64) * n + self.sources
+        # CSR edges are sorted by (source, target), so forward is sorted.
+        pos = np.searchsorted(forward, backward)
+        pos = np.minimum(pos, self.num_edges - 1)
+        return np.where(forward[pos] == backward, pos, -1)
+
+    @cached_property
+    def edge_bounds(self) -> np.ndarray:
+        """(m, 4) ``west, south, east, north`` of every edge's polyline."""
+        if not self.num_edges:
+            return np.empty((0, 4), dtype=np.float64)
+        starts = self.geometry_offsets[:-1]
+        return np.column_stack(
+            (
+                np.minimum.reduceat(self.geometry_x, starts),
+                np.minimum.reduceat(self.geometry_y, starts),
+                np.maximum.reduceat(self.geometry_x, starts),
+                np.maximum.reduceat(self.geometry_y, starts),
+            )
+        )
+
+    @cached_property
+    def total_length(self) -> float:
+        """Length of all (collapsed) edges; a two-way street counts twice."""
+        return float(self.lengths.sum())
+
+    @cached_property
+    def strong_components(self) -> np.ndarray:
+        """Strongly connected component label of every node."""
+        n = self.num_nodes
+        matrix = csr_array(
+            (np.ones(self.num_edges, dtype=np.int8), self.targets, self.offsets), (n, n)
+        )
+        _, labels = connected_components(matrix, directed=True, connection="strong")
+        return labels
+
+    def reachable(self, s: int, t: int) -> bool:
+        """Whether a directed walk leads from ``s`` to ``t``."""
+        labels = self._strong_components
+        if labels[s] == labels[t]:
+            return True
+        seen = {s}
+        stack = [s]
+        while stack:
+            u = stack.pop()
+            for v in self.successors(u):
+                if v == t:
+                    return True
+                if v not in seen:
+                    seen.add(v)
+                    stack.append(v)
+        return False
+
+    # Plain-list mirrors: scalar indexing into lists is much cheaper than into
+    # numpy arrays, and the generators are scalar Python loops.
+    @cached_property
+    def _offsets(self) -> list[int]:
+        return self.offsets.tolist()
+
+    @cached_property
+    def _targets(self) -> list[int]:
+        return self.targets.tolist()
+
+    @cached_property
+    def _lengths(self) -> list[float]:
+        return self.lengths.tolist()
+
+    @cached_property
+    def _bearings(self) -> list[float]:
+        return self.bearings.tolist()
+
+    @cached_property
+    def _sources(self) -> list[int]:
+        return self.sources.tolist()
+
+    @cached_property
+    def _reverse(self) -> list[int]:
+        return self.reverse.tolist()
+
+    @cached_property
+    def _strong_components(self) -> list[int]:
+        return self.strong_components.tolist()
+
+    @cached_property
+    def _geometry_offsets(self) -> list[int]:
+        return self.geometry_offsets.tolist()
+
+    @cached_property
+    def _geometry_x(self) -> list[float]:
+        return self.geometry_x.tolist()
+
+    @cached_property
+    def _geometry_y(self) -> list[float]:
+        return self.geometry_y.tolist()
+
+    @cached_property
+    def _coords(self) -> list[tuple[float, float]]:
+        return list(zip(self.x.tolist(), self.y.tolist()))
+
+    def dense(self, node: int) -> int:
+        return self.index[node]
+
+    def dense_nodes(self, nodes: list[int]) -> set[int]:
+        return {self.index[n] for n in nodes if n in self.index}
+
+    def dense_edges(self, edges: list[tuple[int, int]]) -> set[tuple[int, int]]:
+        index = self.index
+        return {(index[u], index[v]) for u, v in edges if u in index and v in index}
+
+    def to_osm(self, route: list[int]) -> list[int]:
+        ids = self.osm_ids
+        return [ids[i] for i in route]
+
+    def coords(self, node: int) -> tuple[float, float]:
+        """(lon, lat) of a dense node id."""
+        return self._coords[node]
+
+    def out_edges(self, node: int) -> range:
+        return range(self._offsets[node], self._offsets[node + 1])
+
+    def successors(self, node: int) -> list[int]:
+        return self._targets[self._offsets[node] : self._offsets[node + 1]]
+
+    def edge_id(self, u: int, v: int) -> int:
+        start, end = self._offsets[u], self._offsets[u + 1]
+        return self._targets.index(v, start, end)
+
+    def source(self, edge: int) -> int:
+        return self._sources[edge]
+
+    def target(self, edge: int) -> int:
+        return self._targets[edge]
+
+    def reverse_edge(self, edge: int) -> int:
+        return self._reverse[edge]
+
+    def length(self, u: int, v: int) -> float:
+        return self._lengths[self.edge_id(u, v)]
+
+    def edge_length(self, edge: int) -> float:
+        return self._lengths[edge]
+
+    def bearing(self, edge: int) -> float:
+        return self._bearings[edge]
+
+    def path_length(self, path: list[int]) -> float:
+        return sum(self.length(u, v) for u, v in zip(path, path[1:]))
+
+    def distances_to(self, node: int) -> np.ndarray:
+        """Great-circle distance in meters from every node to ``node``.
+
+        Street lengths are never shorter than this, so it is a lower bound on
+        the remaining walk to ``node``.
+        """
+        lon, lat = np.radians(self.x), np.radians(self.y)
+        dlon = lon - lon[node]
+        dlat = lat - lat[node]
+        a = (
+            np.sin(dlat / 2) ** 2
+            + np.cos(lat) * np.cos(lat[node]) * np.sin(dlon / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def find_edge(self, u: int, v: int) -> int | None:
+        """Collapsed edge id for OSM ids ``u -> v``, or None."""
+        return self.edge_index.get((u, v))
+
+    def edge_geometry(self, edge: int) -> tuple[list[float], list[float]]:
+        """(xs, ys) of the edge polyline, endpoints included."""
+        start = self._geometry_offsets[edge]
+        end = self._geometry_offsets[edge + 1]
+        return self._geometry_x[start:end], self._geometry_y[start:end]
+
+
+def build_compiled_graph(graph: nx.MultiDiGraph) -> CompiledGraph:
+    n = graph.number_of_nodes()
+    index: dict[int, int] = {}
+    node_ids = np.empty(n, dtype=np.int64)
+    x = np.empty(n, dtype=np.float64)
+    y = np.empty(n, dtype=np.float64)
+    for i, (node, data) in enumerate(graph.nodes(data=True)):
+        index[node] = i
+        node_ids[i] = node
+        x[i] = data["x"]
+        y[i] = data["y"]
+
+    # (u, v) -> (length, key, geometry) of the shortest parallel edge
+    shortest: dict[tuple[int, int], tuple[float, int, object]] = {}
+    for u, v, k, data in graph.edges(keys=True, data=True):
+        pair = (index[u], index[v])
+        length = data["length"]
+        if pair not in shortest or length < shortest[pair][0]:
+            shortest[pair] = (length, k, data.get("geometry"))
+
+    m = len(shortest)
+    pairs = sorted(shortest)
+    src = np.fromiter((p[0] for p in pairs), dtype=np.int32, count=m)
+    dst = np.fromiter((p[1] for p in pairs), dtype=np.int32, count=m)
+    lengths = np.fromiter((shortest[p][0] for p in pairs), dtype=np.float64, count=m)
+    keys = np.fromiter((shortest[p][1] for p in pairs), dtype=np.int64, count=m)
+
+    geometry_offsets = np.zeros(m + 1, dtype=np.int64)
+    geometry_x: list[float] = []
+    geometry_y: list[float] = []
+    for e, (u, v) in enumerate(pairs):
+        geometry = shortest[u, v][2]
+        if geometry:
+            xs, ys = geometry.xy
+            geometry_x.extend(xs)
+            geometry_y.extend(ys)
+        else:
+            geometry_x.extend((x[u], x[v]))
+            geometry_y.extend((y[u], y[v]))
+        geometry_offsets[e + 1] = len(geometry_x)
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+    bearings = np.arctan2(y[dst] - y[src], x[dst] - x[src])
+
+    return CompiledGraph(
+        node_ids=node_ids,
+        x=x,
+        y=y,
+        offsets=offsets,
+        targets=dst,
+        lengths=lengths,
+        bearings=bearings,
+        keys=keys,
+        geometry_offsets=geometry_offsets,
+        geometry_x=np.asarray(geometry_x, dtype=np.float64),
+        geometry_y=np.asarray(geometry_y, dtype=np.float64),
+    )
+
+
+_compiled: WeakKeyDictionary[nx.MultiDiGraph, CompiledGraph] = WeakKeyDictionary()
+_compiled_lock = threading.Lock()
+
+
+def register_compiled_graph(graph: nx.MultiDiGraph, compiled: CompiledGraph) -> None:
+    """Attach an already built compiled form (e.g. loaded from disk) to ``graph``."""
+    with _compiled_lock:
+        _compiled[graph] = compiled
+
+
+def get_compiled_graph(graph: nx.MultiDiGraph) -> CompiledGraph:
+    """Return the compiled form of ``graph``, building it on first use."""
+    with _compiled_lock:
+        compiled = _compiled.get(graph)
+    # Node count is a cheap staleness check for graphs pruned after compiling.
+    if compiled is not None and compiled.num_nodes == len(graph):
+        return compiled
+
+    start = time.perf_counter()
+    compiled = build_compiled_graph(graph)
+    # Warm the (u, v) lookup used for serialization
+    _ = compiled.edge_index
+    logger.info(
+        "Compiled graph: {} nodes, {} edges in {:.4f} sec.",
+        compiled.num_nodes,
+        compiled.num_edges,
+        time.perf_counter() - start,
+    )
+    with _compiled_lock:
+        _compiled[graph] = compiled
+    return compiled
+
+
+def prepare_graph(graph: nx.MultiDiGraph) -> CompiledGraph:
+    """Prepare ``graph`` once, before it is shared between requests.
+
+    Isolated nodes and everything outside the largest weakly connected
+    component are dropped, the graph is compiled (dense node and edge ids) and
+    frozen. Generators then only read it and keep per-request state of their
+    own, so they need no cleanup per request and can run concurrently.
+    """
+    if nx.is_frozen(graph):
+        return get_compiled_graph(graph)
+
+    compiled = get_compiled_graph(graph)
+    n = compiled.num_nodes
+    matrix = csr_array(
+        (
+            np.ones(compiled.num_edges, dtype=np.int8),
+            compiled.targets,
+            compiled.offsets,
+        ),
+        (n, n),
+    )
+    count, labels = connected_components(matrix, directed=True, connection="weak")
+    if count > 1:
+        outside = labels != np.bincount(labels).argmax()
+        graph.remove_nodes_from(compiled.node_ids[outside].tolist())
+        logger.info("Prepared graph: dropped {} stray nodes", int(outside.sum()))
+        compiled = get_compiled_graph(graph)
+    nx.freeze(graph)
+    return compiled
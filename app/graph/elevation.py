@@ -0,0 +1,170 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
+
+from app.graph.compiled import CompiledGraph
+from app.graph.store import BBox, GraphStore
+from app.services.elevation import MISS_TTL_SECONDS, ElevationService, fill_profile
+from app.visited_edges import edge_ids
+
+
+@dataclass(frozen=True, eq=False)
+class EdgeElevation:
+    """Elevations of a compiled graph, looked up once per graph.
+
+    ``points`` follows the flattened edge geometry (``geometry_x`` and
+    ``geometry_y``), NaN along edges with no known point. ``ascent`` and
+    ``descent`` are the climbs along every directed edge's polyline, so a
+    route's totals are sums over its edges.
+    """
+
+    points: np.ndarray  # float64, meters at every edge geometry point
+    ascent: np.ndarray  # float64, per edge
+    descent: np.ndarray  # float64, per edge
+
+    def profile(self, compiled: CompiledGraph, edges: np.ndarray) -> list[int]:
+        """Elevation along ``edges``, aligned with ``utils.route_to_x_y``."""
+        starts = compiled.geometry_offsets[edges]
+        counts = compiled.geometry_offsets[edges + 1] - starts
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        points = np.repeat(starts, counts) + np.arange(counts.sum()) - first
+        return fill_profile(self.points[points])
+
+    def totals(self, edges: np.ndarray) -> tuple[int, int]:
+        """Total ascent and descent of a walk along ``edges``, in meters."""
+        return round(self.ascent[edges].sum()), round(self.descent[edges].sum())
+
+
+def build_edge_elevation(compiled: CompiledGraph, points: np.ndarray) -> EdgeElevation:
+    counts = np.diff(compiled.geometry_offsets)
+    edges = np.repeat(np.arange(compiled.num_edges), counts)
+    points = fill_edge_gaps(compiled, edges, points)
+    # Consecutive points of the same edge; edge ends are left out
+    same_edge = edges[:-1] == edges[1:]
+    # Edges with no known point do not climb
+    climbs = np.nan_to_num(np.diff(points)[same_edge])
+    edges = edges[:-1][same_edge]
+    return EdgeElevation(
+        points=points,
+        ascent=np.bincount(
+            edges, weights=np.maximum(climbs, 0), minlength=compiled.num_edges
+        ),
+        descent=np.bincount(
+            edges, weights=np.maximum(-climbs, 0), minlength=compiled.num_edges
+        ),
+    )
+
+
+def fill_edge_gaps(
+    compiled: CompiledGraph, edges: np.ndarray, points: np.ndarray
+) -> np.ndarray:
+    """Interpolate unknown points from known ones of the same edge only."""
+    unknown = np.isnan(points)
+    known_counts = np.bincount(edges[~unknown], minlength=compiled.num_edges)
+    partial = np.unique(edges[unknown])
+    partial = partial[known_counts[partial] > 0]
+    if not len(partial):
+        return points
+    points = points.copy()
+    for edge in partial.tolist():
+        start, end = compiled.geometry_offsets[edge : edge + 2].tolist()
+        segment = points[start:end]
+        known = ~np.isnan(segment)
+        index = np.arange(len(segment))
+        points[start:end] = np.interp(index, index[known], segment[known])
+    return points
+
+
+def _stored_elevation(
+    compiled: CompiledGraph, arrays: dict[str, np.ndarray] | None
+) -> EdgeElevation | None:
+    """Edge elevation from arrays saved in the graph store, if they fit."""
+    if arrays is None or set(arrays) != {"points", "ascent", "descent"}:
+        return None
+    fits = len(arrays["points"]) == len(compiled.geometry_x) and all(
+        len(arrays[name]) == compiled.num_edges for name in ("ascent", "descent")
+    )
+    return EdgeElevation(**arrays) if fits else None
+
+
+_elevations: WeakKeyDictionary[CompiledGraph, EdgeElevation] = WeakKeyDictionary()
+_locks: WeakKeyDictionary[CompiledGraph, asyncio.Lock] = WeakKeyDictionary()
+# Graphs the backend knows nothing of, with the monotonic time to try again
+_missing: WeakKeyDictionary[CompiledGraph, float] = WeakKeyDictionary()
+
+
+async def get_edge_elevation(
+    compiled: CompiledGraph,
+    service: ElevationService,
+    store: GraphStore | None = None,
+    key: tuple[BBox, str] | None = None,
+) -> EdgeElevation | None:
+    """Edge elevations of ``compiled``, looked up on first use and kept with it.
+
+    Every distinct geometry point goes to the backend once. The per-point
+    cache is skipped: the result is kept here, and filling the cache with a
+    whole graph would only cost time on the event loop. None when the backend
+    knows no point of the graph; that is remembered too, for
+    ``MISS_TTL_SECONDS`` like the point misses.
+
+    With a ``store`` and the stored graph's ``key`` (bbox, network type), the
+    elevation is saved next to the graph, per backend, and loaded from there
+    by the other workers instead of being looked up again.
+    """
+    elevation = _elevations.get(compiled)
+    if elevation is not None or _missing.get(compiled, 0) > time.monotonic():
+        return elevation
+
+    lock = _locks.setdefault(compiled, asyncio.Lock())
+    async with lock:
+        elevation = _elevations.get(compiled)
+        if elevation is not None or _missing.get(compiled, 0) > time.monotonic():
+            return elevation
+
+        name = f"elevation-{service.backend.name}" if service.backend else None
+        if store is not None and key is not None and name is not None:
+            arrays = await run_in_threadpool(store.load_arrays, *key, name)
+            elevation = _stored_elevation(compiled, arrays)
+            if elevation is not None:
+                _elevations[compiled] = elevation
+                return elevation
+
+        start = time.perf_counter()
+        points = await service.elevations(
+            compiled.geometry_x, compiled.geometry_y, cache=False
+        )
+        if np.isnan(points).all():
+            logger.warning("No elevation for graph of {} edges", compiled.num_edges)
+            _missing[compiled] = time.monotonic() + MISS_TTL_SECONDS
+            return None
+        _missing.pop(compiled, None)
+        elevation = build_edge_elevation(compiled, points)
+        logger.info(
+            "Edge elevation: {} edges in {:.4f} sec.",
+            compiled.num_edges,
+            time.perf_counter() - start,
+        )
+        _elevations[compiled] = elevation
+        if store is not None and key is not None and name is not None:
+            await run_in_threadpool(
+                store.save_arrays,
+                *key,
+                name,
+                {
+                    "points": elevation.points,
+                    "ascent": elevation.ascent,
+                    "descent": elevation.descent,
+                },
+            )
+        return elevation
+
+
+def route_edges(compiled: CompiledGraph, route: list[int]) -> np.ndarray:
+    """Compiled edge ids along an OSM node route, pairs not in the graph skipped."""
+    pairs = np.column_stack((route[:-1], route[1:])).astype(np.int64)
+    return edge_ids(compiled, pairs)
@@ -0,0 +1,90 @@
+import threading
+import time
+from dataclasses import dataclass
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from loguru import logger
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import dijkstra
+
+from app.graph.compiled import CompiledGraph
+
+DEFAULT_LANDMARKS = 8
+
+
+@dataclass(frozen=True, eq=False)
+class Landmarks:
+    """Shortest-path distances between a few landmark nodes and every node.
+
+    By the triangle inequality ``d(v, t) >= d(L, t) - d(L, v)`` and
+    ``d(v, t) >= d(v, L) - d(t, L)`` for any landmark ``L``, which gives A*
+    (ALT) lower bounds much tighter than straight-line distance on street
+    networks with rivers, rail lines and one-way streets.
+    """
+
+    nodes: np.ndarray  # int64, dense ids of the landmarks
+    from_landmark: np.ndarray  # float64, (k, n), d(L, v)
+    to_landmark: np.ndarray  # float64, (k, n), d(v, L)
+
+    def lower_bounds(self, target: int) -> np.ndarray:
+        """Lower bound of the distance from every node to ``target``."""
+        with np.errstate(invalid="ignore"):
+            forward = self.from_landmark[:, [target]] - self.from_landmark
+            backward = self.to_landmark - self.to_landmark[:, [target]]
+        # inf - inf (both sides unreachable from a landmark) says nothing
+        bounds = np.fmax(forward, backward)
+        bounds[np.isnan(bounds)] = 0.0
+        return np.maximum(bounds.max(axis=0), 0.0)
+
+
+def build_landmarks(compiled: CompiledGraph, k: int = DEFAULT_LANDMARKS) -> Landmarks:
+    """Pick ``k`` landmarks spread over the graph by farthest-point selection."""
+    n = compiled.num_nodes
+    # csgraph may drop explicit zeros, which would overestimate distances
+    weights = np.maximum(compiled.lengths, 1e-6)
+    matrix = csr_array((weights, compiled.targets, compiled.offsets), (n, n))
+
+    # Start from the node farthest from an arbitrary one, then keep adding
+    # the node farthest from all landmarks chosen so far.
+    nodes: list[int] = []
+    rows: list[np.ndarray] = []
+    closest = dijkstra(matrix, indices=0)
+    for _ in range(min(k, n)):
+        reachable = np.where(np.isfinite(closest), closest, -1.0)
+        node = int(reachable.argmax())
+        if node in nodes:
+            break
+        nodes.append(node)
+        rows.append(dijkstra(matrix, indices=node))
+        closest = np.minimum(closest, rows[-1]) if len(nodes) > 1 else rows[-1]
+
+    return Landmarks(
+        nodes=np.array(nodes, dtype=np.int64),
+        from_landmark=np.vstack(rows),
+        to_landmark=np.atleast_2d(dijkstra(matrix.T.tocsr(), indices=nodes)),
+    )
+
+
+_landmarks: WeakKeyDictionary[CompiledGraph, Landmarks] = WeakKeyDictionary()
+_landmarks_lock = threading.Lock()
+
+
+def get_landmarks(compiled: CompiledGraph) -> Landmarks:
+    """Landmarks of ``compiled``, computed on first use and kept with it."""
+    with _landmarks_lock:
+        landmarks = _landmarks.get(compiled)
+    if landmarks is not None:
+        return landmarks
+
+    start = time.perf_counter()
+    landmarks = build_landmarks(compiled)
+    logger.info(
+        "Computed {} landmarks for {} nodes in {:.4f} sec.",
+        len(landmarks.nodes),
+        compiled.num_nodes,
+        time.perf_counter() - start,
+    )
+    with _landmarks_lock:
+        _landmarks[compiled] = landmarks
+    return landmarks
@@ -0,0 +1,367 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import networkx as nx
+import numpy as np
+from loguru import logger
+from redis.exceptions import RedisError
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import dijkstra
+
+from app.graph.compiled import CompiledGraph, get_compiled_graph
+from app.graph.spatial import SpatialIndex, get_spatial_index
+from app.redis import get_sync_binary_redis
+
+# Standard deviation of GPS noise, meters
+GPS_SIGMA = 10.0
+# Scale of the route vs straight-line distance difference between fixes, meters
+TRANSITION_BETA = 20.0
+# Candidate edges per fix and how far from the fix they may be, meters
+CANDIDATES = 8
+SEARCH_RADIUS = 50.0
+# Fixes closer than this to the previous kept one add nothing but work
+MIN_SPACING = 10.0
+# Backwards jitter along the same edge that still counts as standing still
+JITTER = GPS_SIGMA
+# Transitions whose route is this much longer than the straight line are dropped
+MAX_DETOUR = 500.0
+# Fixes further apart start a new matched piece (GPS off, train ride, ...)
+MAX_GAP = 2000.0
+# Fixes whose candidates and shortest paths are prepared together
+BATCH_SIZE = 256
+DIJKSTRA_CHUNK = 32
+# Bounded shortest-path trees kept between tracks of the same import
+MAX_TREES = 20_000
+
+# Bump when matching changes, so cached results are recomputed
+CACHE_VERSION = 1
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+REDIS_RETRY_SECONDS = 30
+
+
+@dataclass
+class _Tree:
+    """Shortest paths from one node, up to ``limit`` meters."""
+
+    limit: float
+    distances: dict[int, float]
+    predecessors: dict[int, int]
+
+
+@dataclass
+class _Chain:
+    """Viterbi state of the current unbroken piece of a track."""
+
+    edges: list[np.ndarray] = field(default_factory=list)
+    positions: list[np.ndarray] = field(default_factory=list)
+    back: list[np.ndarray] = field(default_factory=list)
+    scores: np.ndarray | None = None
+    point: np.ndarray | None = None
+
+
+def _thin(points: np.ndarray, spacing: float) -> np.ndarray:
+    """Drop points closer than ``spacing`` to the previously kept one."""
+    keep = []
+    last = None
+    for i, (x, y) in enumerate(points.tolist()):
+        if last is None or (x - last[0]) ** 2 + (y - last[1]) ** 2 >= spacing**2:
+            keep.append(i)
+            last = (x, y)
+    return points[keep]
+
+
+class MapMatcher:
+    """Hidden Markov map matching of GPS tracks (Newson & Krumm, 2009).
+
+    Hidden states are candidate edges near every fix, with emission
+    probabilities from the distance to the fix. Transitions score how well
+    the shortest route between two candidates agrees with the straight line
+    between their fixes. Viterbi picks the most likely sequence, which is
+    turned into a connected walk by filling in those shortest routes.
+
+    Tracks are processed in batches of fixes: candidates for a batch come
+    from one vectorized spatial query and all shortest paths it needs from
+    a few bounded multi-source Dijkstra calls. The bounded shortest-path
+    trees are kept (LRU) between tracks, so importing many activities over
+    the same streets mostly reuses them.
+    """
+
+    def __init__(self, compiled: CompiledGraph, index: SpatialIndex | None = None):
+        self.compiled = compiled
+        self.index = index or get_spatial_index(compiled)
+        n = compiled.num_nodes
+        self._matrix = csr_array(
+            (compiled.lengths, compiled.targets, compiled.offsets), (n, n)
+        )
+        self._sources = compiled.sources
+        self._targets = compiled.targets
+        self._lengths = compiled.lengths
+        self._trees: OrderedDict[int, _Tree] = OrderedDict()
+
+    def match(self, xs, ys) -> list[int]:
+        """Dense node walk best explaining the track ``(xs, ys)``.
+
+        Consecutive nodes are graph edges, except where the track had to be
+        split (long gaps, no plausible route between fixes).
+        """
+        if not self.compiled.num_edges or not len(xs):
+            return []
+        points = _thin(self.index.project(xs, ys), MIN_SPACING)
+        nodes: list[int] = []
+        chain = _Chain()
+        for start in range(0, len(points), BATCH_SIZE):
+            chain = self._match_batch(points[start : start + BATCH_SIZE], chain, nodes)
+        self._finish(chain, nodes)
+        return nodes
+
+    def _match_batch(
+        self, points: np.ndarray, chain: _Chain, nodes: list[int]
+    ) -> _Chain:
+        edges, distances, fractions = self.index.edge_candidates(
+            points, CANDIDATES, SEARCH_RADIUS
+        )
+        has_candidates = (edges >= 0).any(axis=1)
+        points = points[has_candidates]
+        edges, distances = edges[has_candidates], distances[has_candidates]
+        positions = fractions[has_candidates] * self._lengths[edges]
+        emissions = -0.5 * (distances / GPS_SIGMA) ** 2
+        if not len(points):
+            return chain
+        self._prepare_trees(points, edges, chain)
+
+        for i, point in enumerate(points):
+            valid = edges[i] >= 0
+            e, p, emission = edges[i][valid], positions[i][valid], emissions[i][valid]
+
+            if chain.scores is not None:
+                gap = float(np.linalg.norm(point - chain.point))
+                if gap <= MAX_GAP:
+                    transitions = self._transitions(
+                        chain.edges[-1], chain.positions[-1], e, p, gap
+                    )
+                    total = chain.scores[:, None] + transitions
+                    best = total.argmax(axis=0)
+                    scores = total[best, np.arange(len(e))] + emission
+                    if np.isfinite(scores).any():
+                        chain.edges.append(e)
+                        chain.positions.append(p)
+                        chain.back.append(best)
+                        chain.scores = scores
+                        chain.point = point
+                        continue
+                # Nothing explains the move, so start a new piece here
+                self._finish(chain, nodes)
+                chain = _Chain()
+
+            chain.edges.append(e)
+            chain.positions.append(p)
+            chain.scores = emission
+            chain.point = point
+        return chain
+
+    def _transitions(
+        self, ea: np.ndarray, pa: np.ndarray, eb: np.ndarray, pb: np.ndarray, gap: float
+    ) -> np.ndarray:
+        """Log transition probabilities, (len(ea), len(eb))."""
+        ta, sb = self._targets[ea].tolist(), self._sources[eb].tolist()
+        trees = {t: self._tree(t).distances for t in set(ta)}
+        between = np.array([[trees[t].get(s, np.inf) for s in sb] for t in ta]).reshape(
+            len(ta), len(sb)
+        )
+        route = (self._lengths[ea] - pa)[:, None] + between + pb[None, :]
+
+        along = pb[None, :] - pa[:, None]
+        same = (ea[:, None] == eb[None, :]) & (along >= -JITTER)
+        route = np.where(same, np.maximum(along, 0.0), route)
+
+        excess = np.abs(route - gap)
+        return np.where(excess <= MAX_DETOUR, -excess / TRANSITION_BETA, -np.inf)
+
+    def _prepare_trees(
+        self, points: np.ndarray, edges: np.ndarray, chain: _Chain
+    ) -> None:
+        """Build the bounded shortest-path trees a batch will look up.
+
+        Moving to a fix ``gap`` meters away needs trees from the previous
+        fix's candidate targets reaching ``gap + MAX_DETOUR``.
+        """
+        previous = points[:-1]
+        sources = [edges[:-1]]
+        if chain.point is not None:
+            previous = np.vstack((chain.point, previous))
+            last = np.full((1, edges.shape[1]), -1, dtype=edges.dtype)
+            last[0, : len(chain.edges[-1])] = chain.edges[-1]
+            sources.insert(0, last)
+        sources = np.vstack(sources)
+        gaps = np.linalg.norm(points[len(points) - len(previous) :] - previous, axis=1)
+        limits = np.broadcast_to(
+            (np.minimum(gaps, MAX_GAP) + MAX_DETOUR)[:, None], sources.shape
+        )
+
+        valid = sources >= 0
+        roots = self._targets[sources[valid]]
+        limits = limits[valid]
+        order = np.argsort(-limits, kind="stable")
+        pending: dict[int, float] = {}
+        for node, limit in zip(roots[order].tolist(), limits[order].tolist()):
+            tree = self._trees.get(node)
+            if tree is not None and tree.limit >= limit:
+                self._trees.move_to_end(node)
+            elif node not in pending:
+                pending[node] = limit
+
+        # Sorted by limit, so every chunk runs with its own largest limit
+        todo = list(pending.items())
+        for start in range(0, len(todo), DIJKSTRA_CHUNK):
+            chunk = todo[start : start + DIJKSTRA_CHUNK]
+            self._build_trees([node for node, _ in chunk], chunk[0][1])
+        while len(self._trees) > MAX_TREES:
+            self._trees.popitem(last=False)
+
+    def _build_trees(self, roots: list[int], limit: float) -> None:
+        dist, pred = dijkstra(
+            self._matrix, indices=roots, limit=limit, return_predecessors=True
+        )
+        for root, row, predecessors in zip(roots, dist, pred):
+            reached = np.flatnonzero(np.isfinite(row)).tolist()
+            self._trees[root] = _Tree(
+                limit,
+                dict(zip(reached, row[reached].tolist())),
+                dict(zip(reached, predecessors[reached].tolist())),
+            )
+            self._trees.move_to_end(root)
+
+    def _tree(self, node: int) -> _Tree:
+        if node not in self._trees:
+            # Only when a batch needed more trees than are kept
+            self._build_trees([node], MAX_GAP + MAX_DETOUR)
+        return self._trees[node]
+
+    def _path(self, source: int, target: int) -> list[int]:
+        """Nodes of the shortest route ``source`` -> ``target``, both included."""
+        predecessors = self._tree(source).predecessors
+        path = [target]
+        while path[-1] != source:
+            path.append(predecessors[path[-1]])
+        path.reverse()
+        return path
+
+    def _finish(self, chain: _Chain, nodes: list[int]) -> None:
+        """Backtrack the best state sequence of ``chain`` onto ``nodes``."""
+        if chain.scores is None:
+            return
+        state = int(chain.scores.argmax())
+        matched = []
+        for i in range(len(chain.edges) - 1, -1, -1):
+            matched.append(
+                (int(chain.edges[i][state]), float(chain.positions[i][state]))
+            )
+            if i:
+                state = int(chain.back[i - 1][state])
+        matched.reverse()
+
+        # An edge counts as walked once most of it is: the first one only if
+        # the track starts in its first half, the last one if it ends past it
+        first, start = matched[0]
+        walk = [int(self._targets[first])]
+        if start <= self._lengths[first] / 2:
+            walk.insert(0, int(self._sources[first]))
+        for (ea, pa), (eb, pb) in zip(matched, matched[1:]):
+            if ea == eb and pb >= pa - JITTER:
+                continue
+            walk.extend(self._path(int(self._targets[ea]), int(self._sources[eb]))[1:])
+            walk.append(int(self._targets[eb]))
+        last, end = matched[-1]
+        if len(walk) > 1 and end < self._lengths[last] / 2:
+            walk.pop()
+
+        if nodes and nodes[-1] == walk[0]:
+            walk = walk[1:]
+        nodes.extend(walk)
+
+
+class MatchCache:
+    """Matched node walks by GPX content hash, in Redis.
+
+    Walks are stored as OSM node ids, so they survive graph reloads; a walk
+    is only reused while all of its nodes are still in the graph.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def key(digest: str) -> str:
+        return f"mapmatch:v{CACHE_VERSION}:{digest}"
+
+    def _redis(self):
+        if time.monotonic() < self._redis_down_until:
+            return None
+        return get_sync_binary_redis()
+
+    def _redis_failed(self, e: RedisError) -> None:
+        logger.warning("Map matching cache Redis error, not caching: {}", e)
+        with self._lock:
+            self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+    def get(self, digest: str, compiled: CompiledGraph) -> list[int] | None:
+        client = self._redis()
+        if client is None:
+            return None
+        try:
+            data = client.get(self.key(digest))
+        except RedisError as e:
+            self._redis_failed(e)
+            return None
+        if data is None:
+            return None
+        nodes = np.frombuffer(data, dtype=np.int64)
+        if not np.isin(nodes, compiled.node_ids).all():
+            return None
+        return nodes.tolist()
+
+    def put(self, digest: str, nodes: list[int]) -> None:
+        client = self._redis()
+        if client is None:
+            return
+        data = np.asarray(nodes, dtype=np.int64).tobytes()
+        try:
+            client.set(self.key(digest), data, ex=CACHE_TTL_SECONDS)
+        except RedisError as e:
+            self._redis_failed(e)
+
+
+match_cache = MatchCache()
+
+
+def match_track(
+    graph: nx.MultiDiGraph,
+    xs,
+    ys,
+    digest: str | None = None,
+    matcher: MapMatcher | None = None,
+) -> list[int]:
+    """OSM node walk of a GPS track, cached by ``digest`` of its source file.
+
+    Pass one ``matcher`` for all tracks of an import to share its
+    shortest-path trees between them.
+    """
+    compiled = get_compiled_graph(graph)
+    if digest is not None:
+        cached = match_cache.get(digest, compiled)
+        if cached is not None:
+            return cached
+
+    matcher = matcher or MapMatcher(compiled)
+    nodes = compiled.to_osm(matcher.match(xs, ys))
+    if digest is not None:
+        match_cache.put(digest, nodes)
+    return nodes
@@ -0,0 +1,80 @@
+import threading
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Generic, TypeVar
+
+from loguru import logger
+from redis.exceptions import RedisError
+
+from app.redis import get_sync_redis
+
+T = TypeVar("T")
+
+
+@contextmanager
+def redis_lock(name: str, timeout: float) -> Iterator[None]:
+    """Lock shared by all workers; degrades to no lock when Redis is unreachable.
+
+    The lock expires after ``timeout`` seconds, so a crashed holder can't block
+    others forever. Waiting longer than ``timeout`` proceeds without the lock.
+    """
+    lock = get_sync_redis().lock(name, timeout=timeout, blocking_timeout=timeout)
+    try:
+        acquired = lock.acquire()
+    except RedisError as e:
+        logger.warning("Lock {} Redis error: {}", name, e)
+        acquired = False
+    else:
+        if not acquired:
+            logger.warning("Timed out waiting for lock {}", name)
+
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except RedisError as e:
+                logger.warning("Could not release lock {}: {}", name, e)
+
+
+class SingleFlight(Generic[T]):
+    """Coalesce concurrent calls per key, so only one of them does the work.
+
+    The first caller for a key runs ``fn`` while holding a Redis lock named
+    after the key; every other thread asking for the same key meanwhile waits
+    for that call and gets its result (or exception). Across workers the lock
+    serializes the calls, so ``fn`` should first look for a result stored by a
+    previous holder.
+    """
+
+    def __init__(self, lock_prefix: str, lock_timeout: float) -> None:
+        self.lock_prefix = lock_prefix
+        self.lock_timeout = lock_timeout
+        self._calls: dict[str, Future[T]] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            logger.debug("Waiting for in-flight {}", key)
+            return call.result()
+
+        try:
+            with redis_lock(self.lock_prefix + key, self.lock_timeout):
+                result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,183 @@
+import threading
+import time
+from dataclasses import dataclass
+from weakref import WeakKeyDictionary
+
+import networkx as nx
+import numpy as np
+import shapely
+from loguru import logger
+from scipy.spatial import cKDTree
+from shapely import STRtree
+
+from app.graph.compiled import EARTH_RADIUS, CompiledGraph, get_compiled_graph
+
+# Segments whose midpoints are nearest to a point, checked exactly for edge candidates
+EDGE_CANDIDATES = 16
+
+
+def _project(cos_lat: float, xs, ys) -> np.ndarray:
+    """(n, 2) local meters of lon/lat points."""
+    xs = np.radians(np.asarray(xs, dtype=np.float64))
+    ys = np.radians(np.asarray(ys, dtype=np.float64))
+    return np.column_stack((xs * cos_lat, ys)) * EARTH_RADIUS
+
+
+@dataclass(frozen=True, eq=False)
+class SpatialIndex:
+    """KD-trees over a compiled graph's nodes and edge segments.
+
+    Coordinates are projected to local meters (equirectangular around the
+    graph's mean latitude), which is accurate enough within a city and lets
+    one vectorized tree query snap thousands of points.
+
+    Edge bounding boxes are kept in an STRtree in lon/lat, for viewport
+    queries.
+    """
+
+    cos_lat: float
+    nodes: cKDTree
+    segments: cKDTree  # over segment midpoints
+    segment_edges: np.ndarray  # int64, edge id of every segment
+    segment_start: np.ndarray  # float64, (s, 2), meters
+    segment_end: np.ndarray  # float64, (s, 2), meters
+    segment_offset: np.ndarray  # float64, meters from the edge start to the segment
+    edge_extent: np.ndarray  # float64, projected length of every edge geometry
+    edge_boxes: STRtree  # over edge bounding boxes, lon/lat
+
+    def project(self, xs, ys) -> np.ndarray:
+        return _project(self.cos_lat, xs, ys)
+
+    def edges_in_bbox(
+        self, west: float, south: float, east: float, north: float
+    ) -> np.ndarray:
+        """Ids, ascending, of the edges whose bounding box meets the bbox."""
+        edges = self.edge_boxes.query(shapely.box(west, south, east, north))
+        return np.sort(edges).astype(np.int64)
+
+    def nearest_nodes(self, xs, ys) -> tuple[np.ndarray, np.ndarray]:
+        """Dense id of the nearest node to every point, and its distance."""
+        distances, nodes = self.nodes.query(self.project(xs, ys))
+        return nodes, distances
+
+    def _project_on_segments(
+        self, points: np.ndarray, k: int
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The ``k`` segments with the nearest midpoints to every point.
+
+        Returns (n, k) segment ids, distances from the point to the segment
+        and the projected point's position along the segment, 0 to 1.
+        """
+        k = min(k, len(self.segment_edges))
+        _, candidates = self.segments.query(points, k=k)
+        candidates = candidates.reshape(len(points), k)
+
+        a = self.segment_start[candidates]
+        ab = self.segment_end[candidates] - a
+        ap = points[:, None, :] - a
+        length2 = np.einsum("ijk,ijk->ij", ab, ab)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.clip(np.einsum("ijk,ijk->ij", ap, ab) / length2, 0.0, 1.0)
+        t = np.nan_to_num(t)
+        distances = np.linalg.norm(ap - t[..., None] * ab, axis=2)
+        return candidates, distances, t
+
+    def edge_candidates(
+        self, points: np.ndarray, k: int, radius: float
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Up to ``k`` distinct edges within ``radius`` meters of every point.
+
+        ``points`` are already projected. Returns (n, k) arrays, nearest
+        first and padded with edge -1 and distance inf: edge ids, distances,
+        and where along each edge the point projects to, as a fraction of
+        the edge geometry.
+        """
+        segments, distances, t = self._project_on_segments(points, 2 * EDGE_CANDIDATES)
+        edges = self.segment_edges[segments]
+        along = self.segment_offset[segments] + t * np.linalg.norm(
+            self.segment_end[segments] - self.segment_start[segments], axis=2
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fractions = np.nan_to_num(along / self.edge_extent[edges])
+
+        # Keep the closest segment of every edge, then the k closest edges
+        order = np.lexsort((distances, edges), axis=-1)
+        edges, distances, fractions = (
+            np.take_along_axis(a, order, axis=1) for a in (edges, distances, fractions)
+        )
+        duplicate = np.zeros_like(edges, dtype=bool)
+        duplicate[:, 1:] = edges[:, 1:] == edges[:, :-1]
+        distances = np.where(duplicate | (distances > radius), np.inf, distances)
+
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        edges, distances, fractions = (
+            np.take_along_axis(a, order, axis=1) for a in (edges, distances, fractions)
+        )
+        edges = np.where(np.isfinite(distances), edges, -1)
+        return edges, distances, fractions
+
+
+def build_spatial_index(compiled: CompiledGraph) -> SpatialIndex:
+    cos_lat = float(np.cos(np.radians(compiled.y.mean()))) if len(compiled.y) else 1.0
+
+    # Consecutive polyline points of the same edge form a segment
+    points = _project(cos_lat, compiled.geometry_x, compiled.geometry_y)
+    edges = np.repeat(
+        np.arange(compiled.num_edges, dtype=np.int64),
+        np.diff(compiled.geometry_offsets),
+    )
+    same_edge = edges[:-1] == edges[1:]
+    start, end = points[:-1][same_edge], points[1:][same_edge]
+    segment_edges = edges[:-1][same_edge]
+
+    # Cumulative length of every edge's segments, restarting at each edge
+    lengths = np.linalg.norm(end - start, axis=1)
+    cumulative = np.concatenate(([0.0], np.cumsum(lengths)))
+    first = np.searchsorted(segment_edges, np.arange(compiled.num_edges))
+    segment_offset = cumulative[:-1] - cumulative[first[segment_edges]]
+    edge_extent = np.bincount(
+        segment_edges, weights=lengths, minlength=compiled.num_edges
+    )
+
+    return SpatialIndex(
+        cos_lat=cos_lat,
+        nodes=cKDTree(_project(cos_lat, compiled.x, compiled.y)),
+        segments=cKDTree((start + end) / 2),
+        segment_edges=segment_edges,
+        segment_start=start,
+        segment_end=end,
+        segment_offset=segment_offset,
+        edge_extent=edge_extent,
+        edge_boxes=STRtree(shapely.box(*compiled.edge_bounds.T)),
+    )
+
+
+_indexes: WeakKeyDictionary[CompiledGraph, SpatialIndex] = WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def get_spatial_index(compiled: CompiledGraph) -> SpatialIndex:
+    """Spatial index of ``compiled``, built on first use and kept with it."""
+    with _indexes_lock:
+        index = _indexes.get(compiled)
+    if index is not None:
+        return index
+
+    start = time.perf_counter()
+    index = build_spatial_index(compiled)
+    logger.info(
+        "Built spatial index: {} nodes, {} segments in {:.4f} sec.",
+        compiled.num_nodes,
+        len(index.segment_edges),
+        time.perf_counter() - start,
+    )
+    with _indexes_lock:
+        _indexes[compiled] = index
+    return index
+
+
+def nearest_nodes(graph: nx.MultiDiGraph, xs, ys) -> list[int]:
+    """OSM id of the nearest node to every (x, y) point, in one batch."""
+    compiled = get_compiled_graph(graph)
+    nodes, _ = get_spatial_index(compiled).nearest_nodes(xs, ys)
+    return compiled.node_ids[nodes].tolist()
@@ -0,0 +1,174 @@
+import json
+import os
+import shutil
+import tempfile
+from dataclasses import fields
+from datetime import datetime, timezone
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+from loguru import logger
+
+from app.graph.compiled import (
+    CompiledGraph,
+    get_compiled_graph,
+    register_compiled_graph,
+)
+
+BBox = tuple[float, float, float, float]
+
+FORMAT_VERSION = 1
+ARRAYS = [f.name for f in fields(CompiledGraph)]
+
+
+def graph_from_compiled(compiled: CompiledGraph, crs: str) -> nx.MultiDiGraph:
+    """Rebuild a thin MultiDiGraph (coords and lengths only) from compiled arrays.
+
+    Edge geometry stays in the compiled arrays, so the returned graph must be
+    used together with the compiled form registered for it.
+    """
+    ids = compiled.osm_ids
+    G = nx.MultiDiGraph(crs=crs)
+    G.add_nodes_from(
+        (node, {"x": x, "y": y})
+        for node, x, y in zip(ids, compiled.x.tolist(), compiled.y.tolist())
+    )
+    G.add_edges_from(
+        (ids[u], ids[v], k, {"length": length})
+        for u, v, k, length in zip(
+            compiled.sources.tolist(),
+            compiled.targets.tolist(),
+            compiled.keys.tolist(),
+            compiled.lengths.tolist(),
+        )
+    )
+    return G
+
+
+class GraphStore:
+    """Compiled graphs on disk, one directory per bbox and network type.
+
+    Every array of ``CompiledGraph`` is a separate ``.npy`` file next to a
+    ``meta.json`` sidecar. Arrays are loaded with ``mmap_mode="r"``, so all
+    workers on a host share the page cache instead of each holding a copy.
+    Data derived from a graph, such as edge elevations, goes in named
+    subdirectories next to it (``save_arrays``/``load_arrays``).
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def key(self, bbox: BBox, network_type: str) -> str:
+        west, south, east, north = bbox
+        return f"{network_type}_{west:.6f}_{south:.6f}_{east:.6f}_{north:.6f}"
+
+    def path(self, bbox: BBox, network_type: str) -> Path:
+        return self.root / self.key(bbox, network_type)
+
+    def contains(self, bbox: BBox, network_type: str) -> bool:
+        return (self.path(bbox, network_type) / "meta.json").exists()
+
+    def load(self, bbox: BBox, network_type: str) -> nx.MultiDiGraph | None:
+        path = self.path(bbox, network_type)
+        meta_path = path / "meta.json"
+        if not meta_path.exists():
+            return None
+
+        meta = json.loads(meta_path.read_text())
+        if meta.get("version") != FORMAT_VERSION:
+            logger.warning(
+                "Ignoring stored graph {} with format version {}",
+                path.name,
+                meta.get("version"),
+            )
+            return None
+
+        compiled = CompiledGraph(
+            **{name: np.load(path / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+        )
+        G = graph_from_compiled(compiled, meta["crs"])
+        G.graph.update(bbox=tuple(meta["bbox"]), network_type=meta["network_type"])
+        register_compiled_graph(G, compiled)
+        logger.info(
+            "Loaded stored graph {}: {} nodes, {} edges",
+            path.name,
+            compiled.num_nodes,
+            compiled.num_edges,
+        )
+        return G
+
+    def save(self, bbox: BBox, network_type: str, graph: nx.MultiDiGraph) -> None:
+        compiled = get_compiled_graph(graph)
+        path = self.path(bbox, network_type)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        # Write next to the target and rename, so readers never see a partial
+        # directory and concurrent writers don't clobber each other.
+        tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.root))
+        try:
+            for name in ARRAYS:
+                np.save(
+                    tmp / f"{name}.npy", np.ascontiguousarray(getattr(compiled, name))
+                )
+            meta = {
+                "version": FORMAT_VERSION,
+                "bbox": list(bbox),
+                "network_type": network_type,
+                "crs": str(graph.graph.get("crs", "epsg:4326")),
+                "num_nodes": compiled.num_nodes,
+                "num_edges": compiled.num_edges,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+            (tmp / "meta.json").write_text(json.dumps(meta))
+        except OSError:
+            logger.exception("Could not store graph {}", path.name)
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            logger.debug("Graph {} already stored by another worker", path.name)
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        logger.info("Stored graph {}", path.name)
+
+    def load_arrays(
+        self, bbox: BBox, network_type: str, name: str
+    ) -> dict[str, np.ndarray] | None:
+        """Arrays stored with ``save_arrays``, memory-mapped; None if missing."""
+        path = self.path(bbox, network_type) / name
+        if not path.is_dir():
+            return None
+        try:
+            return {
+                file.stem: np.load(file, mmap_mode="r") for file in path.glob("*.npy")
+            }
+        except (OSError, ValueError):
+            logger.exception("Could not load {} of graph {}", name, path.parent.name)
+            return None
+
+    def save_arrays(
+        self, bbox: BBox, network_type: str, name: str, arrays: dict[str, np.ndarray]
+    ) -> None:
+        """Store data derived from a stored graph in its directory, under ``name``.
+
+        Nothing is written for graphs that are not in the store.
+        """
+        graph_path = self.path(bbox, network_type)
+        if not self.contains(bbox, network_type):
+            return
+        path = graph_path / name
+
+        tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=graph_path))
+        try:
+            for key, array in arrays.items():
+                np.save(tmp / f"{key}.npy", np.ascontiguousarray(array))
+            os.rename(tmp, path)
+        except OSError:
+            logger.debug("{} of graph {} not stored", name, graph_path.name)
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        logger.info("Stored {} of graph {}", name, graph_path.name)
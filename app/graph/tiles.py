@@ -0,0 +1,73 @@
+import math
+from dataclasses import dataclass
+
+import networkx as nx
+import osmnx as ox
+
+BBox = tuple[float, float, float, float]
+
+METERS_PER_DEGREE = 111_320
+
+
+@dataclass(frozen=True, order=True)
+class Tile:
+    """Cell ``(x, y)`` of a fixed lon/lat grid with ``size`` degree cells.
+
+    Tiles never move, so a tile is downloaded and stored once and then reused
+    by every request whose area touches it.
+    """
+
+    x: int
+    y: int
+    size: float
+
+    @property
+    def bbox(self) -> BBox:
+        return (
+            round(self.x * self.size, 6),
+            round(self.y * self.size, 6),
+            round((self.x + 1) * self.size, 6),
+            round((self.y + 1) * self.size, 6),
+        )
+
+
+def tiles_for_bbox(bbox: BBox, size: float) -> list[Tile]:
+    """Tiles covering ``bbox``, row by row from the south-west corner."""
+    west, south, east, north = bbox
+    return [
+        Tile(x, y, size)
+        for y in range(math.floor(south / size), math.floor(north / size) + 1)
+        for x in range(math.floor(west / size), math.floor(east / size) + 1)
+    ]
+
+
+def tiles_bbox(tiles: list[Tile]) -> BBox:
+    """Smallest bbox containing all ``tiles``."""
+    bboxes = [t.bbox for t in tiles]
+    return (
+        min(b[0] for b in bboxes),
+        min(b[1] for b in bboxes),
+        max(b[2] for b in bboxes),
+        max(b[3] for b in bboxes),
+    )
+
+
+def bbox_around(x: float, y: float, radius: float) -> BBox:
+    """Bbox of a circle with ``radius`` meters around a lon/lat point."""
+    dy = radius / METERS_PER_DEGREE
+    dx = radius / (METERS_PER_DEGREE * math.cos(math.radians(y)))
+    return (x - dx, y - dy, x + dx, y + dy)
+
+
+def stitch_tiles(tile_graphs: list[nx.MultiDiGraph]) -> nx.MultiDiGraph:
+    """Merge unsimplified tile graphs into one simplified street graph.
+
+    Tiles are fetched with ``truncate_by_edge``, so a street crossing a tile
+    border is present in both tiles with the same OSM node ids and composing
+    the graphs joins them. Simplification has to happen after stitching,
+    otherwise border nodes would already be merged away inside each tile.
+    """
+    G = nx.compose_all(tile_graphs)
+    G.graph.pop("simplified", None)
+    G = ox.simplify_graph(G)
+    return ox.truncate.largest_component(G)
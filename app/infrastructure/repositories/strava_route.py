@@ -0,0 +1,54 @@
+from collections.abc import AsyncIterator
+
+from loguru import logger
+from pymongo import ASCENDING
+from pymongo.asynchronous.collection import AsyncCollection
+
+# Listing fields only; coordinates and matched nodes are the bulk of a document
+SUMMARY_PROJECTION = {"_id": 0, "id": 1, "type": 1, "name": 1}
+FULL_PROJECTION = {"_id": 0}
+# Documents per round trip while streaming a whole collection
+STREAM_BATCH_SIZE = 100
+
+
+class MongoStravaRouteRepository:
+    """Imported routes, read through the async (pooled) Mongo client.
+
+    Listing is keyset-paginated on the activity ``id``: a page is the next
+    ``limit`` routes with ``id`` above the cursor, which stays cheap however
+    deep the page and doesn't skip or repeat routes while imports run.
+    """
+
+    def __init__(self, collection: AsyncCollection):
+        self.collection = collection
+
+    async def page(self, after: int | None, limit: int) -> list[dict]:
+        logger.debug("StravaRouteRepository.page: after={} limit={}", after, limit)
+        query = {} if after is None else {"id": {"$gt": after}}
+        cursor = (
+            self.collection.find(query, SUMMARY_PROJECTION)
+            .sort("id", ASCENDING)
+            .limit(limit)
+        )
+        return await cursor.to_list()
+
+    async def get(self, route_id: int) -> dict | None:
+        return await self.collection.find_one({"id": route_id}, FULL_PROJECTION)
+
+    async def stream(self) -> AsyncIterator[dict]:
+        """Every route with coordinates, one document at a time."""
+        cursor = (
+            self.collection.find({}, FULL_PROJECTION)
+            .sort("id", ASCENDING)
+            .batch_size(STREAM_BATCH_SIZE)
+        )
+        async for doc in cursor:
+            yield doc
+
+    async def nodes(self) -> AsyncIterator[list[int]]:
+        """Matched node walk of every route."""
+        cursor = self.collection.find({}, {"_id": 0, "nodes": 1}).batch_size(
+            STREAM_BATCH_SIZE
+        )
+        async for doc in cursor:
+            yield doc.get("nodes", [])
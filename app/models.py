@@ -1,5 +1,6 @@
 import uuid as uuid_pkg
 from datetime import datetime, timezone
+from typing import Literal
 
 from pydantic import BaseModel, computed_field
 from sqlalchemy import Column, String, text
@@ -49,6 +50,21 @@ class StravaRoute(BaseModel):
 
     ### Check if for every graph node id is the same
     nodes: list[int]
+    # SHA-256 of the imported GPX file, unchanged files are not imported again
+    content_hash: str | None = None
+
+
+class ImportJob(BaseModel):
+    job_id: str
+    status: Literal["running", "done", "failed"] = "running"
+    total: int = 0
+    processed: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    errors: dict[str, str] = {}
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
 
 
 class UUIDModel(SQLModel):
@@ -1,11 +1,14 @@
 from typing import Optional
 
+import redis
 from loguru import logger
 from redis.asyncio import Redis
 
 from app.settings import settings
 
 _redis_client: Optional[Redis] = None
+_sync_redis_client: Optional[redis.Redis] = None
+_sync_binary_redis_client: Optional[redis.Redis] = None
 
 
 def get_redis() -> Redis:
@@ -16,3 +19,27 @@ def get_redis() -> Redis:
             settings.REDIS_URL, encoding="utf-8", decode_responses=True
         )
     return _redis_client
+
+
+def get_sync_redis() -> redis.Redis:
+    """Blocking client for code running in the threadpool (sync endpoints)."""
+    global _sync_redis_client
+    if _sync_redis_client is None:
+        logger.info("Initializing sync Redis client at {}", settings.REDIS_URL)
+        _sync_redis_client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            encoding="utf-8",
+            decode_responses=True,
+            socket_connect_timeout=1,
+        )
+    return _sync_redis_client
+
+
+def get_sync_binary_redis() -> redis.Redis:
+    """Blocking client returning raw bytes, for binary values."""
+    global _sync_binary_redis_client
+    if _sync_binary_redis_client is None:
+        _sync_binary_redis_client = redis.Redis.from_url(
+            settings.REDIS_URL, socket_connect_timeout=1
+        )
+    return _sync_binary_redis_client
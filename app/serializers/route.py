@@ -0,0 +1,175 @@
+from enum import Enum
+
+import numpy as np
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from app.models import Route, Segment
+
+# Google's polyline precision (~1 m), which map libraries decode by default
+POLYLINE_PRECISION = 5
+# Delta arrays keep a decimal more (~0.1 m); int32 still covers any lon/lat
+DELTA_PRECISION = 6
+
+
+class RouteFormat(str, Enum):
+    json = "json"
+    polyline = "polyline"
+    delta = "delta"
+
+
+MEDIA_TYPES = {
+    RouteFormat.json: "application/json",
+    RouteFormat.polyline: "application/vnd.travelmap.polyline+json",
+    RouteFormat.delta: "application/vnd.travelmap.delta+json",
+}
+_FORMATS_BY_MEDIA_TYPE = {media: fmt for fmt, media in MEDIA_TYPES.items()}
+
+
+def negotiate_format(accept: str | None, format: RouteFormat | None) -> RouteFormat:
+    """Explicit ``format`` first, then the most preferred known Accept type."""
+    if format is not None:
+        return format
+    preferred = []
+    for i, item in enumerate((accept or "").split(",")):
+        media, *params = (part.strip() for part in item.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media in _FORMATS_BY_MEDIA_TYPE and q > 0:
+            preferred.append((-q, i, _FORMATS_BY_MEDIA_TYPE[media]))
+    return min(preferred)[2] if preferred else RouteFormat.json
+
+
+def quantize(values, precision: int) -> np.ndarray:
+    return np.round(np.asarray(values, dtype=np.float64) * 10**precision).astype(
+        np.int64
+    )
+
+
+def delta_encode(values, precision: int = 0) -> list[int]:
+    """First value, then differences, as ints scaled by ``10**precision``."""
+    return np.diff(quantize(values, precision), prepend=0).astype(np.int32).tolist()
+
+
+def delta_decode(deltas: list[int], precision: int = 0) -> list[float]:
+    return (np.cumsum(np.asarray(deltas, dtype=np.int64)) / 10**precision).tolist()
+
+
+def encode_polyline(lats, lngs, precision: int = POLYLINE_PRECISION) -> str:
+    """Google encoded polyline of the points, vectorized over all of them."""
+    points = np.column_stack((quantize(lats, precision), quantize(lngs, precision)))
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    values = deltas.ravel()
+    values = np.where(values < 0, ~(values << 1), values << 1)
+
+    # 5-bit chunks, low first; all but a value's last one carry 0x20
+    _, bits = np.frexp(values.astype(np.float64))
+    counts = np.maximum(1, (bits + 4) // 5)
+    chunk = np.arange(7)
+    chunks = (values[:, None] >> (5 * chunk)) & 0x1F
+    chunks |= np.where(chunk < counts[:, None] - 1, 0x20, 0)
+    chars = (chunks + 63)[chunk < counts[:, None]]
+    return chars.astype(np.uint8).tobytes().decode("ascii")
+
+
+def decode_polyline(
+    encoded: str, precision: int = POLYLINE_PRECISION
+) -> tuple[list[float], list[float]]:
+    values = []
+    value = shift = 0
+    for char in encoded.encode("ascii"):
+        chunk = char - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    points = np.cumsum(np.asarray(values, dtype=np.int64).reshape(-1, 2), axis=0)
+    points = points / 10**precision
+    return points[:, 0].tolist(), points[:, 1].tolist()
+
+
+class SegmentSpan(BaseModel):
+    """A run of consecutive edges that are all new or all walked before."""
+
+    new: bool
+    edges: int
+    distance: float
+
+
+def segment_spans(segments: list[Segment]) -> list[SegmentSpan]:
+    spans: list[SegmentSpan] = []
+    for segment in segments:
+        if spans and spans[-1].new == segment.new:
+            spans[-1].edges += 1
+            spans[-1].distance += segment.distance
+        else:
+            spans.append(
+                SegmentSpan(new=segment.new, edges=1, distance=segment.distance)
+            )
+    return spans
+
+
+class CompactRoute(BaseModel):
+    """``Route`` with the geometry encoded and segments run-length encoded.
+
+    The path is either ``polyline`` (lat/lng, ``precision`` decimals) or
+    ``x``/``y`` delta arrays (scaled by ``10**precision``). ``elevation``
+    is delta encoded in meters.
+    """
+
+    rec: tuple[float, float, float, float]
+    precision: int
+    polyline: str | None = None
+    x: list[int] | None = None
+    y: list[int] | None = None
+    distance: float
+    spans: list[SegmentSpan]
+    elevation: list[int]
+    total_gain: int
+    total_lose: int
+    total_new: float
+    total_old: float
+    percent_of_new: float
+
+
+def compact_route(route: Route, fmt: RouteFormat) -> CompactRoute:
+    if fmt == RouteFormat.polyline:
+        path = {
+            "precision": POLYLINE_PRECISION,
+            "polyline": encode_polyline(route.y, route.x),
+        }
+    else:
+        path = {
+            "precision": DELTA_PRECISION,
+            "x": delta_encode(route.x, DELTA_PRECISION),
+            "y": delta_encode(route.y, DELTA_PRECISION),
+        }
+    return CompactRoute(
+        rec=route.rec,
+        distance=route.distance,
+        spans=segment_spans(route.segments),
+        elevation=delta_encode(route.elevation),
+        total_gain=route.total_gain,
+        total_lose=route.total_lose,
+        total_new=route.total_new,
+        total_old=route.total_old,
+        percent_of_new=route.percent_of_new,
+        **path,
+    )
+
+
+def route_response(route: Route, fmt: RouteFormat) -> Route | Response:
+    """``route`` as is for JSON, otherwise a response in the compact format."""
+    if fmt == RouteFormat.json:
+        return route
+    compact = compact_route(route, fmt)
+    return JSONResponse(
+        compact.model_dump(exclude_none=True), media_type=MEDIA_TYPES[fmt]
+    )
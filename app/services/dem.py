@@ -0,0 +1,331 @@
+import math
+import re
+import struct
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+# SRTM void value
+HGT_NODATA = -32768
+_HGT_NAME = re.compile(r"^([NS])(\d{2})([EW])(\d{3})", re.IGNORECASE)
+
+# TIFF tags and GeoTIFF keys read by open_geotiff
+_IMAGE_WIDTH = 256
+_IMAGE_LENGTH = 257
+_BITS_PER_SAMPLE = 258
+_COMPRESSION = 259
+_STRIP_OFFSETS = 273
+_SAMPLES_PER_PIXEL = 277
+_STRIP_BYTE_COUNTS = 279
+_TILE_WIDTH = 322
+_SAMPLE_FORMAT = 339
+_MODEL_PIXEL_SCALE = 33550
+_MODEL_TIEPOINT = 33922
+_GEO_KEY_DIRECTORY = 34735
+_GDAL_NODATA = 42113
+_GT_MODEL_TYPE = 1024
+_GT_RASTER_TYPE = 1025
+_MODEL_TYPE_GEOGRAPHIC = 2
+_RASTER_PIXEL_IS_POINT = 2
+
+# TIFF field type -> (numpy type, size)
+_TIFF_TYPES = {
+    1: ("u1", 1),
+    2: ("S1", 1),
+    3: ("u2", 2),
+    4: ("u4", 4),
+    6: ("i1", 1),
+    8: ("i2", 2),
+    9: ("i4", 4),
+    11: ("f4", 4),
+    12: ("f8", 8),
+}
+# (SampleFormat, BitsPerSample) -> numpy type
+_SAMPLE_TYPES = {
+    (1, 8): "u1",
+    (1, 16): "u2",
+    (2, 16): "i2",
+    (2, 32): "i4",
+    (3, 32): "f4",
+    (3, 64): "f8",
+}
+
+
+@dataclass(frozen=True, eq=False)
+class DemRaster:
+    """A single-band lon/lat elevation grid, memory-mapped from disk.
+
+    ``west``/``north`` are the coordinates of the first sample (row 0 is the
+    northern edge) and ``dx``/``dy`` the sample spacing in degrees. Points
+    up to ``pad`` samples beyond the outer ones take the outer values, as
+    pixel-is-area rasters cover half a pixel past their pixel centres.
+    """
+
+    data: np.ndarray  # (rows, cols), memory-mapped
+    west: float
+    north: float
+    dx: float
+    dy: float
+    nodata: float | None = None
+    pad: float = 0.0
+
+    @property
+    def bounds(self) -> tuple[float, float, float, float]:
+        """``west, south, east, north`` of the area the samples cover."""
+        rows, cols = self.data.shape
+        return (
+            self.west - self.pad * self.dx,
+            self.north - (rows - 1 + self.pad) * self.dy,
+            self.west + (cols - 1 + self.pad) * self.dx,
+            self.north + self.pad * self.dy,
+        )
+
+    def sample(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """Bilinear elevation at every point; NaN outside the raster or on voids.
+
+        Only the four samples around each point are read from the mapped
+        file. Void samples are left out and the others reweighted.
+        """
+        rows, cols = self.data.shape
+        col = (np.asarray(lons, dtype=np.float64) - self.west) / self.dx
+        row = (self.north - np.asarray(lats, dtype=np.float64)) / self.dy
+        pad = self.pad
+        inside = (col >= -pad) & (col <= cols - 1 + pad)
+        inside &= (row >= -pad) & (row <= rows - 1 + pad)
+        result = np.full(len(col), np.nan)
+        if not inside.any():
+            return result
+
+        col = np.clip(col[inside], 0, cols - 1)
+        row = np.clip(row[inside], 0, rows - 1)
+        c0 = np.minimum(col.astype(np.int64), cols - 2)
+        r0 = np.minimum(row.astype(np.int64), rows - 2)
+        fc, fr = col - c0, row - r0
+
+        values = np.stack(
+            (
+                self.data[r0, c0],
+                self.data[r0, c0 + 1],
+                self.data[r0 + 1, c0],
+                self.data[r0 + 1, c0 + 1],
+            )
+        ).astype(np.float64)
+        weights = np.stack(((1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc))
+        void = np.isnan(values)
+        if self.nodata is not None:
+            void |= values == self.nodata
+        weights[void] = 0.0
+        values[void] = 0.0
+
+        total = weights.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[inside] = (weights * values).sum(axis=0) / total
+        return result
+
+
+def open_hgt(path: Path) -> DemRaster:
+    """SRTM ``.hgt`` tile: big-endian int16 samples, named by its SW corner."""
+    match = _HGT_NAME.match(path.name)
+    if match is None:
+        raise ValueError(f"{path.name} is not named like N51E019.hgt")
+    ns, lat, ew, lon = match.groups()
+    south = int(lat) * (1 if ns.upper() == "N" else -1)
+    west = int(lon) * (1 if ew.upper() == "E" else -1)
+
+    size = math.isqrt(path.stat().st_size // 2)
+    if size < 2 or size * size * 2 != path.stat().st_size:
+        raise ValueError(f"{path.name} is not a square grid of int16 samples")
+    data = np.memmap(path, dtype=">i2", mode="r", shape=(size, size))
+    step = 1 / (size - 1)
+    return DemRaster(data, west, south + 1, step, step, HGT_NODATA)
+
+
+def _read_tiff_tags(path: Path) -> tuple[str, dict[int, np.ndarray | str]]:
+    """Byte order and first-IFD tags of a classic (not Big) TIFF."""
+    with path.open("rb") as f:
+        header = f.read(8)
+        if header[:4] == b"II*\0":
+            order = "<"
+        elif header[:4] == b"MM\0*":
+            order = ">"
+        else:
+            raise ValueError(f"{path.name} is not a classic TIFF")
+        (ifd,) = struct.unpack(order + "I", header[4:])
+
+        f.seek(ifd)
+        (count,) = struct.unpack(order + "H", f.read(2))
+        entries = f.read(12 * count)
+        tags: dict[int, np.ndarray | str] = {}
+        for i in range(count):
+            tag, kind, n, inline = struct.unpack_from(order + "HHI4s", entries, 12 * i)
+            if kind not in _TIFF_TYPES:
+                continue
+            dtype, size = _TIFF_TYPES[kind]
+            if n * size <= 4:
+                raw = inline[: n * size]
+            else:
+                f.seek(struct.unpack(order + "I", inline)[0])
+                raw = f.read(n * size)
+            if kind == 2:
+                tags[tag] = raw.rstrip(b"\0").decode("ascii")
+            else:
+                tags[tag] = np.frombuffer(raw, dtype=order + dtype)
+    return order, tags
+
+
+def _geo_keys(tags: dict[int, np.ndarray | str]) -> dict[int, int]:
+    keys = tags.get(_GEO_KEY_DIRECTORY)
+    if keys is None:
+        return {}
+    # Header of 4 shorts, then (key, location, count, value) per key;
+    # only short values stored inline (location 0) are needed here
+    entries = np.asarray(keys[4:], dtype=np.int64).reshape(-1, 4)
+    return {int(k): int(v) for k, loc, _, v in entries if loc == 0}
+
+
+def open_geotiff(path: Path) -> DemRaster:
+    """Uncompressed, stripped, single-band lon/lat GeoTIFF.
+
+    Those store the grid as one contiguous block, so it is memory-mapped
+    in place. Convert other rasters with
+    ``gdal_translate -co COMPRESS=NONE -co TILED=NO -a_srs EPSG:4326``.
+    """
+    order, tags = _read_tiff_tags(path)
+
+    def tag(code: int, default=None):
+        value = tags.get(code)
+        if value is None:
+            if default is None:
+                raise ValueError(f"{path.name} has no TIFF tag {code}")
+            return default
+        return value
+
+    if int(tag(_COMPRESSION, [1])[0]) != 1 or _TILE_WIDTH in tags:
+        raise ValueError(f"{path.name} is compressed or tiled")
+    if int(tag(_SAMPLES_PER_PIXEL, [1])[0]) != 1:
+        raise ValueError(f"{path.name} has more than one band")
+    sample = (int(tag(_SAMPLE_FORMAT, [1])[0]), int(tag(_BITS_PER_SAMPLE)[0]))
+    if sample not in _SAMPLE_TYPES:
+        raise ValueError(f"{path.name} has unsupported samples {sample}")
+
+    keys = _geo_keys(tags)
+    if keys.get(_GT_MODEL_TYPE, _MODEL_TYPE_GEOGRAPHIC) != _MODEL_TYPE_GEOGRAPHIC:
+        raise ValueError(f"{path.name} is not in lon/lat coordinates")
+
+    cols, rows = int(tag(_IMAGE_WIDTH)[0]), int(tag(_IMAGE_LENGTH)[0])
+    offsets = np.asarray(tag(_STRIP_OFFSETS), dtype=np.int64)
+    counts = np.asarray(tag(_STRIP_BYTE_COUNTS), dtype=np.int64)
+    if (offsets[1:] != offsets[:-1] + counts[:-1]).any():
+        raise ValueError(f"{path.name} strips are not contiguous")
+    if rows < 2 or cols < 2:
+        raise ValueError(f"{path.name} is smaller than 2x2")
+    data = np.memmap(
+        path,
+        dtype=order + _SAMPLE_TYPES[sample],
+        mode="r",
+        offset=int(offsets[0]),
+        shape=(rows, cols),
+    )
+
+    dx, dy = (float(v) for v in tag(_MODEL_PIXEL_SCALE)[:2])
+    i, j, _, x, y, _ = (float(v) for v in tag(_MODEL_TIEPOINT)[:6])
+    west, north = x - i * dx, y + j * dy
+    pad = 0.0
+    if keys.get(_GT_RASTER_TYPE) != _RASTER_PIXEL_IS_POINT:
+        # The tiepoint is a pixel corner; samples are at pixel centres
+        west, north, pad = west + dx / 2, north - dy / 2, 0.5
+
+    nodata = tags.get(_GDAL_NODATA)
+    return DemRaster(
+        data, west, north, dx, dy, float(nodata) if nodata is not None else None, pad
+    )
+
+
+def open_raster(path: Path) -> DemRaster:
+    if path.suffix.lower() == ".hgt":
+        return open_hgt(path)
+    return open_geotiff(path)
+
+
+class DemReader:
+    """Elevations sampled from a directory of SRTM and GeoTIFF rasters.
+
+    The directory is indexed on first use by the 1 degree cells each
+    raster covers. Rasters are memory-mapped and the most recently used
+    ``max_tiles`` of them are kept open, so a lookup touches only the
+    pages around its points and needs no network.
+    """
+
+    PATTERNS = ("*.hgt", "*.tif", "*.tiff")
+
+    def __init__(self, root: Path, max_tiles: int) -> None:
+        self.root = root
+        self.max_tiles = max_tiles
+        self._cells: dict[tuple[int, int], list[Path]] | None = None
+        self._rasters: OrderedDict[Path, DemRaster] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self) -> dict[tuple[int, int], list[Path]]:
+        with self._lock:
+            if self._cells is not None:
+                return self._cells
+
+        cells: dict[tuple[int, int], list[Path]] = {}
+        paths = sorted(p for pattern in self.PATTERNS for p in self.root.rglob(pattern))
+        for path in paths:
+            try:
+                west, south, east, north = open_raster(path).bounds
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping DEM raster {}: {}", path, e)
+                continue
+            for cx in range(math.floor(west), math.floor(east) + 1):
+                for cy in range(math.floor(south), math.floor(north) + 1):
+                    cells.setdefault((cx, cy), []).append(path)
+        logger.info("Indexed {} DEM rasters in {}", len(paths), self.root)
+
+        with self._lock:
+            self._cells = cells
+        return cells
+
+    def _raster(self, path: Path) -> DemRaster:
+        with self._lock:
+            raster = self._rasters.get(path)
+            if raster is not None:
+                self._rasters.move_to_end(path)
+                return raster
+
+        raster = open_raster(path)
+        with self._lock:
+            self._rasters[path] = raster
+            while len(self._rasters) > self.max_tiles:
+                self._rasters.popitem(last=False)
+        return raster
+
+    def lookup(self, xs, ys) -> np.ndarray:
+        """Elevation in meters at every (x, y) point, NaN where no raster has one."""
+        lons = np.asarray(xs, dtype=np.float64)
+        lats = np.asarray(ys, dtype=np.float64)
+        result = np.full(len(lons), np.nan)
+        if not len(lons):
+            return result
+
+        index = self._index()
+        cells = np.column_stack((np.floor(lons), np.floor(lats))).astype(np.int64)
+        unique, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        for k, (cx, cy) in enumerate(unique.tolist()):
+            points = np.flatnonzero(inverse == k)
+            for path in index.get((cx, cy), []):
+                points = points[np.isnan(result[points])]
+                if not len(points):
+                    break
+                result[points] = self._raster(path).sample(lons[points], lats[points])
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            self._rasters.clear()
@@ -1,52 +1,347 @@
-import requests
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Protocol
+
+import httpx
+import numpy as np
 from loguru import logger
+from redis.exceptions import RedisError
+from starlette.concurrency import run_in_threadpool
+
+from app import utils
+from app.redis import get_redis
+from app.services.dem import DemReader
+from app.settings import settings
+
+# Points are cached and deduplicated at 1e-5 degrees, about a meter
+QUANTIZE_PRECISION = 5
+# Locations per request to the HTTP service
+BATCH_SIZE = 512
+# Requests in flight to the HTTP service; also its connection pool size
+MAX_CONNECTIONS = 4
+HTTP_TIMEOUT_SECONDS = 10
+CACHE_VERSION = 1
+CACHE_TTL_SECONDS = 90 * 24 * 3600
+# Points no backend knows, failed requests included, are retried after this
+MISS_TTL_SECONDS = 3600
+REDIS_RETRY_SECONDS = 30
+# Keys per Redis MGET or pipeline round trip
+REDIS_BATCH_SIZE = 1000
+
+
+class ElevationBackend(Protocol):
+    name: str
+
+    async def lookup(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Elevation in meters at every (x, y) point, NaN where unknown."""
+        ...
+
+    async def close(self) -> None: ...
+
+
+class DemElevationBackend:
+    """Local rasters; sampling reads mapped files, so it runs in the threadpool."""
+
+    name = "dem"
+
+    def __init__(self, reader: DemReader) -> None:
+        self.reader = reader
+
+    async def lookup(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        return await run_in_threadpool(self.reader.lookup, xs, ys)
+
+    async def close(self) -> None:
+        self.reader.close()
+
+
+class HttpElevationBackend:
+    """Open-Elevation compatible ``/api/v1/lookup`` service.
+
+    Points go out in ``BATCH_SIZE`` requests, concurrently over a pooled
+    connection; a failed batch leaves its points unknown.
+    """
+
+    name = "http"
+
+    def __init__(self, url: str, client: httpx.AsyncClient | None = None) -> None:
+        self.url = url
+        self.client = client or httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+            ),
+        )
+
+    async def _batch(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        result = np.full(len(xs), np.nan)
+        locations = [
+            {"latitude": y, "longitude": x} for x, y in zip(xs.tolist(), ys.tolist())
+        ]
+        try:
+            response = await self.client.post(self.url, json={"locations": locations})
+            response.raise_for_status()
+            results = response.json()["results"]
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            logger.warning("Elevation service {} failed: {}", self.url, e)
+            return result
+
+        # Results come back in request order
+        for i, r in enumerate(results[: len(result)]):
+            if r.get("elevation") is not None:
+                result[i] = r["elevation"]
+        return result
+
+    async def lookup(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        if not len(xs):
+            return np.empty(0)
+        starts = range(0, len(xs), BATCH_SIZE)
+        batches = await asyncio.gather(
+            *(
+                self._batch(xs[i : i + BATCH_SIZE], ys[i : i + BATCH_SIZE])
+                for i in starts
+            )
+        )
+        return np.concatenate(batches)
+
+    async def close(self) -> None:
+        logger.debug("Closing elevation service client")
+        await self.client.aclose()
+
+
+class ElevationCache:
+    """Elevations of quantized points: an in-process LRU in front of Redis.
+
+    Points are keyed by backend name and integer coordinates, so routes
+    through the same streets, from any worker, reuse earlier lookups.
+    Unknown elevations are cached as NaN for ``MISS_TTL_SECONDS``, so points
+    outside the backend's coverage are not asked for on every request.
+    """
+
+    def __init__(self, max_points: int) -> None:
+        self.max_points = max_points
+        # (elevation, monotonic expiry); misses expire, known points do not
+        self._points: OrderedDict[tuple[str, int, int], tuple[float, float]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+
+    @staticmethod
+    def key(backend: str, qx: int, qy: int) -> str:
+        return f"elevation:v{CACHE_VERSION}:{backend}:{qx}:{qy}"
+
+    def _redis(self):
+        if time.monotonic() < self._redis_down_until:
+            return None
+        return get_redis()
 
-from app.utils import time_measure_decorator
+    def _redis_failed(self, e: RedisError) -> None:
+        logger.warning("Elevation cache Redis error, caching in process only: {}", e)
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+    async def get(
+        self, backend: str, points: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Cached elevation of every (qx, qy) point and which points were cached.
+
+        Elevations are NaN where unknown, cached misses included.
+        """
+        result, cached, keys = await run_in_threadpool(self._local, backend, points)
+        missing = np.flatnonzero(~cached)
+        client = self._redis()
+        if not len(missing) or client is None:
+            return result, cached
+        values = []
+        try:
+            for i in range(0, len(keys), REDIS_BATCH_SIZE):
+                values += await client.mget(keys[i : i + REDIS_BATCH_SIZE])
+        except RedisError as e:
+            self._redis_failed(e)
+            return result, cached
+
+        await run_in_threadpool(
+            self._found, backend, points, missing, values, result, cached
+        )
+        return result, cached
+
+    def _local(
+        self, backend: str, points: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, list[str]]:
+        """Elevations from the process cache, and Redis keys of the rest."""
+        result = np.full(len(points), np.nan)
+        cached = np.zeros(len(points), dtype=bool)
+        pairs = [tuple(p) for p in points.tolist()]
+        now = time.monotonic()
+        with self._lock:
+            for i, (qx, qy) in enumerate(pairs):
+                entry = self._points.get((backend, qx, qy))
+                if entry is not None and entry[1] > now:
+                    self._points.move_to_end((backend, qx, qy))
+                    result[i], cached[i] = entry[0], True
+        keys = [self.key(backend, *pairs[i]) for i in np.flatnonzero(~cached).tolist()]
+        return result, cached, keys
+
+    def _found(
+        self,
+        backend: str,
+        points: np.ndarray,
+        missing: np.ndarray,
+        values: list,
+        result: np.ndarray,
+        cached: np.ndarray,
+    ) -> None:
+        # Misses are stored as "nan", which float() reads back as NaN
+        found = [(i, float(v)) for i, v in zip(missing.tolist(), values) if v]
+        for i, elevation in found:
+            result[i], cached[i] = elevation, True
+        self._remember(
+            backend,
+            [(tuple(points[i].tolist()), elevation) for i, elevation in found],
+        )
+
+    async def put(self, backend: str, points: np.ndarray, elevations: np.ndarray):
+        if not len(points):
+            return
+        commands = await run_in_threadpool(self._commands, backend, points, elevations)
+
+        client = self._redis()
+        if client is None:
+            return
+        try:
+            for i in range(0, len(commands), REDIS_BATCH_SIZE):
+                async with client.pipeline(transaction=False) as pipe:
+                    for key, value, ttl in commands[i : i + REDIS_BATCH_SIZE]:
+                        pipe.set(key, value, ex=ttl)
+                    await pipe.execute()
+        except RedisError as e:
+            self._redis_failed(e)
+
+    def _commands(
+        self, backend: str, points: np.ndarray, elevations: np.ndarray
+    ) -> list[tuple[str, str, int]]:
+        """Remember the points in process; their Redis (key, value, ttl)."""
+        items = list(zip((tuple(p) for p in points.tolist()), elevations.tolist()))
+        self._remember(backend, items)
+        return [
+            (
+                self.key(backend, qx, qy),
+                f"{elevation:.1f}",
+                MISS_TTL_SECONDS if np.isnan(elevation) else CACHE_TTL_SECONDS,
+            )
+            for (qx, qy), elevation in items
+        ]
+
+    def _remember(self, backend: str, items: list) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for (qx, qy), elevation in items:
+                expires = now + MISS_TTL_SECONDS if np.isnan(elevation) else np.inf
+                self._points[(backend, qx, qy)] = (elevation, expires)
+                self._points.move_to_end((backend, qx, qy))
+            while len(self._points) > self.max_points:
+                self._points.popitem(last=False)
+
+
+elevation_cache = ElevationCache(settings.ELEVATION_CACHE_POINTS)
+
+_backend: ElevationBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_elevation_backend() -> ElevationBackend | None:
+    """Process-wide backend picked by ``ELEVATION_BACKEND``; None when "none"."""
+    global _backend
+    with _backend_lock:
+        if _backend is None and settings.ELEVATION_BACKEND == "dem":
+            _backend = DemElevationBackend(
+                DemReader(utils.ROOT_PATH / settings.DEM_DIR, settings.DEM_CACHE_TILES)
+            )
+        elif _backend is None and settings.ELEVATION_BACKEND == "http":
+            _backend = HttpElevationBackend(settings.ELEVATION_URL)
+        return _backend
+
+
+async def close_elevation_backend() -> None:
+    global _backend
+    with _backend_lock:
+        backend, _backend = _backend, None
+    if backend is not None:
+        await backend.close()
 
 
 class ElevationService:
-    # TODO add injector
-    def __init__(self, session: requests.Session | None = None) -> None:
-        self.session = session or requests.session()
-
-    # TODO make it async
-    def close(self):
-        logger.debug("Closing ElevationService session")
-        self.session.close()
-
-    @time_measure_decorator("Getting elevation took: ")
-    def get(self, cords: list[tuple[float, float]]) -> dict[tuple[float, float], int]:
-        logger.debug("Elevation request for {} points", len(cords))
-        # TODO handle not working
-        return {}
-
-        # TODO Handle empty cords
-        with self.session as s:
-            response = s.post(
-                "http://host.docker.internal:8080/api/v1/lookup",
-                json={"locations": [{"latitude": x, "longitude": y} for x, y in cords]},
+    def __init__(
+        self,
+        backend: ElevationBackend | None = None,
+        cache: ElevationCache | None = None,
+    ) -> None:
+        self.backend = backend or get_elevation_backend()
+        self.cache = cache or elevation_cache
+
+    async def elevations(self, xs, ys, cache: bool = True) -> np.ndarray:
+        """Elevation in meters of every (x, y) point, in input order.
+
+        Points are quantized and deduplicated, looked up in the cache, and
+        only the misses go to the backend. NaN where no source knows the
+        point. Whole-graph lookups, which are kept per graph, pass
+        ``cache=False`` and go straight to the backend.
+        """
+        if not len(xs) or self.backend is None:
+            return np.full(len(xs), np.nan)
+
+        with utils.time_measure("Getting elevation took: "):
+            scale = 10**QUANTIZE_PRECISION
+            points, inverse = await run_in_threadpool(_unique_points, xs, ys, scale)
+
+            name = self.backend.name
+            if cache:
+                elevations, cached = await self.cache.get(name, points)
+            else:
+                elevations = np.full(len(points), np.nan)
+                cached = np.zeros(len(points), dtype=bool)
+            missing = np.flatnonzero(~cached)
+            if len(missing):
+                found = await self.backend.lookup(
+                    points[missing, 0] / scale, points[missing, 1] / scale
+                )
+                elevations[missing] = found
+                if cache:
+                    await self.cache.put(name, points[missing], found)
+            logger.debug(
+                "Elevation for {} points: {} unique, {} from the backend",
+                len(xs),
+                len(points),
+                len(missing),
             )
-            result = response.json()
-
-        res = {
-            (r["latitude"], r["longitude"]): r["elevation"] for r in result["results"]
-        }
-        logger.debug("Elevation got {} results", len(res))
-        return res
-
-    def covert_to_list(self, result: dict[tuple[float, float], int]) -> list[int]:
-        return list(result.values())
-
-    def calculate_total_gain_lose(self, elevation: list[int]) -> tuple[int, int]:
-        total_gain = 0
-        total_lose = 0
-        for i, j in zip(elevation[:-1], elevation[1:]):
-            diff = j - i
-
-            if diff > 0:
-                total_gain += diff
-            elif diff < 0:
-                total_lose += abs(diff)
-
-        logger.debug("Elevation total_gain={}, total_lose={}", total_gain, total_lose)
-        return total_gain, total_lose
+        return elevations[inverse]
+
+    async def profile(self, xs: list[float], ys: list[float]) -> list[int]:
+        """Elevation along one path of (x, y) points, gaps interpolated."""
+        return fill_profile(await self.elevations(xs, ys))
+
+
+def _unique_points(xs, ys, scale: int) -> tuple[np.ndarray, np.ndarray]:
+    """Distinct quantized (qx, qy) points and where each input point went."""
+    quantized = np.column_stack(
+        (np.round(np.asarray(xs) * scale), np.round(np.asarray(ys) * scale))
+    ).astype(np.int64)
+    points, inverse = np.unique(quantized, axis=0, return_inverse=True)
+    return points, inverse.ravel()
+
+
+def fill_profile(profile: np.ndarray) -> list[int]:
+    """Whole meters along a path, empty when no point is known.
+
+    Unknown points take the elevation interpolated from their neighbours on
+    the path, so only pass points that follow each other.
+    """
+    known = ~np.isnan(profile)
+    if not known.any():
+        return []
+    if not known.all():
+        index = np.arange(len(profile))
+        profile = np.interp(index, index[known], profile[known])
+    return np.rint(profile).astype(np.int64).tolist()
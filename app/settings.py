@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -10,6 +12,8 @@ class Settings(BaseSettings):
     URL_PREFIX: str
     SENTRY_SDK: str
     MONGO_URL: str
+    # Connections per app worker of the async Mongo client
+    MONGO_MAX_POOL_SIZE: int = 50
     NOMINATIM_USER_AGENT: str
     NOMINATIM_URL: str
     NOMINATIM_REVERSE_URL: str
@@ -24,6 +28,35 @@ class Settings(BaseSettings):
 
     PROMETHEUS_MULTIPROC_DIR: str
 
+    GRAPH_STORE_DIR: str = "data/graphs"
+    # Never download graphs, serve only what is already in GRAPH_STORE_DIR
+    GRAPH_STORE_OFFLINE: bool = False
+    GRAPH_CACHE_MAX_MB: int = 1024
+    # Graphs are downloaded in tiles of this size and stitched per request
+    GRAPH_TILE_DEG: float = 0.05
+    # How long other workers wait for (and a crashed worker holds) a graph download
+    GRAPH_FETCH_LOCK_TIMEOUT: int = 120
+    # Route generation worker processes, 0 means one per CPU
+    ROUTE_WORKERS: int = 0
+    # Jobs allowed to wait for a busy worker before requests get 503
+    ROUTE_QUEUE_SIZE: int = 32
+    ROUTE_JOB_TIMEOUT: float = 60
+    # GPX import worker processes, 0 means one per CPU
+    IMPORT_WORKERS: int = 0
+    # Users whose visited edges are kept in process memory
+    VISITED_CACHE_USERS: int = 1000
+    # Rendered visited-edge vector tiles kept in process memory
+    TILE_CACHE_SIZE: int = 4096
+    # "dem" (local rasters in DEM_DIR), "http" (ELEVATION_URL) or "none"
+    ELEVATION_BACKEND: Literal["dem", "http", "none"] = "dem"
+    # SRTM .hgt and uncompressed lon/lat GeoTIFF rasters
+    DEM_DIR: str = "data/dem"
+    # DEM rasters kept memory-mapped at a time
+    DEM_CACHE_TILES: int = 16
+    ELEVATION_URL: str = "http://host.docker.internal:8080/api/v1/lookup"
+    # Point elevations kept in process memory, in front of the Redis cache
+    ELEVATION_CACHE_POINTS: int = 200_000
+
     MAIL_USERNAME: str = ""
     MAIL_PASSWORD: SecretStr = SecretStr("")
     MAIL_FROM: str = "app@example.com"
@@ -0,0 +1,276 @@
+import multiprocessing as mp
+import threading
+import uuid
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import gpxpy
+import networkx as nx
+from loguru import logger
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+from app.graph.compiled import get_compiled_graph, prepare_graph
+from app.graph.map_matching import MapMatcher, match_cache, match_track
+from app.graph.store import GraphStore
+from app.models import ImportJob, StravaRoute
+
+BBox = tuple[float, float, float, float]
+
+# Matched routes written to Mongo per bulk request
+BULK_SIZE = 100
+# Files sent to a worker at a time
+CHUNK_SIZE = 8
+
+
+def parse_gpx(data: bytes, file_id: int) -> tuple[str, list[float], list[float]]:
+    """Name and (x, y) of a GPX file's tracks (or routes), repeated points dropped."""
+    gpx = gpxpy.parse(data.decode("utf-8"))
+
+    name = (
+        (gpx.name.strip() if gpx.name else None)
+        or next((t.name.strip() for t in gpx.tracks if t.name), None)
+        or next((r.name.strip() for r in gpx.routes if r.name), None)
+        or f"Route {file_id}"
+    )
+
+    points: list[tuple[float, float]] = []
+    if gpx.tracks:
+        for trk in gpx.tracks:
+            for seg in trk.segments:
+                for p in seg.points:
+                    points.append((float(p.longitude), float(p.latitude)))
+    elif gpx.routes:
+        for rte in gpx.routes:
+            for p in rte.points:
+                points.append((float(p.longitude), float(p.latitude)))
+    else:
+        raise ValueError("No tracks or routes found in GPX")
+
+    x: list[float] = []
+    y: list[float] = []
+    prev = None
+    for lon, lat in points:
+        pair = (lon, lat)
+        if pair != prev:
+            x.append(lon)
+            y.append(lat)
+            prev = pair
+
+    if not x or not y:
+        raise ValueError("No coordinate points extracted from GPX")
+    return name, x, y
+
+
+@dataclass(frozen=True)
+class ImportFile:
+    id: int
+    path: Path
+    content_hash: str
+
+
+@dataclass(frozen=True)
+class ImportResult:
+    id: int
+    route: dict | None = None
+    error: str | None = None
+
+
+def import_file(
+    file: ImportFile, G: nx.MultiDiGraph, matcher: MapMatcher
+) -> ImportResult:
+    try:
+        name, x, y = parse_gpx(file.path.read_bytes(), file.id)
+        nodes = match_track(G, x, y, file.content_hash, matcher)
+    except Exception as e:
+        return ImportResult(file.id, error=f"{type(e).__name__}: {e}")
+    route = StravaRoute(
+        id=file.id,
+        x=x,
+        y=y,
+        type="gpx",
+        name=name,
+        nodes=nodes,
+        content_hash=file.content_hash,
+    )
+    return ImportResult(file.id, route=route.model_dump())
+
+
+# Worker process state, set up by _init_worker.
+_graph: nx.MultiDiGraph | None = None
+_matcher: MapMatcher | None = None
+
+
+def _init_worker(store_root: Path, bbox: BBox, network_type: str) -> None:
+    global _graph, _matcher
+    G = GraphStore(store_root).load(bbox, network_type)
+    if G is None:
+        raise LookupError(f"Graph {bbox} {network_type} is not in the store")
+    _graph = G
+    _matcher = MapMatcher(prepare_graph(G))
+
+
+def _import_in_worker(file: ImportFile) -> ImportResult:
+    return import_file(file, _graph, _matcher)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class GpxImporter:
+    """Bulk import of GPX activities into the routes collection.
+
+    A job runs in a background thread. It hashes every file first, skips
+    files whose content hash is already stored for their activity id, and
+    sends the rest to a pool of worker processes that parse and map-match
+    them, each with the graph loaded memory-mapped from the graph store.
+    Results stream back into unordered bulk upserts keyed on activity
+    id, and the job document in ``jobs`` is updated after every bulk write,
+    so any app worker can report progress.
+
+    Graphs that are not in the store are matched in the job thread.
+    """
+
+    def __init__(
+        self, routes: Collection, jobs: Collection, store_root: Path, workers: int
+    ) -> None:
+        self.routes = routes
+        self.jobs = jobs
+        self.store_root = store_root
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._running: str | None = None
+
+    def get(self, job_id: str) -> ImportJob | None:
+        doc = self.jobs.find_one({"job_id": job_id}, {"_id": 0})
+        return ImportJob(**doc) if doc else None
+
+    def create_job(self, total: int) -> ImportJob:
+        job = ImportJob(job_id=uuid.uuid4().hex, total=total, started_at=_now())
+        self.jobs.insert_one(job.model_dump())
+        return job
+
+    def start(self, G: nx.MultiDiGraph, paths: list[Path]) -> ImportJob:
+        """Start importing ``paths`` onto ``G``; the running job if one is."""
+        with self._lock:
+            if self._running is not None:
+                job = self.get(self._running)
+                if job is not None and job.status == "running":
+                    return job
+            job = self.create_job(len(paths))
+            self._running = job.job_id
+
+        thread = threading.Thread(
+            target=self.run, args=(job, G, paths), name="gpx-import", daemon=True
+        )
+        thread.start()
+        return job
+
+    def run(self, job: ImportJob, G: nx.MultiDiGraph, paths: list[Path]) -> ImportJob:
+        logger.info("Import {}: {} files", job.job_id, len(paths))
+        try:
+            self._run(job, G, paths)
+            job.status = "done"
+        except Exception as e:
+            logger.exception("Import {} failed", job.job_id)
+            job.status = "failed"
+            job.errors["job"] = f"{type(e).__name__}: {e}"
+        finally:
+            job.finished_at = _now()
+            self._save(job)
+            with self._lock:
+                if self._running == job.job_id:
+                    self._running = None
+        logger.info(
+            "Import {} {}: {} inserted, {} updated, {} unchanged, {} errors",
+            job.job_id,
+            job.status,
+            job.inserted,
+            job.updated,
+            job.unchanged,
+            len(job.errors),
+        )
+        return job
+
+    def _run(self, job: ImportJob, G: nx.MultiDiGraph, paths: list[Path]) -> None:
+        self.routes.create_index("id")
+        stored = {
+            doc["id"]: doc.get("content_hash")
+            for doc in self.routes.find({}, {"id": 1, "content_hash": 1, "_id": 0})
+        }
+
+        files = []
+        for path in paths:
+            try:
+                file_id = int(path.stem)
+                content_hash = match_cache.digest(path.read_bytes())
+            except (ValueError, OSError) as e:
+                job.errors[path.name] = f"{type(e).__name__}: {e}"
+                job.processed += 1
+                continue
+            if stored.get(file_id) == content_hash:
+                job.unchanged += 1
+                job.processed += 1
+            else:
+                files.append(ImportFile(file_id, path, content_hash))
+        self._save(job)
+
+        batch: list[UpdateOne] = []
+        for result in self._results(G, files):
+            job.processed += 1
+            if result.error is not None:
+                job.errors[str(result.id)] = result.error
+                continue
+            batch.append(
+                UpdateOne({"id": result.id}, {"$set": result.route}, upsert=True)
+            )
+            if len(batch) >= BULK_SIZE:
+                self._write(job, batch)
+                batch = []
+        if batch:
+            self._write(job, batch)
+
+    def _results(
+        self, G: nx.MultiDiGraph, files: list[ImportFile]
+    ) -> Iterator[ImportResult]:
+        if not files:
+            return
+        if self.workers <= 1 or not self._stored(G):
+            matcher = MapMatcher(get_compiled_graph(G))
+            for file in files:
+                yield import_file(file, G, matcher)
+            return
+
+        workers = min(self.workers, len(files))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.store_root, G.graph["bbox"], G.graph["network_type"]),
+        ) as pool:
+            yield from pool.map(_import_in_worker, files, chunksize=CHUNK_SIZE)
+
+    def _stored(self, G: nx.MultiDiGraph) -> bool:
+        if "bbox" not in G.graph:
+            return False
+        stored = GraphStore(self.store_root).contains(
+            G.graph["bbox"], G.graph["network_type"]
+        )
+        if not stored:
+            logger.warning("Graph is not in the store, matching in the job thread")
+        return stored
+
+    def _write(self, job: ImportJob, batch: Iterable[UpdateOne]) -> None:
+        result = self.routes.bulk_write(list(batch), ordered=False)
+        job.inserted += result.upserted_count
+        job.updated += result.matched_count
+        self._save(job)
+
+    def _save(self, job: ImportJob) -> None:
+        self.jobs.update_one(
+            {"job_id": job.job_id}, {"$set": job.model_dump(exclude={"job_id"})}
+        )
@@ -6,6 +6,8 @@ from pathlib import Path
 from loguru import logger
 from networkx import MultiDiGraph
 
+from app.graph.compiled import get_compiled_graph
+
 ROOT_PATH = Path(__file__).parent.parent
 
 
@@ -61,25 +63,19 @@ def route_to_x_y(
     route: list[int],
     reversed: bool = False,
 ) -> tuple[list[float], list[float]]:
+    compiled = get_compiled_graph(graph)
     x = []
     y = []
     for u, v in zip(route[:-1], route[1:]):
-        # if there are parallel edges, select the shortest in length
-        # TODO remove try
-        try:
-            data = min(graph.get_edge_data(u, v).values(), key=lambda d: d["length"])
-        except Exception:
+        # parallel edges are collapsed to the shortest one at compile time
+        edge = compiled.find_edge(u, v)
+        if edge is None:
             continue
 
-        if data.get("geometry"):
-            # if geometry attribute exists, add all its coords to list
-            xs, ys = data["geometry"].xy
-            x.extend(xs)
-            y.extend(ys)
-        else:
-            # otherwise, the edge is a straight line from node to node
-            x.extend((graph.nodes[u]["x"], graph.nodes[v]["x"]))
-            y.extend((graph.nodes[u]["y"], graph.nodes[v]["y"]))
+        # edge geometry, or a straight line from node to node
+        xs, ys = compiled.edge_geometry(edge)
+        x.extend(xs)
+        y.extend(ys)
 
     if reversed:
         return y, x
@@ -104,21 +100,18 @@ def zip_x_y(
 
 
 def get_distance_between(graph: MultiDiGraph, start: int, end: int) -> float:
-    data = min(graph.get_edge_data(start, end).values(), key=lambda d: d["length"])
-    return data["length"]
+    compiled = get_compiled_graph(graph)
+    return compiled.edge_length(compiled.edge_index[start, end])
 
 
 def get_route_distance(graph: MultiDiGraph, route: list[int]) -> float:
+    compiled = get_compiled_graph(graph)
+    edge_index = compiled.edge_index
     distance = 0
     for u, v in zip(route[:-1], route[1:]):
-        data = min(graph.get_edge_data(u, v).values(), key=lambda d: d["length"])
-        distance += data["length"]
+        distance += compiled.edge_length(edge_index[u, v])
     return distance
 
 
 def get_graph_distance(graph: MultiDiGraph) -> float:
-    total = 0
-    for start, end, _ in graph.edges:
-        distance = get_distance_between(graph, start, end)
-        total += distance
-    return total
+    return get_compiled_graph(graph).total_length
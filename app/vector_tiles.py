@@ -0,0 +1,175 @@
+import math
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
+
+import numpy as np
+import shapely
+
+from app.graph.compiled import CompiledGraph
+from app.graph.spatial import get_spatial_index
+from app.visited_edges import VisitedEdges
+
+EXTENT = 4096
+# Tile units of geometry kept around the tile, so lines join across tiles
+BUFFER = 64
+# Tile units; half a pixel of a 256 px tile, so simplification is per zoom
+SIMPLIFY_TOLERANCE = 8.0
+MAX_ZOOM = 22
+LAYER = "visited"
+
+# MVT geometry commands
+MOVE_TO = 1
+LINE_TO = 2
+LINESTRING = 2
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """``west, south, east, north`` of a web mercator (XYZ) tile."""
+    n = 2**z
+
+    def lat(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def _to_tile(z: int, x: int, y: int, lons: np.ndarray, lats: np.ndarray):
+    n = 2**z
+    px = ((lons + 180) / 360 * n - x) * EXTENT
+    mercator = np.arcsinh(np.tan(np.radians(lats)))
+    py = ((1 - mercator / np.pi) / 2 * n - y) * EXTENT
+    return px, py
+
+
+def _varints(values: np.ndarray) -> bytes:
+    """Protobuf varints of non-negative ints, vectorized over all of them."""
+    values = np.asarray(values, dtype=np.uint64)
+    _, bits = np.frexp(values.astype(np.float64))
+    counts = np.maximum(1, (bits + 6) // 7)
+    group = np.arange(10, dtype=np.uint64)
+    groups = (values[:, None] >> (np.uint64(7) * group)) & np.uint64(0x7F)
+    groups |= np.where(group < counts[:, None] - 1, 0x80, 0).astype(np.uint64)
+    return groups[group < counts[:, None]].astype(np.uint8).tobytes()
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varints([field << 3 | wire_type])
+
+
+def _varint_field(field: int, value: int) -> bytes:
+    return _key(field, 0) + _varints([value])
+
+
+def _bytes_field(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + _varints([len(payload)]) + payload
+
+
+def encode_geometry(coords: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """MVT command integers for lines ``coords[offsets[i]:offsets[i + 1]]``.
+
+    The cursor carries over from one line to the next, so every parameter
+    is the zigzag delta from the previous point of the whole sequence.
+    """
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    params = ((deltas << 1) ^ (deltas >> 63)).ravel()
+    starts, counts = offsets[:-1], np.diff(offsets)
+    positions = np.column_stack((2 * starts, 2 * starts + 2)).ravel()
+    commands = np.column_stack(
+        (np.full(len(starts), MOVE_TO | 1 << 3), LINE_TO | (counts - 1) << 3)
+    ).ravel()
+    return np.insert(params, positions, commands)
+
+
+def encode_tile(coords: np.ndarray, offsets: np.ndarray) -> bytes:
+    """One-layer tile with all lines as a single multi-line feature."""
+    if len(offsets) < 2:
+        return b""
+    geometry = _varints(encode_geometry(coords, offsets))
+    feature = _varint_field(3, LINESTRING) + _bytes_field(4, geometry)
+    layer = (
+        _varint_field(15, 2)
+        + _bytes_field(1, LAYER.encode())
+        + _bytes_field(2, feature)
+        + _varint_field(5, EXTENT)
+    )
+    return _bytes_field(3, layer)
+
+
+def tile_lines(
+    compiled: CompiledGraph, edges: np.ndarray, z: int, x: int, y: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Edges clipped to the buffered tile and simplified, in integer tile units.
+
+    Returns the points of all lines and the (k + 1) offsets of each line.
+    """
+    empty = np.empty((0, 2), dtype=np.int64), np.zeros(1, dtype=np.int64)
+    if not len(edges):
+        return empty
+
+    starts = compiled.geometry_offsets[edges]
+    counts = compiled.geometry_offsets[edges + 1] - starts
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    points = np.repeat(starts, counts) + np.arange(counts.sum()) - first
+    px, py = _to_tile(z, x, y, compiled.geometry_x[points], compiled.geometry_y[points])
+
+    lines = shapely.linestrings(
+        np.column_stack((px, py)), indices=np.repeat(np.arange(len(edges)), counts)
+    )
+    lines = shapely.clip_by_rect(
+        lines, -BUFFER, -BUFFER, EXTENT + BUFFER, EXTENT + BUFFER
+    )
+    lines = shapely.simplify(lines, SIMPLIFY_TOLERANCE, preserve_topology=False)
+    parts = shapely.get_parts(lines)
+    parts = parts[shapely.get_type_id(parts) == shapely.GeometryType.LINESTRING]
+    coords, index = shapely.get_coordinates(parts, return_index=True)
+    if not len(coords):
+        return empty
+
+    # Drop points that round onto the previous one, then lines left with one
+    coords = np.round(coords).astype(np.int64)
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = (coords[1:] != coords[:-1]).any(axis=1) | (index[1:] != index[:-1])
+    coords, index = coords[keep], index[keep]
+    counts = np.bincount(index, minlength=len(parts))
+    long_enough = counts[index] >= 2
+    coords, counts = coords[long_enough], counts[counts >= 2]
+    return coords, np.concatenate(([0], np.cumsum(counts)))
+
+
+def visited_tile(
+    compiled: CompiledGraph, visited: VisitedEdges, z: int, x: int, y: int
+) -> bytes:
+    """Vector tile of the visited streets of ``compiled`` in tile ``z/x/y``."""
+    west, south, east, north = tile_bounds(z, x, y)
+    pad_x = (east - west) * BUFFER / EXTENT
+    pad_y = (north - south) * BUFFER / EXTENT
+    edges = get_spatial_index(compiled).edges_in_bbox(
+        west - pad_x, south - pad_y, east + pad_x, north + pad_y
+    )
+    edges = visited.streets(compiled, edges)
+    return encode_tile(*tile_lines(compiled, edges, z, x, y))
+
+
+class TileCache:
+    """LRU of rendered tiles, each valid for one version of its source."""
+
+    def __init__(self, max_tiles: int) -> None:
+        self.max_tiles = max_tiles
+        self._tiles: OrderedDict[Hashable, tuple[int, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: int) -> bytes | None:
+        with self._lock:
+            entry = self._tiles.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._tiles.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, version: int, data: bytes) -> None:
+        with self._lock:
+            self._tiles[key] = (version, data)
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
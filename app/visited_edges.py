@@ -1,75 +1,412 @@
-from typing import Generic, Iterator, TypeVar
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from uuid import UUID
+from weakref import WeakKeyDictionary
 
 import networkx as nx
+import numpy as np
 from loguru import logger
+from redis.exceptions import RedisError
 
+from app.graph.compiled import CompiledGraph, get_compiled_graph
 from app.models import Segment
-from app.utils import get_distance_between
+from app.redis import get_sync_binary_redis
+from app.settings import settings
 
-K = TypeVar("K")
+Pair = tuple[int, int]
 
+# Skip Redis for this long after it failed, instead of timing out per request
+REDIS_RETRY_SECONDS = 30
 
-class VisitedEdges(Generic[K]):
-    def __init__(self) -> None:
-        self._map: dict[K, int] = {}
+# Process-wide, so a reloaded VisitedEdges never reuses an earlier version
+_versions = itertools.count(1)
 
-    def __getitem__(self, key: K) -> int:
-        return self._map[key]
 
-    def __contains__(self, key: K) -> bool:
-        return key in self._map
+def _as_pairs(pairs: Iterable[Pair] | np.ndarray) -> np.ndarray:
+    return np.asarray(
+        pairs if isinstance(pairs, np.ndarray) else list(pairs), dtype=np.int64
+    ).reshape(-1, 2)
+
+
+def edge_ids(compiled: CompiledGraph, pairs: np.ndarray) -> np.ndarray:
+    """Compiled edge ids of OSM ``(u, v)`` pairs; pairs not in the graph are dropped."""
+    ids, found = _find_edges(compiled, pairs)
+    return ids[found]
+
+
+def _find_edges(
+    compiled: CompiledGraph, pairs: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Edge id of every pair, and whether the graph has that edge at all."""
+    n = np.int64(compiled.num_nodes)
+    if not len(pairs) or not compiled.num_edges:
+        return np.zeros(len(pairs), dtype=np.int64), np.zeros(len(pairs), dtype=bool)
+
+    order = np.argsort(compiled.node_ids)
+    sorted_ids = compiled.node_ids[order]
+
+    def dense(nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        pos = np.minimum(np.searchsorted(sorted_ids, nodes), n - 1)
+        return order[pos], sorted_ids[pos] == nodes
+
+    u, u_found = dense(pairs[:, 0])
+    v, v_found = dense(pairs[:, 1])
+    wanted = u * n + v
+
+    # CSR edges are sorted by (source, target)
+    forward = compiled.sources.astype(np.int64) * n + compiled.targets
+    pos = np.minimum(np.searchsorted(forward, wanted), compiled.num_edges - 1)
+    return pos, u_found & v_found & (forward[pos] == wanted)
+
+
+@dataclass
+class EdgeCoverage:
+    """Visited edges of one graph: a mask by edge id and its total length,
+    and how often each edge was walked in its own direction."""
+
+    mask: np.ndarray  # bool, per compiled edge
+    walks: np.ndarray  # int64, per compiled edge
+    visited_length: float = 0.0
+
+    def set(self, compiled: CompiledGraph, edges: np.ndarray) -> None:
+        """Mark ``edges`` and their reverse edges, counting only newly set ones."""
+        reverse = compiled.reverse[edges]
+        edges = np.unique(np.concatenate((edges, reverse[reverse >= 0])))
+        edges = edges[~self.mask[edges]]
+        self.mask[edges] = True
+        self.visited_length += float(compiled.lengths[edges].sum())
+
+    def walk(self, compiled: CompiledGraph, pairs: np.ndarray, counts: np.ndarray):
+        """Count ``counts`` more walks along each of ``pairs``."""
+        ids, found = _find_edges(compiled, pairs)
+        np.add.at(self.walks, ids[found], counts[found])
+
+
+@dataclass(frozen=True)
+class CoverageStats:
+    total_distance: float
+    visited_distance: float
+
+    @property
+    def visited_percent(self) -> float:
+        if not self.total_distance:
+            return 0.0
+        return self.visited_distance / self.total_distance * 100
+
+
+class VisitedEdges:
+    """Streets one user has walked, as unique OSM ``(u, v)`` node pairs,
+    with how many times each was walked.
+
+    Pairs don't depend on any graph, so they outlive graph eviction and apply
+    to every graph covering the same streets. For a given graph they are
+    turned into a mask over its compiled edge ids (both directions of a
+    walked street are set) and the mask's total length, computed once per
+    graph and updated incrementally as edges are added.
+
+    ``version`` changes whenever the set of pairs does, so anything derived
+    from them (e.g. rendered tiles) can be cached against it; walking a
+    street again doesn't change it.
+    """
+
+    def __init__(
+        self,
+        key: str = "",
+        pairs: np.ndarray | None = None,
+        counts: np.ndarray | None = None,
+    ) -> None:
+        self.key = key
+        self.version = next(_versions)
+        self._pairs = np.empty((0, 2), dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._coverage: WeakKeyDictionary[CompiledGraph, EdgeCoverage] = (
+            WeakKeyDictionary()
+        )
+        if pairs is not None:
+            self.union(pairs, counts)
+
+    # Masks are cheap to rebuild and weak references can't be pickled, so
+    # route jobs sent to worker processes carry the pairs only.
+    def __getstate__(self) -> dict:
+        return {"key": self.key, "pairs": self._pairs, "counts": self._counts}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["key"], state["pairs"], state["counts"])
 
     def __len__(self) -> int:
-        return len(self._map)
+        return len(self._pairs)
+
+    def __iter__(self) -> Iterator[Pair]:
+        return iter(map(tuple, self._pairs.tolist()))
+
+    @property
+    def pairs(self) -> np.ndarray:
+        return self._pairs
+
+    @property
+    def counts(self) -> np.ndarray:
+        """How many times each of ``pairs`` was walked."""
+        return self._counts
+
+    def union(
+        self, pairs: Iterable[Pair] | np.ndarray, counts: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Add ``pairs``, each walked once or ``counts`` times; returns the
+        ones that were not visited before."""
+        pairs = _as_pairs(pairs)
+        if not len(pairs):
+            return pairs
+        counts = (
+            np.ones(len(pairs), dtype=np.int64)
+            if counts is None
+            else np.asarray(counts, dtype=np.int64)
+        )
+        merged, inverse = np.unique(
+            np.concatenate((self._pairs, pairs)), axis=0, return_inverse=True
+        )
+        inverse = inverse.ravel()
+        # Old pairs are unique, so every merged row they don't map to is new
+        new = np.ones(len(merged), dtype=bool)
+        new[inverse[: len(self._pairs)]] = False
+        added = merged[new]
 
-    def __iter__(self) -> Iterator[K]:
-        return iter(self._map)
+        self._pairs = merged
+        self._counts = np.bincount(
+            inverse,
+            weights=np.concatenate((self._counts, counts)),
+            minlength=len(merged),
+        ).astype(np.int64)
+        if len(added):
+            self.version = next(_versions)
+        for compiled, coverage in list(self._coverage.items()):
+            coverage.set(compiled, edge_ids(compiled, added))
+            coverage.walk(compiled, pairs, counts)
+        return added
+
+    def unvisited(self, pairs: Iterable[Pair] | np.ndarray) -> np.ndarray:
+        """The unique ``pairs`` that are not visited yet."""
+        pairs = np.unique(_as_pairs(pairs), axis=0)
+        old = self._pairs.view([("u", np.int64), ("v", np.int64)]).ravel()
+        new = pairs.view([("u", np.int64), ("v", np.int64)]).ravel()
+        return pairs[~np.isin(new, old)]
+
+    def add(self, pair: Pair) -> None:
+        self.union([pair])
 
     def clear(self) -> None:
-        logger.debug("VisitedEdges cleared (had {} entries)", len(self._map))
-        self._map.clear()
+        logger.debug("VisitedEdges cleared (had {} entries)", len(self._pairs))
+        self._pairs = np.empty((0, 2), dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._coverage = WeakKeyDictionary()
+        self.version = next(_versions)
+
+    def mark_edges_visited(self, route: list[int]) -> np.ndarray:
+        added = self.union(zip(route[:-1], route[1:]))
+        logger.debug(
+            "VisitedEdges: +{} new edges (total {})", len(added), len(self._pairs)
+        )
+        return added
+
+    def coverage(self, compiled: CompiledGraph) -> EdgeCoverage:
+        coverage = self._coverage.get(compiled)
+        if coverage is None:
+            coverage = EdgeCoverage(
+                np.zeros(compiled.num_edges, dtype=bool),
+                np.zeros(compiled.num_edges, dtype=np.int64),
+            )
+            coverage.set(compiled, edge_ids(compiled, self._pairs))
+            coverage.walk(compiled, self._pairs, self._counts)
+            self._coverage[compiled] = coverage
+        return coverage
+
+    def edge_mask(self, compiled: CompiledGraph) -> np.ndarray:
+        """Whether each compiled edge's street was walked, by edge id."""
+        return self.coverage(compiled).mask
+
+    def edge_visits(self, compiled: CompiledGraph) -> np.ndarray:
+        """How many times each compiled edge was walked, by edge id.
 
-    def add(self, key: K) -> None:
-        if key in self._map:
-            self._map[key] += 1
-        else:
-            self._map[key] = 1
+        An edge never walked in its own direction takes its reverse edge's
+        walks, so both directions of a street count as visited.
+        """
+        walks = self.coverage(compiled).walks
+        visits = walks.copy()
+        reverse = compiled.reverse
+        fallback = (visits == 0) & (reverse >= 0)
+        visits[fallback] = walks[reverse[fallback]]
+        return visits
+
+    def streets(
+        self, compiled: CompiledGraph, edges: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Visited edges among ``edges`` (all by default), one per two-way street."""
+        mask = self.edge_mask(compiled)
+        edges = np.flatnonzero(mask) if edges is None else edges[mask[edges]]
+        reverse = compiled.reverse[edges]
+        twin = (reverse >= 0) & (reverse < edges)
+        twin[twin] = mask[reverse[twin]]
+        return edges[~twin]
 
     def get_visited_segments(
         self,
         graph: nx.MultiDiGraph,
         route: list[int],
     ) -> list[Segment]:
+        compiled = get_compiled_graph(graph)
+        edge_index = compiled.edge_index
+        visited = self.edge_mask(compiled)
         result = []
         for u, v in zip(route[:-1], route[1:]):
-            data = min(graph.get_edge_data(u, v).values(), key=lambda d: d["length"])
-            if (u, v) in self._map or (v, u) in self._map:
-                segment = Segment(new=False, distance=data["length"])
-            else:
-                segment = Segment(new=True, distance=data["length"])
+            edge = edge_index[u, v]
+            segment = Segment(
+                new=not visited[edge], distance=compiled.edge_length(edge)
+            )
             result.append(segment)
         return result
 
     def get_visited_distance(self, graph: nx.MultiDiGraph) -> float:
-        visited_routes_distance = 0
-
-        for start, end, _ in graph.edges:
-            if (start, end) in self._map or (end, start) in self._map:
-                visited_routes_distance += get_distance_between(graph, start, end)
-
+        compiled = get_compiled_graph(graph)
+        visited_routes_distance = self.coverage(compiled).visited_length
         logger.debug("VisitedEdges total distance: {:.1f}m", visited_routes_distance)
         return visited_routes_distance
 
-    def mark_edges_visited(self, route: list[int]):
-        count_before = len(self._map)
-        for u, v in zip(route[:-1], route[1:]):
-            self.add((u, v))
-        logger.debug(
-            "VisitedEdges: +{} new edges (total {})",
-            len(self._map) - count_before,
-            len(self._map),
+    def coverage_stats(self, graph: nx.MultiDiGraph) -> CoverageStats:
+        compiled = get_compiled_graph(graph)
+        return CoverageStats(
+            total_distance=compiled.total_length,
+            visited_distance=self.coverage(compiled).visited_length,
         )
 
 
-# For more users it has to be refactored
-visited_edges = VisitedEdges[tuple[int, int]]()
+class VisitedStore:
+    """Per-user visited edges, persisted in Redis, with an in-process LRU.
+
+    Each user's Redis value is an append-only log of int64 ``(u, v)`` pairs,
+    one per walk, so it also holds how often each street was walked. Walks
+    are appended atomically, so every app worker can add to it, and a cached
+    copy catches up by reading only the bytes past what it has seen. Without
+    Redis, visited edges live in this process only.
+    """
+
+    def __init__(self, max_users: int) -> None:
+        self.max_users = max_users
+        self._entries: OrderedDict[str, tuple[VisitedEdges, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+
+    @staticmethod
+    def key(user_id: UUID | None) -> str:
+        return f"visited:{user_id or 'anonymous'}"
+
+    def _redis(self):
+        if time.monotonic() < self._redis_down_until:
+            return None
+        return get_sync_binary_redis()
+
+    def _redis_failed(self, e: RedisError) -> None:
+        logger.warning("Visited edges Redis error, using process memory: {}", e)
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+    def get(self, user_id: UUID | None) -> VisitedEdges:
+        key = self.key(user_id)
+        with self._lock:
+            visited, synced = self._entries.get(key, (None, 0))
+            if visited is None:
+                visited = VisitedEdges(key)
+            self._entries[key] = (visited, synced)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        self._sync(visited)
+        return visited
+
+    def _sync(self, visited: VisitedEdges) -> None:
+        """Read pairs appended, by any worker, since the cached copy last did."""
+        client = self._redis()
+        if client is None:
+            return
+        with self._lock:
+            _, synced = self._entries.get(visited.key, (None, 0))
+        try:
+            if client.strlen(visited.key) <= synced:
+                return
+            data = client.getrange(visited.key, synced, -1)
+        except RedisError as e:
+            self._redis_failed(e)
+            return
+        self._apply(visited, synced, data)
+
+    def _apply(self, visited: VisitedEdges, start: int, data: bytes) -> bool:
+        """Add log bytes read from offset ``start``, if the cached copy ends there.
+
+        Walks are counted, so every byte is applied exactly once: whichever
+        thread reads it first. Redis I/O happens outside the lock; only this
+        swap of the in-memory state takes it.
+        """
+        usable = len(data) - len(data) % 16
+        with self._lock:
+            cached, synced = self._entries.get(visited.key, (None, 0))
+            if cached is not visited or synced != start:
+                return False
+            visited.union(np.frombuffer(data[:usable], dtype=np.int64))
+            self._entries[visited.key] = (visited, start + usable)
+        return True
+
+    def mark(self, visited: VisitedEdges, pairs: Iterable[Pair] | np.ndarray) -> None:
+        """Count a walk along each of ``pairs`` and persist it."""
+        pairs = _as_pairs(pairs)
+        if not len(pairs):
+            return
+        client = self._redis()
+        if client is not None:
+            data = pairs.tobytes()
+            try:
+                length = client.append(visited.key, data)
+            except RedisError as e:
+                self._redis_failed(e)
+            else:
+                # Unless another worker appended in between, the new bytes are
+                # just ours; otherwise read theirs and ours back from the log
+                if self._apply(visited, length - len(data), data):
+                    return
+                with self._lock:
+                    cached, _ = self._entries.get(visited.key, (None, 0))
+                if cached is visited:
+                    self._sync(visited)
+                    return
+        # No Redis, or a copy the store no longer holds: update it directly
+        with self._lock:
+            visited.union(pairs)
+
+    def visit(self, visited: VisitedEdges, pairs: Iterable[Pair] | np.ndarray) -> None:
+        """Mark ``pairs`` visited without counting walks along them.
+
+        Only pairs not visited yet are logged, once each, so marking the same
+        streets again (e.g. every imported activity) leaves the log and the
+        counts as they are.
+        """
+        self._sync(visited)
+        with self._lock:
+            pairs = visited.unvisited(pairs)
+        self.mark(visited, pairs)
+
+    def mark_route(self, visited: VisitedEdges, route: list[int]) -> None:
+        self.mark(visited, zip(route[:-1], route[1:]))
+
+    def clear(self, visited: VisitedEdges) -> None:
+        client = self._redis()
+        if client is not None:
+            try:
+                client.delete(visited.key)
+            except RedisError as e:
+                self._redis_failed(e)
+        with self._lock:
+            visited.clear()
+            self._entries.pop(visited.key, None)
+
+
+visited_store = VisitedStore(max_users=settings.VISITED_CACHE_USERS)
@@ -4,7 +4,10 @@ from loguru import logger
 
 from app.api import route_generation as rg
 from app.api.common import DEFAULT_START_X, DEFAULT_START_Y
+from app.dependencies import get_visited
+from app.graph.compiled import get_compiled_graph
 from app.serializers.geocode import GeocodeItem
+from app.serializers.route import RouteFormat, encode_polyline
 from app.services.elevation import ElevationService
 from app.services.nominatim import (
     BadRequest,
@@ -12,6 +15,7 @@ from app.services.nominatim import (
     NominatimService,
     UpstreamError,
 )
+from app.visited_edges import VisitedEdges
 
 router = APIRouter(prefix="/htmx", tags=["Web"], include_in_schema=False)
 
@@ -21,7 +25,7 @@ def get_nominatim_service() -> NominatimService:
 
 
 @router.get("/route", response_class=HTMLResponse)
-def htmx_route(
+async def htmx_route(
     request: Request,
     algorithm: str = "random",
     start_x: float = DEFAULT_START_X,
@@ -30,6 +34,7 @@ def htmx_route(
     end_y: float | None = None,
     distance: int = 6000,
     prefer_new: bool = False,
+    visited: VisitedEdges = Depends(get_visited),
 ) -> HTMLResponse:
     """Generate a route and return an HTML fragment that draws it on the map."""
     logger.info(
@@ -41,7 +46,8 @@ def htmx_route(
     )
     from app.web.templates import templates
 
-    route = rg.route(
+    route = await rg.route(
+        request=request,
         algorithm_type=algorithm,
         start_x=start_x,
         start_y=start_y,
@@ -50,30 +56,37 @@ def htmx_route(
         distance=distance,
         prefer_new=prefer_new,
         skip_elevation=True,
+        format=RouteFormat.json,
         elevation_service=ElevationService(),
+        visited=visited,
     )
 
-    coords = [[lat, lng] for lat, lng in zip(route.y, route.x)]
-
     return templates.TemplateResponse(
         request,
         "partials/route_result.html",
-        {"route": route, "coords": coords},
+        {"route": route, "polyline": encode_polyline(route.y, route.x)},
     )
 
 
 @router.get("/visited-routes", response_class=HTMLResponse)
-def htmx_visited_routes(request: Request) -> HTMLResponse:
-    """Return an HTML fragment that draws all visited edges on the map."""
+def htmx_visited_routes(
+    request: Request, visited: VisitedEdges = Depends(get_visited)
+) -> HTMLResponse:
+    """Return an HTML fragment that shows the visited-streets tile layer.
+
+    The map fetches the streets itself, tile by tile, so only their count
+    is computed here.
+    """
     logger.debug("HTMX /visited-routes")
     from app.web.templates import templates
 
-    segments = rg.get_visited_edges()
+    count = len(visited.streets(get_compiled_graph(rg.get_or_create_graph())))
+    tile_url = request.app.url_path_for("get_visited_tile", z="{z}", x="{x}", y="{y}")
 
     return templates.TemplateResponse(
         request,
         "partials/visited_routes.html",
-        {"segments": segments, "count": len(segments)},
+        {"count": count, "tile_url": tile_url},
     )
 
 
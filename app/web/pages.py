@@ -10,7 +10,9 @@ ALGORITHMS = [
     ("random", "Random walk"),
     ("dfs", "Depth-first search"),
     ("astar", "A* (start \u2192 end)"),
+    ("astar-alt", "A* with landmarks (start \u2192 end)"),
     ("allstreet", "All streets"),
+    ("allstreet-postman", "All streets (Chinese postman)"),
 ]
 
 
@@ -0,0 +1,98 @@
+"""Compare the greedy all-streets walk with the Chinese postman solver.
+
+python -m scripts.benchmark_all_streets                 # OSM, around the default start
+python -m scripts.benchmark_all_streets --radius 1500
+python -m scripts.benchmark_all_streets --grid 40       # synthetic 40x40 grid, offline
+"""
+
+import argparse
+import random
+import time
+
+import networkx as nx
+import osmnx as ox
+
+from app.api.common import DEFAULT_START_X, DEFAULT_START_Y, get_city_bbox
+from app.generator.all_streets_random import AllStreetsRoute
+from app.generator.base import keep_largest_component, remove_isolated_nodes
+from app.generator.chinese_postman import ChinesePostmanRoute
+from app.utils import remove_farthest_nodes
+from app.visited_edges import VisitedEdges
+
+GENERATORS = {
+    "greedy": AllStreetsRoute,
+    "postman": ChinesePostmanRoute,
+}
+
+
+def make_grid(size: int, seed: int = 0) -> nx.MultiDiGraph:
+    """``size`` x ``size`` street grid with a few streets missing."""
+    rng = random.Random(seed)
+    G = nx.MultiDiGraph()
+    for i in range(size):
+        for j in range(size):
+            G.add_node(i * size + j, x=19.2 + j * 0.001, y=51.6 + i * 0.001)
+    for i in range(size):
+        for j in range(size):
+            node = i * size + j
+            for neighbour in (node + 1 if j + 1 < size else None, node + size):
+                if neighbour is None or neighbour >= size * size:
+                    continue
+                if rng.random() < 0.1:
+                    continue
+                length = rng.uniform(70.0, 120.0)
+                G.add_edge(node, neighbour, length=length)
+                G.add_edge(neighbour, node, length=length)
+    return keep_largest_component(G)
+
+
+def load_osm(radius: int) -> nx.MultiDiGraph:
+    bbox = get_city_bbox(DEFAULT_START_X, DEFAULT_START_Y, size=0.05)
+    G = ox.graph_from_bbox(bbox, network_type="drive")
+    G = remove_farthest_nodes(G, DEFAULT_START_X, DEFAULT_START_Y, radius=radius)
+    remove_isolated_nodes(G)
+    return keep_largest_component(G)
+
+
+def street_length(G: nx.MultiDiGraph) -> float:
+    """Length of every street once, whichever way it can be walked."""
+    streets: dict[frozenset[int], float] = {}
+    for u, v, data in G.edges(data=True):
+        key = frozenset((u, v))
+        streets[key] = min(streets.get(key, data["length"]), data["length"])
+    return sum(streets.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--grid", type=int, help="use a synthetic N x N grid")
+    parser.add_argument("--radius", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.grid:
+        G = make_grid(args.grid)
+        start_node = next(iter(G.nodes))
+    else:
+        G = load_osm(args.radius)
+        start_node = ox.nearest_nodes(G, X=DEFAULT_START_X, Y=DEFAULT_START_Y)
+
+    total = street_length(G)
+    print(
+        f"Graph: {len(G.nodes)} nodes, {len(G.edges)} edges, {total:.0f} m of streets"
+    )
+    print(f"{'algorithm':<10} {'distance [m]':>14} {'x streets':>10} {'time [s]':>10}")
+    for name, generator_class in GENERATORS.items():
+        generator = generator_class(G.copy(), VisitedEdges())
+        started = time.perf_counter()
+        route = generator.generate(start_node=start_node)
+        elapsed = time.perf_counter() - started
+        distance = generator.compiled.path_length(
+            [generator.compiled.dense(n) for n in route]
+        )
+        print(
+            f"{name:<10} {distance:>14.0f} {distance / total:>10.2f} {elapsed:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from matplotlib.collections import LineCollection
 from app.api.common import get_city_bbox
 from app.generator.all_streets_random import (
     AllStreetsRoute,
+    UnvisitedEdges,
     choose_next_edge,
     remove_edge_both_directions,
 )
@@ -42,74 +43,64 @@ def build_edge_coords(G, u, v):
 
 
 def step_generator(generator: AllStreetsRoute, start_node: int):
-    """Yield (route, current, unvisited_edges, step_type, recovery_len) at each algorithm step."""
-    graph = generator.graph
-    unvisited_edges = set(graph.edges(keys=True))
-    route = [start_node]
-    current = start_node
-    previous_edge = None  # Track the actual edge we came from (u, v, k)
+    """Yield (route, current, unvisited_edges, step_type, recovery_len) at each algorithm step.
+
+    Route and unvisited (u, v) pairs are reported with OSM node ids.
+    """
+    graph = generator.compiled
+    unvisited_edges = UnvisitedEdges(graph)
+    current = graph.dense(start_node)
+    route = [current]
+    previous_edge = None  # Track the actual edge we came from
     recovery_len = 0
     step_no = 0
 
-    yield route.copy(), current, unvisited_edges.copy(), "start", recovery_len
+    def snapshot():
+        ids = graph.osm_ids
+        unvisited = {
+            (ids[graph.source(e)], ids[graph.target(e)]) for e in unvisited_edges
+        }
+        return graph.to_osm(route), ids[current], unvisited
+
+    yield *snapshot(), "start", recovery_len
     print(f"step {step_no}: route = {route}")
 
     while unvisited_edges:
-        outgoing = [
-            e for e in graph.out_edges(current, keys=True) if e in unvisited_edges
-        ]
+        outgoing = [e for e in graph.out_edges(current) if e in unvisited_edges]
 
         if outgoing:
             chosen_edge = choose_next_edge(
                 graph, current, outgoing, previous_edge, unvisited_edges
             )
-            next_node = chosen_edge[1]
-            remove_edge_both_directions(graph, unvisited_edges, current, next_node)
+            next_node = graph.target(chosen_edge)
+            remove_edge_both_directions(graph, unvisited_edges, chosen_edge)
             route.append(next_node)
             previous_edge = chosen_edge  # Remember the edge we just took
             current = next_node
             step_no += 1
-            yield route.copy(), current, unvisited_edges.copy(), "greedy", recovery_len
+            yield *snapshot(), "greedy", recovery_len
             print(f"step {step_no}: greedy -> {current}, route = {route}")
         else:
-            nodes_with_unvisited = {e[0] for e in unvisited_edges}
-            try:
-                lengths = nx.single_source_shortest_path_length(graph, current)
-                closest = min(
-                    (n for n in nodes_with_unvisited if n in lengths),
-                    key=lambda n: lengths[n],
-                )
-                recovery_path = nx.shortest_path(graph, source=current, target=closest)
-                recovery_len = len(recovery_path) - 1
-                route.extend(recovery_path[1:])
-
-                for i in range(len(recovery_path) - 1):
-                    u, v = recovery_path[i], recovery_path[i + 1]
-                    remove_edge_both_directions(graph, unvisited_edges, u, v)
-
-                # Track the last edge in the recovery path
-                if len(recovery_path) >= 2:
-                    u, v = recovery_path[-2], recovery_path[-1]
-                    edge_data = graph.get_edge_data(u, v)
-                    if edge_data:
-                        k = list(edge_data.keys())[0]
-                        previous_edge = (u, v, k)
-                    else:
-                        previous_edge = None
-                else:
-                    previous_edge = None
-                current = closest
-
-                step_no += 1
-                yield route.copy(), current, unvisited_edges.copy(), "recovery", recovery_len
-                print(f"step {step_no}: recovery -> {current}, route = {route}")
-            except ValueError:
+            recovery_path = generator._path_to_unvisited(current, unvisited_edges)
+            if recovery_path is None:
                 step_no += 1
-                yield route.copy(), current, unvisited_edges.copy(), "stuck", recovery_len
+                yield *snapshot(), "stuck", recovery_len
                 print(f"step {step_no}: stuck at {current}")
+                break
+
+            recovery_len = len(recovery_path) - 1
+            route.extend(recovery_path[1:])
+            for u, v in zip(recovery_path, recovery_path[1:]):
+                previous_edge = graph.edge_id(u, v)
+                remove_edge_both_directions(graph, unvisited_edges, previous_edge)
+            current = recovery_path[-1]
+
+            step_no += 1
+            yield *snapshot(), "recovery", recovery_len
+            print(f"step {step_no}: recovery -> {current}, route = {route}")
 
     step_no += 1
-    yield route.copy(), current, unvisited_edges.copy(), "done", recovery_len
+    yield *snapshot(), "done", recovery_len
     print(f"step {step_no}: done, route = {route}")
 
 
@@ -202,7 +193,7 @@ def main():
 
         for u, v, k, data in G.edges(keys=True, data=True):
             is_visited = (u, v) in visited_set or (v, u) in visited_set
-            edge_key = (u, v, k)
+            edge_key = (u, v)
             coords = None
 
             if "geometry" in data and data["geometry"] is not None:
@@ -245,7 +236,7 @@ def main():
         current_marker.set_data([cx], [cy])
         start_marker.set_data([sx], [sy])
 
-        total_edges = len(set(G.edges(keys=True)))
+        total_edges = len(set(G.edges()))
         unvisited_count = len(unvisited)
         visited_count = total_edges - unvisited_count
         pct = visited_count / total_edges * 100 if total_edges else 0
@@ -15,7 +15,11 @@
   let startMarker = null;
   let endMarker = null;
   let routeLayer = null;
-  let visitedLayer = null;
+
+  // Visited streets as vector tiles, so only what is on screen is fetched
+  const visitedTiles = L.visitedTiles("/api/tiles/visited/{z}/{x}/{y}.mvt", {
+    maxNativeZoom: 19,
+  }).addTo(map);
 
   function setInput(id, value) {
     const input = document.getElementById(id);
@@ -52,24 +56,46 @@
     }
   });
 
+  // Google encoded polyline (precision 5) -> [[lat, lng], ...]
+  function decodePolyline(encoded) {
+    const coords = [];
+    let index = 0, lat = 0, lng = 0;
+    while (index < encoded.length) {
+      const delta = [0, 0];
+      for (let i = 0; i < 2; i++) {
+        let result = 0, shift = 0, chunk;
+        do {
+          chunk = encoded.charCodeAt(index++) - 63;
+          result |= (chunk & 0x1f) << shift;
+          shift += 5;
+        } while (chunk >= 0x20);
+        delta[i] = result & 1 ? ~(result >> 1) : result >> 1;
+      }
+      lat += delta[0];
+      lng += delta[1];
+      coords.push([lat / 1e5, lng / 1e5]);
+    }
+    return coords;
+  }
+
+  function asCoords(path) {
+    return typeof path === "string" ? decodePolyline(path) : path;
+  }
+
   window.TravelMap = {
-    drawRoute: function (coords) {
+    decodePolyline: decodePolyline,
+
+    drawRoute: function (path) {
       if (routeLayer) map.removeLayer(routeLayer);
+      const coords = path && asCoords(path);
       if (!coords || !coords.length) return;
       routeLayer = L.polyline(coords, { color: "#3fb950", weight: 5, opacity: 0.9 });
       routeLayer.addTo(map);
       map.fitBounds(routeLayer.getBounds(), { padding: [40, 40] });
     },
 
-    drawVisited: function (segments) {
-      if (visitedLayer) map.removeLayer(visitedLayer);
-      if (!segments || !segments.length) return;
-      visitedLayer = L.layerGroup(
-        segments.map(function (seg) {
-          return L.polyline(seg, { color: "#58a6ff", weight: 3, opacity: 0.6 });
-        })
-      );
-      visitedLayer.addTo(map);
+    drawVisited: function (tileUrl) {
+      visitedTiles.setUrl(tileUrl);
     },
 
     flyTo: function (btn) {
@@ -0,0 +1,133 @@
+// Leaflet layer for the visited-streets vector tiles (/api/tiles/visited).
+// Reads just the MVT subset app/vector_tiles.py writes: line features
+// drawn with MoveTo/LineTo commands, and paints them on canvas tiles.
+(function () {
+  "use strict";
+
+  function Reader(bytes) {
+    this.bytes = bytes;
+    this.pos = 0;
+  }
+
+  Reader.prototype.varint = function () {
+    let value = 0, shift = 1, byte;
+    do {
+      byte = this.bytes[this.pos++];
+      value += (byte & 0x7f) * shift;
+      shift *= 128;
+    } while (byte & 0x80);
+    return value;
+  };
+
+  // Calls fn(field, end) for every length-delimited field of the message
+  // and fn(field, null, value) for every varint; others are skipped.
+  Reader.prototype.fields = function (end, fn) {
+    while (this.pos < end) {
+      const key = this.varint();
+      const wireType = key & 7;
+      if (wireType === 2) {
+        const length = this.varint();
+        const next = this.pos + length;
+        fn(key >> 3, next);
+        this.pos = next;
+      } else if (wireType === 0) {
+        fn(key >> 3, null, this.varint());
+      } else {
+        this.pos += wireType === 1 ? 8 : 4;
+      }
+    }
+  };
+
+  function zigzag(n) {
+    return n % 2 ? -(n + 1) / 2 : n / 2;
+  }
+
+  // Tile -> [[x, y], ...] lines of every feature, in tile units
+  function decodeLines(bytes) {
+    const reader = new Reader(bytes);
+    const lines = [];
+    let extent = 4096;
+    reader.fields(bytes.length, function (field, end) {
+      if (field !== 3 || end === null) return; // layers
+      reader.fields(end, function (field, end, value) {
+        if (field === 5 && end === null) extent = value;
+        if (field !== 2 || end === null) return; // features
+        reader.fields(end, function (field, end) {
+          if (field !== 4 || end === null) return; // packed geometry
+          let x = 0, y = 0, line = null;
+          while (reader.pos < end) {
+            const command = reader.varint();
+            for (let i = 0; i < command >> 3; i++) {
+              x += zigzag(reader.varint());
+              y += zigzag(reader.varint());
+              if ((command & 7) === 1) {
+                line = [];
+                lines.push(line);
+              }
+              line.push([x, y]);
+            }
+          }
+        });
+      });
+    });
+    return { lines: lines, extent: extent };
+  }
+
+  L.VisitedTiles = L.GridLayer.extend({
+    options: { color: "#58a6ff", weight: 3, opacity: 0.6 },
+
+    initialize: function (url, options) {
+      this._url = url;
+      L.setOptions(this, options);
+    },
+
+    setUrl: function (url) {
+      this._url = url;
+      return this.redraw();
+    },
+
+    createTile: function (coords, done) {
+      const tile = document.createElement("canvas");
+      const size = this.getTileSize();
+      const ratio = window.devicePixelRatio || 1;
+      tile.width = size.x * ratio;
+      tile.height = size.y * ratio;
+      tile.style.width = size.x + "px";
+      tile.style.height = size.y + "px";
+
+      const url = L.Util.template(this._url, coords);
+      const options = this.options;
+      fetch(url, { credentials: "same-origin" })
+        .then(function (res) {
+          if (!res.ok) throw new Error(res.status + " " + url);
+          return res.arrayBuffer();
+        })
+        .then(function (buffer) {
+          const tileData = decodeLines(new Uint8Array(buffer));
+          const ctx = tile.getContext("2d");
+          const scale = tile.width / tileData.extent;
+          ctx.strokeStyle = options.color;
+          ctx.globalAlpha = options.opacity;
+          ctx.lineWidth = options.weight * ratio;
+          ctx.lineJoin = ctx.lineCap = "round";
+          ctx.beginPath();
+          tileData.lines.forEach(function (line) {
+            ctx.moveTo(line[0][0] * scale, line[0][1] * scale);
+            for (let i = 1; i < line.length; i++) {
+              ctx.lineTo(line[i][0] * scale, line[i][1] * scale);
+            }
+          });
+          ctx.stroke();
+          done(null, tile);
+        })
+        .catch(function (err) {
+          done(err, tile);
+        });
+      return tile;
+    },
+  });
+
+  L.visitedTiles = function (url, options) {
+    return new L.VisitedTiles(url, options);
+  };
+})();
@@ -1,10 +1,16 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
 
 import networkx as nx
+import numpy as np
 import pytest
 
 from app.api.common import graphs
-from app.visited_edges import visited_edges
+from app.app import app
+from app.dependencies import get_current_user
+from app.generator.base import NoRouteError
+from app.generator.executor import GraphNotStored
+from app.visited_edges import visited_store
 
 pytestmark = [pytest.mark.asyncio]
 
@@ -33,16 +39,12 @@ def mock_graph():
 def mock_elevation_service():
     with patch("app.api.route_generation.ElevationService") as mock_cls:
         mock_instance = mock_cls.return_value
-        mock_instance.get = MagicMock(
-            return_value={
-                (19.2, 51.6): 100,
-                (19.21, 51.61): 110,
-                (19.22, 51.62): 105,
-                (19.23, 51.63): 115,
-            }
+        # Down into a valley along x and back up
+        mock_instance.elevations = AsyncMock(
+            side_effect=lambda xs, ys, cache=True: np.rint(
+                np.abs(np.asarray(xs) - 19.215) * 10000
+            )
         )
-        mock_instance.covert_to_list = MagicMock(return_value=[100, 110, 105, 115])
-        mock_instance.calculate_total_gain_lose = MagicMock(return_value=(15, 5))
         yield mock_instance
 
 
@@ -66,21 +68,84 @@ def mock_route_generator():
 @pytest.fixture(autouse=True)
 def clear_graphs_and_edges():
     graphs.clear()
-    visited_edges.clear()
+    visited_store.clear(visited_store.get(None))
     yield
     graphs.clear()
-    visited_edges.clear()
+    visited_store.clear(visited_store.get(None))
 
 
-async def test_clear_endpoint(client):
-    graphs["refactor"] = nx.MultiDiGraph()
-    visited_edges.add((1, 2))
+@pytest.fixture
+def user():
+    user = MagicMock(id=uuid4())
+    app.dependency_overrides[get_current_user] = lambda: user
+    yield user
+    app.dependency_overrides.pop(get_current_user, None)
+    visited_store.clear(visited_store.get(user.id))
+
+
+@pytest.mark.parametrize("path", ["/api/clear?everything=true", "/api/graphs"])
+async def test_cache_endpoints_require_login(client, path):
+    graphs.put("refactor", nx.MultiDiGraph())
+
+    res = await client.get(path)
+
+    assert res.status_code == 401
+    assert "refactor" in graphs
+
+
+async def test_clear_endpoint(client, user):
+    graphs.put("refactor", nx.MultiDiGraph())
+    visited_store.mark(visited_store.get(user.id), [(1, 2)])
+    visited_store.mark(visited_store.get(None), [(1, 2)])
+
+    res = await client.get("/api/clear?everything=true")
+
+    assert res.status_code == 200
+    assert len(graphs) == 0
+    assert len(visited_store.get(user.id)) == 0
+    assert len(visited_store.get(None)) == 1
+
+
+async def test_clear_endpoint_requires_target(client, user):
+    graphs.put("refactor", nx.MultiDiGraph())
 
     res = await client.get("/api/clear")
 
+    assert res.status_code == 422
+    assert "refactor" in graphs
+
+
+async def test_clear_endpoint_evicts_single_graph(client, user, mock_graph):
+    graphs.put("a", mock_graph)
+    graphs.put("b", nx.MultiDiGraph())
+    visited_store.mark(visited_store.get(None), [(1, 2)])
+
+    res = await client.get("/api/clear?key=a")
+
+    assert res.status_code == 200
+    assert "a" not in graphs
+    assert "b" in graphs
+    assert len(visited_store.get(None)) == 1
+
+    res = await client.get("/api/clear?key=a")
+    assert res.status_code == 404
+
+
+async def test_graphs_endpoint(client, user, mock_graph):
+    hits, misses = graphs.hits, graphs.misses
+    graphs.put("a", mock_graph)
+    graphs.get("a")
+    graphs.get("missing")
+
+    res = await client.get("/api/graphs")
+
     assert res.status_code == 200
-    assert graphs == {}
-    assert len(visited_edges) == 0
+    data = res.json()
+    assert data["hits"] == hits + 1
+    assert data["misses"] == misses + 1
+    assert [g["key"] for g in data["graphs"]] == ["a"]
+    assert data["graphs"][0]["nodes"] == 4
+    assert data["graphs"][0]["edges"] == 10
 
 
 async def test_route_invalid_algorithm(client):
@@ -90,7 +155,7 @@ async def test_route_invalid_algorithm(client):
 
 
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_random_algorithm(
     mock_nearest_nodes,
     mock_get_graph,
@@ -100,7 +165,7 @@ async def test_route_random_algorithm(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/random")
 
@@ -115,8 +180,70 @@ async def test_route_random_algorithm(
     assert "total_lose" in data
 
 
+@pytest.mark.parametrize(
+    "stored, worker_error",
+    [(False, None), (True, GraphNotStored("Graph is not in the store"))],
+)
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
+async def test_route_falls_back_to_thread_for_unstored_graph(
+    mock_nearest_nodes,
+    mock_get_graph,
+    stored,
+    worker_error,
+    client,
+    mock_graph,
+    mock_elevation_service,
+    mock_route_generator,
+):
+    mock_graph.graph.update(bbox=(19.1, 51.5, 19.3, 51.7), network_type="walk")
+    mock_get_graph.return_value = mock_graph
+    mock_nearest_nodes.return_value = [1, 3]
+
+    with (
+        patch("app.api.route_generation.graph_store.contains", return_value=stored),
+        patch(
+            "app.api.route_generation.route_executor.run",
+            AsyncMock(side_effect=worker_error),
+        ) as run,
+    ):
+        res = await client.get("/api/route/random")
+
+    assert res.status_code == 200, res.json()
+    assert run.called == stored
+    mock_route_generator[0].return_value.generate.assert_called_once()
+
+
+@patch("app.api.route_generation.get_or_create_graph")
+@patch("app.api.route_generation.nearest_nodes")
+async def test_route_compact_formats(
+    mock_nearest_nodes,
+    mock_get_graph,
+    client,
+    mock_graph,
+    mock_elevation_service,
+    mock_route_generator,
+):
+    mock_get_graph.return_value = mock_graph
+    mock_nearest_nodes.return_value = [1, 3]
+
+    polyline = await client.get(
+        "/api/route/random",
+        headers={"Accept": "application/vnd.travelmap.polyline+json"},
+    )
+    delta = await client.get("/api/route/random?format=delta")
+
+    assert polyline.headers["content-type"].startswith(
+        "application/vnd.travelmap.polyline+json"
+    )
+    assert isinstance(polyline.json()["polyline"], str)
+    assert "x" not in polyline.json() and "segments" not in polyline.json()
+    assert sum(span["edges"] for span in delta.json()["spans"]) > 0
+    assert len(delta.json()["x"]) == len(delta.json()["y"])
+
+
+@patch("app.api.route_generation.get_or_create_graph")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_dfs_algorithm(
     mock_nearest_nodes,
     mock_get_graph,
@@ -126,7 +253,7 @@ async def test_route_dfs_algorithm(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/dfs")
 
@@ -134,7 +261,7 @@ async def test_route_dfs_algorithm(
 
 
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_astar_algorithm(
     mock_nearest_nodes,
     mock_get_graph,
@@ -144,7 +271,7 @@ async def test_route_astar_algorithm(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/astar")
 
@@ -152,7 +279,7 @@ async def test_route_astar_algorithm(
 
 
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_with_end_coordinates(
     mock_nearest_nodes,
     mock_get_graph,
@@ -162,7 +289,7 @@ async def test_route_with_end_coordinates(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/random?end_x=19.22&end_y=51.62")
 
@@ -170,7 +297,7 @@ async def test_route_with_end_coordinates(
 
 
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_with_custom_distance(
     mock_nearest_nodes,
     mock_get_graph,
@@ -180,7 +307,7 @@ async def test_route_with_custom_distance(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/random?distance=10000")
 
@@ -188,7 +315,7 @@ async def test_route_with_custom_distance(
 
 
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_with_prefer_new(
     mock_nearest_nodes,
     mock_get_graph,
@@ -198,7 +325,7 @@ async def test_route_with_prefer_new(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/random?prefer_new=true")
 
@@ -207,7 +334,7 @@ async def test_route_with_prefer_new(
 
 async def test_visited_routes_endpoint(client, mock_graph, mock_elevation_service):
     with patch("app.api.route_generation.get_or_create_graph", return_value=mock_graph):
-        visited_edges.add((1, 2))
+        visited_store.mark(visited_store.get(None), [(1, 2)])
 
         res = await client.get("/api/visited-routes")
 
@@ -220,7 +347,7 @@ async def test_visited_edges_as_points_endpoint(
     client, mock_graph, mock_elevation_service
 ):
     with patch("app.api.route_generation.get_or_create_graph", return_value=mock_graph):
-        visited_edges.add((1, 2))
+        visited_store.mark(visited_store.get(None), [(1, 2)])
 
         res = await client.get("/api/visited-edges-as-points")
 
@@ -229,8 +356,27 @@ async def test_visited_edges_as_points_endpoint(
         assert isinstance(data, list)
 
 
+async def test_visited_routes_in_bbox(client, mock_graph, mock_elevation_service):
+    with patch("app.api.route_generation.get_or_create_graph", return_value=mock_graph):
+        visited_store.mark(visited_store.get(None), [(1, 2), (3, 4)])
+
+        everything = await client.get("/api/visited-routes")
+        in_view = await client.get(
+            "/api/visited-routes",
+            params={"south": 51.595, "north": 51.605, "west": 19.195, "east": 19.205},
+        )
+        points = await client.get(
+            "/api/visited-edges-as-points",
+            params={"south": 51.595, "north": 51.605, "west": 19.195, "east": 19.205},
+        )
+
+    assert len(everything.json()) == 2
+    assert in_view.json() == [[[51.6, 19.2], [51.61, 19.21]]]
+    assert points.json() == [[51.6, 19.2], [51.61, 19.21]]
+
+
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_response_structure(
     mock_nearest_nodes,
     mock_get_graph,
@@ -240,7 +386,7 @@ async def test_route_response_structure(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/random")
 
@@ -265,7 +411,7 @@ async def test_route_response_structure(
 
 
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_response_skip_elevation(
     mock_nearest_nodes,
     mock_get_graph,
@@ -275,7 +421,7 @@ async def test_route_response_skip_elevation(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/random?skip_elevation=false")
 
@@ -288,9 +434,8 @@ async def test_route_response_skip_elevation(
     assert isinstance(data["y"], list)
     assert isinstance(data["distance"], float)
     assert isinstance(data["segments"], list)
-    assert isinstance(data["elevation"], list)
-    assert data["total_gain"] > 0
-    assert data["total_lose"] > 0
+    assert len(data["elevation"]) == len(data["x"])
+    assert (data["total_gain"], data["total_lose"]) == (100, 100)
 
     for segment in data["segments"]:
         assert "new" in segment
@@ -300,7 +445,7 @@ async def test_route_response_skip_elevation(
 
 
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_route_response_skip_elevation_true(
     mock_nearest_nodes,
     mock_get_graph,
@@ -309,7 +454,7 @@ async def test_route_response_skip_elevation_true(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/api/route/random?skip_elevation=true")
 
@@ -331,3 +476,23 @@ async def test_route_response_skip_elevation_true(
         assert "distance" in segment
         assert isinstance(segment["new"], bool)
         assert isinstance(segment["distance"], float)
+
+
+@patch("app.api.route_generation.get_or_create_graph")
+@patch("app.api.route_generation.nearest_nodes")
+async def test_route_without_solution_returns_422(
+    mock_nearest_nodes,
+    mock_get_graph,
+    client,
+    mock_graph,
+    mock_route_generator,
+):
+    mock_get_graph.return_value = mock_graph
+    mock_nearest_nodes.return_value = [1, 3]
+    mock_random, _, _ = mock_route_generator
+    mock_random.return_value.generate.side_effect = NoRouteError("unreachable")
+
+    res = await client.get("/api/route/random?end_x=19.22&end_y=51.62")
+
+    assert res.status_code == 422
+    assert res.json()["detail"] == "unreachable"
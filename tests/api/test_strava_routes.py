@@ -0,0 +1,138 @@
+from unittest.mock import patch
+
+import networkx as nx
+import pytest
+
+from app import visited_edges
+from app.app import app
+from app.dependencies import get_strava_route_repository
+from app.infrastructure.repositories.strava_route import MongoStravaRouteRepository
+from app.visited_edges import VisitedStore, visited_store
+from tests.test_visited_edges import FakeRedis
+
+pytestmark = [pytest.mark.asyncio]
+
+
+class FakeCursor:
+    def __init__(self, docs: list[dict]) -> None:
+        self.docs = docs
+
+    def sort(self, field: str, direction: int) -> "FakeCursor":
+        return FakeCursor(sorted(self.docs, key=lambda d: d[field]))
+
+    def limit(self, n: int) -> "FakeCursor":
+        return FakeCursor(self.docs[:n])
+
+    def batch_size(self, n: int) -> "FakeCursor":
+        return self
+
+    async def to_list(self) -> list[dict]:
+        return self.docs
+
+    async def __aiter__(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeAsyncCollection:
+    """Filters on ``{"id": {"$gt": n}}`` and projects like Mongo."""
+
+    def __init__(self, docs: list[dict]) -> None:
+        self.docs = docs
+
+    def _project(self, doc: dict, projection: dict) -> dict:
+        included = [f for f, on in projection.items() if on and f != "_id"]
+        if included:
+            return {f: doc[f] for f in included if f in doc}
+        return {f: v for f, v in doc.items() if projection.get(f, 1)}
+
+    def find(self, query: dict, projection: dict) -> FakeCursor:
+        after = query.get("id", {}).get("$gt")
+        docs = [d for d in self.docs if after is None or d["id"] > after]
+        return FakeCursor([self._project(d, projection) for d in docs])
+
+    async def find_one(self, query: dict, projection: dict) -> dict | None:
+        docs = [d for d in self.docs if d["id"] == query["id"]]
+        return self._project(docs[0], projection) if docs else None
+
+
+def _route(route_id: int) -> dict:
+    return {
+        "_id": f"oid{route_id}",
+        "id": route_id,
+        "x": [19.2, 19.21],
+        "y": [51.6, 51.61],
+        "type": "gpx",
+        "name": f"Walk {route_id}",
+        "nodes": [1, 2],
+    }
+
+
+@pytest.fixture
+def routes():
+    collection = FakeAsyncCollection([_route(i) for i in (3, 1, 2)])
+    app.dependency_overrides[get_strava_route_repository] = (
+        lambda: MongoStravaRouteRepository(collection)
+    )
+    yield collection
+    app.dependency_overrides.pop(get_strava_route_repository)
+
+
+async def test_pages_route_summaries(client, routes):
+    first = (await client.get("/api/strava/routes?limit=2")).json()
+    second = (
+        await client.get(f"/api/strava/routes?limit=2&after={first['next_cursor']}")
+    ).json()
+
+    assert first == {
+        "items": [
+            {"id": 1, "type": "gpx", "name": "Walk 1"},
+            {"id": 2, "type": "gpx", "name": "Walk 2"},
+        ],
+        "next_cursor": 2,
+    }
+    assert second == {
+        "items": [{"id": 3, "type": "gpx", "name": "Walk 3"}],
+        "next_cursor": None,
+    }
+
+
+async def test_streams_all_routes_as_json_array(client, routes):
+    res = await client.get("/api/strava/routes/all")
+
+    assert res.status_code == 200
+    assert [route["id"] for route in res.json()] == [1, 2, 3]
+    assert res.json()[0]["x"] == [19.2, 19.21]
+
+
+async def test_gets_one_route(client, routes):
+    assert (await client.get("/api/strava/routes/2")).json()["name"] == "Walk 2"
+    assert (await client.get("/api/strava/routes/9")).status_code == 404
+
+
+async def test_marking_as_visited_again_changes_nothing(client, routes):
+    G = nx.MultiDiGraph()
+    G.add_node(1, x=19.2, y=51.6)
+    G.add_node(2, x=19.21, y=51.61)
+    G.add_edge(1, 2, length=100.0)
+    G.add_edge(2, 1, length=100.0)
+    redis_client = FakeRedis()
+
+    with (
+        patch.object(visited_edges, "get_sync_binary_redis", return_value=redis_client),
+        patch.object(visited_store, "_redis_down_until", 0.0),
+        patch("app.api.common.get_or_create_graph", return_value=G),
+    ):
+        visited_store.clear(visited_store.get(None))
+        first = await client.get("/api/strava/mark-as-visited")
+        log = redis_client.data[VisitedStore.key(None)]
+        second = await client.get("/api/strava/mark-as-visited")
+        visited = visited_store.get(None)
+
+        assert first.json() == second.json()
+        assert first.json()["visited_percent"] == 100
+        # Three routes walked 1 -> 2, logged and counted once
+        assert redis_client.data[VisitedStore.key(None)] == log
+        assert len(log) == 16
+        assert visited.counts.tolist() == [1]
+        visited_store.clear(visited)
@@ -0,0 +1,41 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.api.tiles import MVT_MEDIA_TYPE
+from app.visited_edges import visited_store
+
+pytestmark = [pytest.mark.asyncio]
+
+# z15 tile holding the south-west corner of the street grid
+TILE = "/api/tiles/visited/15/18131/10882.mvt"
+
+
+@pytest.fixture(autouse=True)
+def clear_visited():
+    visited_store.clear(visited_store.get(None))
+    yield
+    visited_store.clear(visited_store.get(None))
+
+
+async def test_visited_tile_follows_visited_edges(client, street_grid):
+    visited = visited_store.get(None)
+    with patch("app.api.tiles.get_or_create_graph", return_value=street_grid):
+        empty = await client.get(TILE)
+        visited_store.mark(visited, [(1, 2), (2, 1)])
+        walked = await client.get(TILE)
+        with patch("app.api.tiles.visited_tile") as render:
+            again = await client.get(TILE)
+
+    assert empty.status_code == 200
+    assert empty.headers["content-type"] == MVT_MEDIA_TYPE
+    assert empty.content == b""
+    assert walked.content
+    assert again.content == walked.content
+    render.assert_not_called()
+
+
+async def test_visited_tile_out_of_range(client):
+    res = await client.get("/api/tiles/visited/2/4/0.mvt")
+
+    assert res.status_code == 404
@@ -1,6 +1,7 @@
 from typing import AsyncIterator
 from unittest.mock import patch
 
+import networkx as nx
 import pytest
 import pytest_asyncio
 from fastapi_cache import FastAPICache
@@ -82,3 +83,30 @@ async def async_session() -> AsyncIterator[AsyncSession]:
         await conn.run_sync(SQLModel.metadata.drop_all)
 
     await async_engine.dispose()
+
+
+def make_street_grid(rows: int = 5, cols: int = 5, step: float = 0.001):
+    """Two-way street grid with OSMnx-like node/edge attributes."""
+    G = nx.MultiDiGraph()
+    for r in range(rows):
+        for c in range(cols):
+            G.add_node(r * cols + c + 1, x=19.2 + c * step, y=51.6 + r * step)
+
+    for r in range(rows):
+        for c in range(cols):
+            u = r * cols + c + 1
+            for v in (
+                u + 1 if c + 1 < cols else None,
+                u + cols if r + 1 < rows else None,
+            ):
+                if v is None:
+                    continue
+                length = 100.0 + (u + v) % 7
+                G.add_edge(u, v, length=length)
+                G.add_edge(v, u, length=length)
+    return G
+
+
+@pytest.fixture
+def street_grid():
+    return make_street_grid()
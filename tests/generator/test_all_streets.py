@@ -0,0 +1,57 @@
+import networkx as nx
+
+from app.generator.all_streets_random import (
+    AllStreetsRoute,
+    UnvisitedEdges,
+    remove_edge_both_directions,
+)
+from app.visited_edges import VisitedEdges
+
+
+def make_fork() -> nx.MultiDiGraph:
+    """1 -> 2 is one long street, 1 -> 3 -> 4 two short ones; 2 and 4 go on."""
+    G = nx.MultiDiGraph()
+    for node in range(1, 7):
+        G.add_node(node, x=19.2 + node * 0.001, y=51.6)
+    for u, v, length in [
+        (1, 2, 500.0),
+        (1, 3, 100.0),
+        (3, 4, 100.0),
+        (2, 5, 50.0),
+        (4, 6, 50.0),
+    ]:
+        G.add_edge(u, v, length=length)
+        G.add_edge(v, u, length=length)
+    return G
+
+
+def test_unvisited_edges_track_degree(street_grid):
+    generator = AllStreetsRoute(street_grid, VisitedEdges())
+    compiled = generator.compiled
+    unvisited = UnvisitedEdges(compiled)
+    corner = compiled.dense(1)
+
+    assert len(unvisited) == compiled.num_edges
+    assert unvisited.degree[corner] == 2
+
+    edge = compiled.edge_id(corner, compiled.dense(2))
+    remove_edge_both_directions(compiled, unvisited, edge)
+    remove_edge_both_directions(compiled, unvisited, edge)
+
+    assert edge not in unvisited
+    assert len(unvisited) == compiled.num_edges - 2
+    assert unvisited.degree[corner] == 1
+    assert unvisited.degree[compiled.dense(2)] == 2
+
+
+def test_recovery_goes_to_nearest_by_length():
+    generator = AllStreetsRoute(make_fork(), VisitedEdges())
+    compiled = generator.compiled
+    unvisited = UnvisitedEdges(compiled)
+    for u, v in [(1, 2), (1, 3), (3, 4)]:
+        edge = compiled.edge_id(compiled.dense(u), compiled.dense(v))
+        remove_edge_both_directions(compiled, unvisited, edge)
+
+    path = generator._path_to_unvisited(compiled.dense(1), unvisited)
+
+    assert compiled.to_osm(path) == [1, 3, 4]
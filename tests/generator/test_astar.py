@@ -0,0 +1,55 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from app.generator.astar import AStarLandmarkRoute, AStarRoute
+from app.graph.compiled import build_compiled_graph
+from app.graph.landmarks import build_landmarks
+from app.visited_edges import VisitedEdges
+
+EDGE_LENGTH = 70.0
+
+
+def make_street_ladder(n: int) -> nx.MultiDiGraph:
+    """Two parallel streets joined every 5 nodes, lengths consistent with coords."""
+    G = nx.MultiDiGraph()
+    for i in range(n):
+        G.add_node(i, x=19.2 + i * 0.001, y=51.6)
+        G.add_node(n + i, x=19.2 + i * 0.001, y=51.601)
+
+    edges = [(o + i, o + i + 1, EDGE_LENGTH) for o in (0, n) for i in range(n - 1)]
+    edges += [(i, n + i, 112.0) for i in range(0, n, 5)]
+    for u, v, length in edges:
+        G.add_edge(u, v, length=length)
+        G.add_edge(v, u, length=length)
+    return G
+
+
+@pytest.mark.parametrize("generator_class", [AStarRoute, AStarLandmarkRoute])
+def test_astar_finds_shortest_path(generator_class):
+    G = make_street_ladder(20)
+
+    route = generator_class(G, VisitedEdges()).generate(
+        start_node=0, end_node=39, distance=2000
+    )
+
+    assert route[0] == 0
+    assert route[-1] == 39
+    assert nx.path_weight(G, route, "length") == pytest.approx(
+        nx.shortest_path_length(G, 0, 39, weight="length")
+    )
+
+
+def test_landmark_bounds_are_admissible():
+    G = make_street_ladder(20)
+    compiled = build_compiled_graph(G)
+    landmarks = build_landmarks(compiled, k=4)
+
+    target = compiled.dense(39)
+    exact = nx.single_source_dijkstra_path_length(G.reverse(), 39, weight="length")
+    bounds = landmarks.lower_bounds(target)
+
+    for node, distance in exact.items():
+        assert bounds[compiled.dense(node)] <= distance + 1e-6
+    assert np.count_nonzero(bounds) > 0
+    assert len(landmarks.nodes) == 4
@@ -0,0 +1,61 @@
+import networkx as nx
+import numpy as np
+
+from app.generator import chinese_postman
+from app.generator.all_streets_random import AllStreetsRoute
+from app.generator.chinese_postman import ChinesePostmanRoute
+from app.visited_edges import VisitedEdges
+
+
+def streets(route: list[int]) -> set[frozenset[int]]:
+    return {frozenset(step) for step in zip(route, route[1:])}
+
+
+def route_length(G: nx.MultiDiGraph, route: list[int]) -> float:
+    return sum(
+        min(d["length"] for d in G[u][v].values()) for u, v in zip(route, route[1:])
+    )
+
+
+def test_walks_every_street_and_returns(street_grid):
+    route = ChinesePostmanRoute(street_grid, VisitedEdges()).generate(start_node=1)
+
+    assert route[0] == route[-1] == 1
+    assert streets(route) == {frozenset((u, v)) for u, v in street_grid.edges()}
+    assert all(street_grid.has_edge(u, v) for u, v in zip(route, route[1:]))
+
+
+def test_shorter_than_greedy(street_grid):
+    postman = ChinesePostmanRoute(street_grid.copy(), VisitedEdges()).generate(
+        start_node=13
+    )
+    greedy = AllStreetsRoute(street_grid.copy(), VisitedEdges()).generate(start_node=13)
+
+    total = sum(d["length"] for u, v, d in street_grid.edges(data=True) if u < v)
+    assert route_length(street_grid, postman) <= route_length(street_grid, greedy)
+    assert route_length(street_grid, postman) < 2 * total
+
+
+def test_greedy_matching_above_limit(street_grid, monkeypatch):
+    monkeypatch.setattr(chinese_postman, "EXACT_MATCHING_LIMIT", 0)
+
+    route = ChinesePostmanRoute(street_grid, VisitedEdges()).generate(start_node=1)
+
+    assert route[0] == route[-1] == 1
+    assert streets(route) == {frozenset((u, v)) for u, v in street_grid.edges()}
+
+
+def test_one_way_street_is_detoured():
+    # Triangle 1 -> 2 -> 3 -> 1 of one-way streets: walking it backwards
+    # is not allowed, so any step against the flow goes around instead.
+    G = nx.MultiDiGraph()
+    for node, (x, y) in {1: (0.0, 0.0), 2: (0.001, 0.0), 3: (0.0, 0.001)}.items():
+        G.add_node(node, x=x, y=y)
+    for u, v in [(1, 2), (2, 3), (3, 1)]:
+        G.add_edge(u, v, length=150.0)
+
+    route = ChinesePostmanRoute(G, VisitedEdges()).generate(start_node=1)
+
+    assert route[0] == route[-1] == 1
+    assert all(G.has_edge(u, v) for u, v in zip(route, route[1:]))
+    assert np.isclose(route_length(G, route), 450.0)
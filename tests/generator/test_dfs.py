@@ -0,0 +1,58 @@
+from unittest.mock import patch
+
+import networkx as nx
+import pytest
+
+from app.generator.base import NoRouteError
+from app.generator.dfs import DfsRoute
+from app.visited_edges import VisitedEdges
+
+EDGE_LENGTH = 70.0  # a little over 0.001 deg of longitude at this latitude
+
+
+def make_street_line(n: int) -> nx.MultiDiGraph:
+    G = nx.MultiDiGraph()
+    for i in range(1, n + 1):
+        G.add_node(i, x=19.2 + i * 0.001, y=51.6)
+    for i in range(1, n):
+        G.add_edge(i, i + 1, length=EDGE_LENGTH)
+        G.add_edge(i + 1, i, length=EDGE_LENGTH)
+    return G
+
+
+def test_dfs_handles_paths_deeper_than_recursion_limit():
+    G = make_street_line(3000)
+
+    route = DfsRoute(G, VisitedEdges()).generate(
+        start_node=1,
+        end_node=3000,
+        distance=int(2999 * EDGE_LENGTH),
+        depth_limit=5000,
+    )
+
+    assert route == list(range(1, 3001))
+
+
+def test_dfs_prunes_targets_out_of_reach():
+    G = make_street_line(100)
+    dfs = DfsRoute(G, VisitedEdges())
+
+    with patch.object(
+        dfs, "get_neighbours_and_sort", wraps=dfs.get_neighbours_and_sort
+    ) as expand:
+        with pytest.raises(NoRouteError):
+            dfs.generate(start_node=1, end_node=100, distance=1000)
+
+    expand.assert_not_called()
+
+
+def test_v2_prefers_the_least_walked_streets(street_grid):
+    # From node 7: twice to 2, once from 8 (the other way), never to 6 or 12
+    visited = VisitedEdges(pairs=[(7, 2), (8, 7)], counts=[2, 1])
+    dfs = DfsRoute(street_grid, visited)
+    index = dfs.compiled.index
+
+    order = dfs.sort_by_occurrance([index[n] for n in (2, 6, 8, 12)], index[7])
+
+    assert sorted(order[:2]) == [index[6], index[12]]
+    assert order[2:] == [index[8], index[2]]
@@ -0,0 +1,105 @@
+import os
+import signal
+from dataclasses import replace
+
+import pytest
+
+from app.generator import executor as executor_module
+from app.generator.all_streets_random import AllStreetsRoute
+from app.generator.executor import (
+    GraphNotStored,
+    RouteExecutor,
+    RouteJob,
+    RouteJobCancelled,
+    RouteJobTimeout,
+    RouteQueueFull,
+    RouteWorkerLost,
+)
+from app.graph.store import GraphStore
+from app.visited_edges import VisitedEdges
+
+pytestmark = [pytest.mark.asyncio]
+
+BBOX = (19.15, 51.55, 19.25, 51.65)
+
+
+def _job(**kwargs) -> RouteJob:
+    return RouteJob(
+        generator_class=AllStreetsRoute,
+        bbox=BBOX,
+        network_type="walk",
+        visited=VisitedEdges(),
+        start_node=1,
+        end_node=None,
+        distance=1000,
+        prefer_new=False,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def stored_grid(tmp_path, street_grid):
+    GraphStore(tmp_path).save(BBOX, "walk", street_grid)
+    return tmp_path
+
+
+@pytest.fixture
+def executor(stored_grid):
+    executor = RouteExecutor(stored_grid, workers=1, queue_size=0, timeout=30)
+    yield executor
+    executor.shutdown()
+
+
+async def test_generates_route_in_worker(executor, street_grid):
+    route = await executor.run(_job())
+
+    assert route[0] == 1
+    walked = {frozenset(e) for e in zip(route, route[1:])}
+    assert walked == {frozenset(e) for e in street_grid.edges()}
+
+
+async def test_rejects_jobs_over_queue_size(executor):
+    await executor._slot_available.acquire()
+
+    with pytest.raises(RouteQueueFull):
+        await executor.run(_job())
+
+
+async def test_stops_jobs_over_timeout(executor):
+    executor.timeout = 1e-6
+
+    with pytest.raises(RouteJobTimeout):
+        await executor.run(_job())
+
+    executor.timeout = 30
+    assert await executor.run(_job())
+
+
+async def test_reports_graphs_missing_from_the_store(executor):
+    with pytest.raises(GraphNotStored):
+        await executor.run(replace(_job(), bbox=(0.0, 0.0, 0.1, 0.1)))
+
+
+async def test_restarts_the_pool_when_a_worker_dies(executor):
+    assert await executor.run(_job())
+    for pid in list(executor._pool._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    with pytest.raises(RouteWorkerLost):
+        await executor.run(_job())
+
+    assert executor._pool is None
+    assert await executor.run(_job())
+
+
+async def test_checkpoint_stops_cancelled_and_late_jobs(monkeypatch):
+    monkeypatch.setattr(executor_module, "_cancel_flags", [0])
+    executor_module._checkpoint(0, deadline=float("inf"))()
+
+    monkeypatch.setattr(executor_module, "_cancel_flags", [1])
+    with pytest.raises(RouteJobCancelled):
+        executor_module._checkpoint(0, deadline=float("inf"))()
+
+    monkeypatch.setattr(executor_module, "_cancel_flags", [0])
+    with pytest.raises(RouteJobTimeout):
+        executor_module._checkpoint(0, deadline=0.0)()
@@ -1,8 +1,11 @@
 import networkx as nx
 import osmnx as ox
+import pytest
 
 from app.api.common import get_city_bbox
 from app.generator.all_streets_random import AllStreetsRoute
+from app.generator.base import NoRouteError, RouteBudgetExceeded
+from app.generator.random_route import RandomRoute
 from app.utils import remove_farthest_nodes
 from app.visited_edges import VisitedEdges
 
@@ -57,3 +60,40 @@ def test_random_route():
 
     ox.plot_graph(G)
     assert 0
+
+
+def test_random_route_rejects_unreachable_target(street_grid):
+    street_grid.add_node(100, x=19.3, y=51.7)
+    street_grid.add_edge(100, 101, length=50.0)
+    street_grid.add_node(101, x=19.3005, y=51.7)
+
+    with pytest.raises(NoRouteError):
+        RandomRoute(street_grid, VisitedEdges()).generate(
+            start_node=1, end_node=101, distance=1000
+        )
+
+
+def test_random_route_rejects_target_out_of_range(street_grid):
+    with pytest.raises(NoRouteError):
+        RandomRoute(street_grid, VisitedEdges()).generate(
+            start_node=1, end_node=5, distance=100
+        )
+
+
+def test_random_route_stops_when_budget_runs_out(street_grid):
+    generator = RandomRoute(street_grid, VisitedEdges())
+    generator.STEP_BUDGET = 0
+
+    with pytest.raises(RouteBudgetExceeded):
+        generator.generate(start_node=1, end_node=5, distance=800)
+
+
+def test_random_route_picks_best_walk_of_batch(street_grid):
+    route = RandomRoute(street_grid, VisitedEdges()).generate(
+        start_node=1, end_node=5, distance=600
+    )
+
+    assert route[0] == 1
+    assert route[-1] == 5
+    length = nx.path_weight(street_grid, route, "length")
+    assert 480 < length <= 720
@@ -0,0 +1,55 @@
+from unittest.mock import patch
+
+from app.api import common
+from app.graph.cache import GraphCache, graph_nbytes
+from tests.conftest import make_street_grid
+
+
+def test_graph_cache_evicts_least_recently_used():
+    a, b, c = make_street_grid(), make_street_grid(), make_street_grid()
+    cache = GraphCache(max_bytes=graph_nbytes(a) * 2)
+
+    cache.put("a", a)
+    cache.put("b", b)
+    assert cache.get("a") is a
+    cache.put("c", c)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.evictions == 1
+    assert [e.key for e in cache.entries()] == ["a", "c"]
+
+
+def test_graph_cache_keeps_newest_graph_over_budget():
+    cache = GraphCache(max_bytes=1)
+
+    cache.put("a", make_street_grid())
+    cache.put("b", make_street_grid())
+
+    assert len(cache) == 1
+    assert "b" in cache
+
+
+def test_graph_cache_counts_hits_and_misses(street_grid):
+    cache = GraphCache(max_bytes=10 * 1024**2)
+    cache.put("a", street_grid)
+
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.entries()[0].hits == 2
+
+
+def test_nearby_start_points_share_a_graph(street_grid):
+    with (
+        patch.object(common, "graphs", GraphCache(max_bytes=10 * 1024**2)),
+        patch.object(common, "load_or_stitch_graph", return_value=street_grid) as fetch,
+    ):
+        first = common.get_or_create_graph(19.2001, 51.6101)
+        second = common.get_or_create_graph(19.2012, 51.6098)
+
+    assert first is second
+    fetch.assert_called_once()
@@ -0,0 +1,159 @@
+import math
+
+import networkx as nx
+import pytest
+from shapely.geometry import LineString
+
+from app import utils
+from app.generator.all_streets_random import AllStreetsRoute
+from app.generator.astar import AStarRoute
+from app.generator.dfs import DfsRoute
+from app.generator.random_route import RandomRoute
+from app.graph.compiled import build_compiled_graph, get_compiled_graph, prepare_graph
+from app.visited_edges import VisitedEdges
+
+
+def test_compiled_graph_matches_networkx(street_grid):
+    street_grid.add_edge(1, 2, length=42.0)  # shorter parallel edge
+    compiled = build_compiled_graph(street_grid)
+
+    assert compiled.num_nodes == street_grid.number_of_nodes()
+    assert compiled.num_edges == len(set(street_grid.edges()))
+
+    for u in street_grid.nodes:
+        du = compiled.dense(u)
+        assert compiled.coords(du) == (
+            street_grid.nodes[u]["x"],
+            street_grid.nodes[u]["y"],
+        )
+        assert set(compiled.to_osm(compiled.successors(du))) == set(
+            street_grid.neighbors(u)
+        )
+        for v in street_grid.neighbors(u):
+            expected = min(d["length"] for d in street_grid[u][v].values())
+            assert compiled.length(du, compiled.dense(v)) == expected
+
+    assert compiled.length(compiled.dense(1), compiled.dense(2)) == 42.0
+
+
+def test_compiled_graph_reverse_and_bearing(street_grid):
+    street_grid.add_edge(1, 25, length=1000.0)  # one-way
+    compiled = build_compiled_graph(street_grid)
+
+    one_way = compiled.edge_id(compiled.dense(1), compiled.dense(25))
+    assert compiled.reverse_edge(one_way) == -1
+
+    east = compiled.edge_id(compiled.dense(1), compiled.dense(2))
+    west = compiled.reverse_edge(east)
+    assert compiled.source(west) == compiled.dense(2)
+    assert compiled.target(west) == compiled.dense(1)
+    assert compiled.bearing(east) == pytest.approx(0.0)
+    assert compiled.bearing(west) == pytest.approx(math.pi)
+
+
+def test_get_compiled_graph_is_cached(street_grid):
+    compiled = get_compiled_graph(street_grid)
+    assert get_compiled_graph(street_grid) is compiled
+
+    street_grid.remove_node(25)
+    assert get_compiled_graph(street_grid) is not compiled
+
+
+def _assert_walkable(graph, route):
+    for u, v in zip(route, route[1:]):
+        assert graph.has_edge(u, v)
+
+
+@pytest.mark.parametrize("generator_class", [DfsRoute, RandomRoute])
+def test_loop_generators_on_compiled_graph(street_grid, generator_class):
+    route = generator_class(street_grid, VisitedEdges()).generate(
+        start_node=1, end_node=None, distance=600
+    )
+
+    assert route[0] == 1
+    _assert_walkable(street_grid, route)
+
+
+def test_astar_on_compiled_graph(street_grid):
+    route = AStarRoute(street_grid, VisitedEdges()).generate(
+        start_node=1, end_node=25, distance=800
+    )
+
+    assert route[0] == 1
+    assert route[-1] == 25
+    assert len(route) == 9
+    _assert_walkable(street_grid, route)
+
+
+def test_all_streets_covers_every_street(street_grid):
+    route = AllStreetsRoute(street_grid, VisitedEdges()).generate(start_node=1)
+
+    _assert_walkable(street_grid, route)
+    walked = {frozenset(e) for e in zip(route, route[1:])}
+    assert walked == {frozenset(e) for e in street_grid.edges()}
+
+
+def test_edge_index_keeps_shortest_parallel_edge_and_geometry(street_grid):
+    bend = LineString([(19.2, 51.6), (19.2005, 51.6003), (19.201, 51.6)])
+    street_grid.add_edge(1, 2, length=42.0, geometry=bend)
+    compiled = build_compiled_graph(street_grid)
+
+    edge = compiled.find_edge(1, 2)
+    assert compiled.edge_length(edge) == 42.0
+    assert compiled.keys[edge] == 1
+    assert compiled.edge_geometry(edge) == (
+        [19.2, 19.2005, 19.201],
+        [51.6, 51.6003, 51.6],
+    )
+    assert compiled.edge_geometry(compiled.find_edge(2, 1)) == (
+        [19.2 + 0.001, 19.2],
+        [51.6, 51.6],
+    )
+
+    assert compiled.find_edge(1, 25) is None
+
+
+def test_route_helpers_use_edge_index(street_grid):
+    street_grid.add_edge(1, 2, length=42.0)
+    route = [1, 2, 3, 8]
+
+    x, y = utils.route_to_x_y(street_grid, route)
+
+    assert x == pytest.approx([19.2, 19.201, 19.201, 19.202, 19.202, 19.202])
+    assert y == pytest.approx([51.6, 51.6, 51.6, 51.6, 51.6, 51.601])
+    assert utils.get_distance_between(street_grid, 1, 2) == 42.0
+    assert utils.get_route_distance(street_grid, route) == sum(
+        utils.get_distance_between(street_grid, u, v) for u, v in zip(route, route[1:])
+    )
+
+
+def test_prepare_graph_prunes_once_and_freezes(street_grid):
+    street_grid.add_node(100, x=19.3, y=51.7)  # isolated
+    street_grid.add_node(101, x=19.31, y=51.7)
+    street_grid.add_edge(100, 101, length=50.0)  # separate component
+    street_grid.add_node(102, x=19.32, y=51.7)  # isolated
+
+    compiled = prepare_graph(street_grid)
+
+    assert compiled.num_nodes == street_grid.number_of_nodes() == 25
+    assert get_compiled_graph(street_grid) is compiled
+    assert nx.is_frozen(street_grid)
+    assert prepare_graph(street_grid) is compiled
+    with pytest.raises(nx.NetworkXError):
+        street_grid.remove_node(1)
+
+
+def test_visited_mask_covers_both_directions(street_grid):
+    v_edges = VisitedEdges()
+    v_edges.mark_edges_visited([1, 2, 1])
+    v_edges.mark_edges_visited([2, 3])
+    compiled = get_compiled_graph(street_grid)
+
+    mask = v_edges.edge_mask(compiled)
+
+    def visited(u, v):
+        return mask[compiled.edge_id(compiled.dense(u), compiled.dense(v))]
+
+    assert visited(1, 2) and visited(2, 1)
+    assert visited(2, 3) and visited(3, 2)
+    assert mask.sum() == 4
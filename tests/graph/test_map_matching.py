@@ -0,0 +1,77 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from app.graph import map_matching
+from app.graph.compiled import get_compiled_graph
+from app.graph.map_matching import MapMatcher, match_track
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.data: dict[str, bytes] = {}
+
+    def get(self, key: str) -> bytes | None:
+        return self.data.get(key)
+
+    def set(self, key: str, value: bytes, ex: int | None = None) -> None:
+        self.data[key] = value
+
+
+def noisy_track(G, route: list[int], per_edge: int = 8, noise: float = 3e-5):
+    """Fixes along ``route`` with a few meters of noise."""
+    rng = np.random.default_rng(1)
+    xs, ys = [], []
+    for u, v in zip(route, route[1:]):
+        t = np.linspace(0, 1, per_edge, endpoint=False)
+        xs.extend(G.nodes[u]["x"] + t * (G.nodes[v]["x"] - G.nodes[u]["x"]))
+        ys.extend(G.nodes[u]["y"] + t * (G.nodes[v]["y"] - G.nodes[u]["y"]))
+    xs.append(G.nodes[route[-1]]["x"])
+    ys.append(G.nodes[route[-1]]["y"])
+    return (
+        np.array(xs) + rng.normal(0, noise, len(xs)),
+        np.array(ys) + rng.normal(0, noise, len(ys)),
+    )
+
+
+def test_matches_noisy_track_to_walked_streets(street_grid):
+    route = [1, 2, 3, 4, 5, 10, 15, 14]
+    xs, ys = noisy_track(street_grid, route)
+
+    assert match_track(street_grid, xs, ys) == route
+
+
+def test_fills_sparse_fixes_with_connected_walk(street_grid):
+    compiled = get_compiled_graph(street_grid)
+    xs = [street_grid.nodes[1]["x"], street_grid.nodes[15]["x"]]
+    ys = [street_grid.nodes[1]["y"], street_grid.nodes[15]["y"]]
+
+    walk = match_track(street_grid, xs, ys)
+
+    assert walk[0] == 1 and walk[-1] == 15
+    assert all(compiled.find_edge(u, v) is not None for u, v in zip(walk, walk[1:]))
+    # 4 blocks east and 2 north, without detours
+    assert len(walk) == 7
+
+
+def test_skips_fixes_far_from_streets(street_grid):
+    xs, ys = noisy_track(street_grid, [1, 2, 3])
+    xs = np.insert(xs, 5, 19.5)
+    ys = np.insert(ys, 5, 51.9)
+
+    matcher = MapMatcher(get_compiled_graph(street_grid))
+
+    assert get_compiled_graph(street_grid).to_osm(matcher.match(xs, ys)) == [1, 2, 3]
+
+
+def test_caches_by_file_digest(street_grid):
+    xs, ys = noisy_track(street_grid, [1, 2, 3])
+    digest = map_matching.match_cache.digest(b"<gpx/>")
+    redis_client = FakeRedis()
+    with patch.object(map_matching, "get_sync_binary_redis", return_value=redis_client):
+        first = match_track(street_grid, xs, ys, digest)
+        with patch.object(MapMatcher, "match") as match:
+            second = match_track(street_grid, xs, ys, digest)
+
+    assert first == second == [1, 2, 3]
+    match.assert_not_called()
@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from app.graph import singleflight
+from app.graph.singleflight import SingleFlight
+
+
+@pytest.fixture
+def redis_client():
+    client = MagicMock()
+    with patch.object(singleflight, "get_sync_redis", return_value=client):
+        yield client
+
+
+def test_concurrent_calls_share_one_result(redis_client):
+    flight = SingleFlight(lock_prefix="lock:", lock_timeout=10)
+    calls = 0
+    started = threading.Event()
+
+    def fetch():
+        nonlocal calls
+        calls += 1
+        started.set()
+        time.sleep(0.2)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        leader = pool.submit(flight.do, "a", fetch)
+        started.wait()
+        followers = [pool.submit(flight.do, "a", fetch) for _ in range(7)]
+        results = [f.result() for f in [leader, *followers]]
+
+    assert calls == 1
+    assert all(r is results[0] for r in results)
+    redis_client.lock.assert_called_once_with("lock:a", timeout=10, blocking_timeout=10)
+    redis_client.lock.return_value.release.assert_called_once()
+
+
+def test_errors_reach_every_caller_and_are_not_cached(redis_client):
+    flight = SingleFlight(lock_prefix="lock:", lock_timeout=10)
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("overpass down")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "a", fail)
+        started.wait()
+        follower = pool.submit(flight.do, "a", fail)
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+
+    assert flight.do("a", lambda: 1) == 1
+
+
+def test_runs_without_redis(redis_client):
+    redis_client.lock.return_value.acquire.side_effect = ConnectionError("down")
+    flight = SingleFlight(lock_prefix="lock:", lock_timeout=10)
+
+    assert flight.do("a", lambda: 1) == 1
+    redis_client.lock.return_value.release.assert_not_called()
@@ -0,0 +1,72 @@
+import networkx as nx
+import numpy as np
+from shapely.geometry import LineString
+
+from app.graph.compiled import get_compiled_graph
+from app.graph.spatial import get_spatial_index, nearest_nodes
+
+
+def test_nearest_nodes_match_brute_force(street_grid):
+    rng = np.random.default_rng(0)
+    xs = rng.uniform(19.199, 19.206, 500)
+    ys = rng.uniform(51.599, 51.606, 500)
+
+    snapped = nearest_nodes(street_grid, xs, ys)
+
+    node_ids = list(street_grid.nodes)
+    coords = np.array([(d["x"], d["y"]) for _, d in street_grid.nodes(data=True)])
+    cos_lat = np.cos(np.radians(51.6))
+    dx = (xs[:, None] - coords[:, 0]) * cos_lat
+    dy = ys[:, None] - coords[:, 1]
+    expected = [node_ids[i] for i in np.argmin(dx**2 + dy**2, axis=1)]
+    assert snapped == expected
+
+
+def test_edge_candidates_follow_geometry():
+    # 1 -> 2 bends far north, so a point north of the straight line between
+    # the nodes is closer to the curved street than to the straight 1 -> 3 -> 2.
+    G = nx.MultiDiGraph()
+    G.add_node(1, x=19.200, y=51.600)
+    G.add_node(2, x=19.210, y=51.600)
+    G.add_node(3, x=19.205, y=51.599)
+    bend = LineString([(19.200, 51.600), (19.205, 51.605), (19.210, 51.600)])
+    G.add_edge(1, 2, length=1000.0, geometry=bend)
+    G.add_edge(1, 3, length=500.0)
+    G.add_edge(3, 2, length=500.0)
+
+    compiled = get_compiled_graph(G)
+    index = get_spatial_index(compiled)
+
+    edges, _, _ = index.edge_candidates(
+        index.project([19.205, 19.2051], [51.6049, 51.5992]), k=1, radius=np.inf
+    )
+
+    nearest = edges[:, 0]
+    u = compiled.node_ids[compiled.sources[nearest]].tolist()
+    v = compiled.node_ids[compiled.targets[nearest]].tolist()
+    assert list(zip(u, v)) == [(1, 2), (3, 2)]
+
+
+def test_index_is_built_once(street_grid):
+    compiled = get_compiled_graph(street_grid)
+
+    assert get_spatial_index(compiled) is get_spatial_index(compiled)
+
+
+def test_edges_in_bbox_match_brute_force(street_grid):
+    compiled = get_compiled_graph(street_grid)
+    index = get_spatial_index(compiled)
+    bbox = (19.2005, 51.6005, 19.2025, 51.6015)
+
+    edges = index.edges_in_bbox(*bbox)
+
+    west, south, east, north = bbox
+    bounds = compiled.edge_bounds
+    expected = np.flatnonzero(
+        (bounds[:, 0] <= east)
+        & (bounds[:, 2] >= west)
+        & (bounds[:, 1] <= north)
+        & (bounds[:, 3] >= south)
+    )
+    assert edges.tolist() == expected.tolist()
+    assert 0 < len(edges) < compiled.num_edges
@@ -0,0 +1,66 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app import utils
+from app.api import common
+from app.graph.compiled import get_compiled_graph
+from app.graph.store import GraphStore
+from app.graph.tiles import Tile
+
+BBOX = (19.19, 51.59, 19.21, 51.61)
+TILE = Tile(383, 1031, 0.05)
+
+
+def test_store_roundtrip_is_memory_mapped(tmp_path, street_grid):
+    store = GraphStore(tmp_path)
+    original = get_compiled_graph(street_grid)
+
+    assert store.load(BBOX, "walk") is None
+    store.save(BBOX, "walk", street_grid)
+    G = store.load(BBOX, "walk")
+
+    compiled = get_compiled_graph(G)
+    assert isinstance(compiled.targets, np.memmap)
+    assert np.array_equal(compiled.targets, original.targets)
+    assert np.array_equal(compiled.geometry_x, original.geometry_x)
+    assert set(G.edges()) == set(street_grid.edges())
+    assert utils.get_route_distance(G, [1, 2, 3]) == utils.get_route_distance(
+        street_grid, [1, 2, 3]
+    )
+
+
+def test_store_keeps_network_types_apart(tmp_path, street_grid):
+    store = GraphStore(tmp_path)
+    store.save(BBOX, "walk", street_grid)
+
+    assert store.load(BBOX, "drive") is None
+
+
+def test_load_or_fetch_tile_uses_store(tmp_path, street_grid):
+    store = GraphStore(tmp_path)
+    store.save(TILE.bbox, "walk_tile", street_grid)
+
+    with (
+        patch.object(common, "graph_store", store),
+        patch.object(common.ox, "graph_from_bbox") as graph_from_bbox,
+    ):
+        G = common.load_or_fetch_tile(TILE, "walk")
+
+    graph_from_bbox.assert_not_called()
+    assert G.number_of_nodes() == street_grid.number_of_nodes()
+
+
+def test_load_or_fetch_tile_offline_miss(tmp_path):
+    with (
+        patch.object(common, "graph_store", GraphStore(tmp_path)),
+        patch.object(common.settings, "GRAPH_STORE_OFFLINE", True),
+        patch.object(common.ox, "graph_from_bbox") as graph_from_bbox,
+    ):
+        with pytest.raises(HTTPException) as exc:
+            common.load_or_fetch_tile(TILE, "walk")
+
+    graph_from_bbox.assert_not_called()
+    assert exc.value.status_code == 503
@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import common
+from app.graph.compiled import get_compiled_graph
+from app.graph.store import GraphStore
+from app.graph.tiles import Tile, bbox_around, stitch_tiles, tiles_for_bbox
+
+
+def _column(node: int, cols: int = 5) -> int:
+    return (node - 1) % cols
+
+
+def _tile_of_grid(grid, keep):
+    """Edges with at least one end in the tile, like ``truncate_by_edge``."""
+    return grid.edge_subgraph(
+        (u, v, k) for u, v, k in grid.edges(keys=True) if keep(u) or keep(v)
+    ).copy()
+
+
+def test_tiles_for_bbox_covers_bbox():
+    tiles = tiles_for_bbox((19.16, 51.58, 19.26, 51.62), 0.05)
+
+    assert tiles == [Tile(x, y, 0.05) for y in (1031, 1032) for x in (383, 384, 385)]
+    assert tiles[0].bbox == (19.15, 51.55, 19.2, 51.6)
+
+
+def test_bbox_around_scales_longitude():
+    west, south, east, north = bbox_around(19.2, 51.6, 1000)
+
+    assert north - south == pytest.approx(2 * 1000 / 111_320)
+    assert east - west > north - south
+
+
+def test_long_routes_load_a_city_sized_graph():
+    area = common.graph_area(19.2, 51.6, distance=1_000_000)
+    city = common.get_city_bbox(19.2, 51.6)
+
+    assert len(tiles_for_bbox(area, 0.05)) <= len(tiles_for_bbox(city, 0.05))
+
+
+def test_stitched_tiles_match_whole_graph(street_grid):
+    west = _tile_of_grid(street_grid, lambda n: _column(n) <= 2)
+    east = _tile_of_grid(street_grid, lambda n: _column(n) > 2)
+
+    stitched = stitch_tiles([west, east])
+    whole = stitch_tiles([street_grid])
+
+    assert set(stitched.edges()) == set(whole.edges())
+    assert get_compiled_graph(stitched).lengths.sum() == pytest.approx(
+        get_compiled_graph(whole).lengths.sum()
+    )
+
+
+def test_stitching_reuses_stored_tiles(tmp_path, street_grid):
+    area = (19.201, 51.601, 19.203, 51.603)
+    with (
+        patch.object(common, "graph_store", GraphStore(tmp_path)),
+        patch.object(common.settings, "GRAPH_TILE_DEG", 0.05),
+        patch.object(
+            common.ox, "graph_from_bbox", return_value=street_grid
+        ) as graph_from_bbox,
+    ):
+        G = common.load_or_stitch_graph(area, "walk")
+        with patch.object(common.settings, "GRAPH_STORE_OFFLINE", True):
+            assert common.load_or_fetch_tile(Tile(384, 1032, 0.05), "walk")
+
+    graph_from_bbox.assert_called_once()
+    assert set(G.nodes) <= set(street_grid.nodes)
+
+
+def test_offline_stitching_needs_every_tile(tmp_path):
+    with (
+        patch.object(common, "graph_store", GraphStore(tmp_path)),
+        patch.object(common.settings, "GRAPH_STORE_OFFLINE", True),
+    ):
+        with pytest.raises(HTTPException) as exc:
+            common.load_or_stitch_graph((19.19, 51.59, 19.21, 51.61), "walk")
+
+    assert exc.value.status_code == 503
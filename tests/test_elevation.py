@@ -0,0 +1,380 @@
+import json
+import struct
+from unittest.mock import patch
+
+import httpx
+import numpy as np
+import pytest
+
+from app import utils
+from app.graph.compiled import get_compiled_graph
+from app.graph.elevation import get_edge_elevation, route_edges
+from app.graph.store import GraphStore
+from app.services import elevation
+from app.services.dem import DemReader, open_geotiff
+from app.services.elevation import (
+    ElevationCache,
+    ElevationService,
+    HttpElevationBackend,
+)
+
+
+def write_hgt(path, grid: np.ndarray) -> None:
+    grid.astype(">i2").tofile(path)
+
+
+def write_geotiff(path, grid: np.ndarray, west: float, north: float, step: float):
+    """Little-endian, one-strip float32 GeoTIFF, pixel-is-area."""
+    rows, cols = grid.shape
+    entries = [
+        (256, 3, 1, cols),
+        (257, 3, 1, rows),
+        (258, 3, 1, 32),
+        (259, 3, 1, 1),
+        (273, 4, 1, 0),  # strip offset, patched below
+        (277, 3, 1, 1),
+        (279, 4, 1, grid.nbytes),
+        (339, 3, 1, 3),
+        (33550, 12, 3, struct.pack("<3d", step, step, 0)),
+        (33922, 12, 6, struct.pack("<6d", 0, 0, 0, west, north, 0)),
+        (34735, 3, 8, struct.pack("<8H", 1, 1, 0, 1, 1024, 0, 1, 2)),
+        (42113, 2, 6, b"-9999\0"),
+    ]
+    ifd_size = 2 + 12 * len(entries) + 4
+    extra = b""
+    packed = []
+    data_offset = 8 + ifd_size
+    for tag, kind, count, value in entries:
+        if isinstance(value, bytes) and len(value) > 4:
+            inline = struct.pack("<I", data_offset + len(extra))
+            extra += value
+        elif isinstance(value, bytes):
+            inline = value.ljust(4, b"\0")
+        elif kind == 3:
+            inline = struct.pack("<HH", value, 0)
+        else:
+            inline = struct.pack("<I", value)
+        packed.append((tag, kind, count, inline))
+    strip = data_offset + len(extra)
+    ifd = struct.pack("<H", len(entries))
+    for tag, kind, count, inline in packed:
+        if tag == 273:
+            inline = struct.pack("<I", strip)
+        ifd += struct.pack("<HHI4s", tag, kind, count, inline)
+    ifd += struct.pack("<I", 0)
+    header = b"II*\0" + struct.pack("<I", 8)
+    path.write_bytes(header + ifd + extra + grid.astype("<f4").tobytes())
+
+
+def test_hgt_is_sampled_bilinearly(tmp_path):
+    # 3x3 samples over N51E019: 0.5 degree apart, rows from the north
+    write_hgt(
+        tmp_path / "N51E019.hgt",
+        np.array([[200, 220, 240], [100, 120, 140], [0, 20, 40]]),
+    )
+    reader = DemReader(tmp_path, max_tiles=4)
+
+    elevations = reader.lookup(
+        [19.0, 19.25, 20.0, 19.5, 25.0], [51.0, 51.25, 52.0, 51.5, 51.0]
+    )
+
+    np.testing.assert_allclose(elevations[:4], [0, 60, 240, 120])
+    assert np.isnan(elevations[4])
+
+
+def test_hgt_voids_are_left_out(tmp_path):
+    write_hgt(tmp_path / "N51E019.hgt", np.array([[-32768, 100], [100, 100]]))
+    reader = DemReader(tmp_path, max_tiles=4)
+
+    assert reader.lookup([19.5, 19.0], [51.5, 52.0]).tolist()[0] == 100
+    assert np.isnan(reader.lookup([19.0], [52.0])[0])
+
+
+def test_geotiff_is_memory_mapped(tmp_path):
+    grid = np.array([[10, 20], [30, -9999]], dtype=np.float32)
+    write_geotiff(tmp_path / "dem.tif", grid, west=19.0, north=52.0, step=0.5)
+
+    raster = open_geotiff(tmp_path / "dem.tif")
+    # Pixel centres sit half a pixel inside the corner tiepoint
+    elevations = raster.sample(
+        np.array([19.25, 19.5, 19.75]), np.array([51.75, 51.75, 51.25])
+    )
+
+    assert isinstance(raster.data, np.memmap)
+    np.testing.assert_allclose(elevations[:2], [10, 15])
+    assert np.isnan(elevations[2])
+
+
+def test_reader_keeps_recent_rasters(tmp_path):
+    write_hgt(tmp_path / "N51E019.hgt", np.full((2, 2), 100))
+    write_hgt(tmp_path / "N51E020.hgt", np.full((2, 2), 200))
+    reader = DemReader(tmp_path, max_tiles=1)
+
+    assert reader.lookup([19.5, 20.5], [51.5, 51.5]).tolist() == [100, 200]
+    assert list(reader._rasters) == [tmp_path / "N51E020.hgt"]
+
+
+class FakeRedis:
+    """The async string commands ElevationCache uses."""
+
+    def __init__(self) -> None:
+        self.data: dict[str, str] = {}
+
+    async def mget(self, keys: list[str]) -> list[str | None]:
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis) -> None:
+        self.redis = redis
+        self.commands: list[tuple[str, str]] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+    def set(self, key: str, value: str, ex: int | None = None) -> None:
+        self.commands.append((key, value))
+
+    async def execute(self) -> None:
+        self.redis.data.update(self.commands)
+
+
+class CountingBackend:
+    name = "test"
+
+    def __init__(self, reader: DemReader) -> None:
+        self.reader = reader
+        self.points = 0
+
+    async def lookup(self, xs, ys):
+        self.points += len(xs)
+        return self.reader.lookup(xs, ys)
+
+    async def close(self) -> None:
+        pass
+
+
+class FunctionBackend:
+    name = "function"
+
+    def __init__(self, elevation) -> None:
+        self.elevation = elevation
+        self.calls = 0
+
+    async def lookup(self, xs, ys):
+        self.calls += 1
+        return self.elevation(np.asarray(xs), np.asarray(ys))
+
+    async def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def redis_client():
+    client = FakeRedis()
+    with patch.object(elevation, "get_redis", return_value=client):
+        yield client
+
+
+@pytest.mark.asyncio
+async def test_profile_follows_input_order(tmp_path, redis_client):
+    write_hgt(tmp_path / "N51E019.hgt", np.array([[100, 200], [0, 100]]))
+    backend = CountingBackend(DemReader(tmp_path, max_tiles=1))
+    service = ElevationService(backend, ElevationCache(max_points=100))
+
+    # A repeated point, and one outside the raster between known ones
+    profile = await service.profile(
+        [19.0, 20.0, 25.0, 19.0, 20.0000001], [51.0, 52.0, 51.0, 51.0, 52.0]
+    )
+
+    assert profile == [0, 200, 100, 0, 200]
+    assert backend.points == 3
+
+
+@pytest.mark.asyncio
+async def test_profile_reuses_cached_points(tmp_path, redis_client):
+    write_hgt(tmp_path / "N51E019.hgt", np.array([[100, 200], [0, 100]]))
+    backend = CountingBackend(DemReader(tmp_path, max_tiles=1))
+    xs, ys = [19.25, 19.5, 19.75], [51.5, 51.5, 51.5]
+
+    first = await ElevationService(backend, ElevationCache(100)).profile(xs, ys)
+    # Another worker: empty process cache, shared Redis
+    second = await ElevationService(backend, ElevationCache(100)).profile(xs, ys)
+
+    assert first == second == [75, 100, 125]
+    assert backend.points == 3
+    assert len(redis_client.data) == 3
+
+
+@pytest.mark.asyncio
+async def test_http_backend_sends_batches(monkeypatch):
+    monkeypatch.setattr(elevation, "BATCH_SIZE", 2)
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        locations = json.loads(request.content)["locations"]
+        requests.append(locations)
+        if len(requests) == 2:
+            return httpx.Response(503)
+        return httpx.Response(
+            200, json={"results": [{**loc, "elevation": 150} for loc in locations]}
+        )
+
+    backend = HttpElevationBackend(
+        "http://elevation", httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    elevations = await backend.lookup(
+        np.array([19.1, 19.2, 19.3, 19.4, 19.5]), np.array([51.5] * 5)
+    )
+    await backend.close()
+
+    assert [len(batch) for batch in requests] == [2, 2, 1]
+    assert requests[0][0] == {"latitude": 51.5, "longitude": 19.1}
+    # The failed second batch is unknown, the others are filled in
+    assert np.isnan(elevations).tolist() == [False, False, True, True, False]
+
+
+@pytest.mark.parametrize("size", [0, 2 * 3 * 3 + 2])
+def test_malformed_hgt_is_skipped(tmp_path, size):
+    (tmp_path / "N51E019.hgt").write_bytes(b"\0" * size)
+
+    assert np.isnan(DemReader(tmp_path, max_tiles=1).lookup([19.5], [51.5])[0])
+
+
+@pytest.mark.asyncio
+async def test_edge_climbs_sum_to_the_route_profile(street_grid, redis_client):
+    compiled = get_compiled_graph(street_grid)
+    service = ElevationService(
+        FunctionBackend(lambda xs, ys: (ys - 51.6) * 1e5 + np.sin(xs * 1e4) * 20),
+        ElevationCache(max_points=1000),
+    )
+    route = [1, 2, 7, 12, 11, 6, 1]
+
+    elevation = await get_edge_elevation(compiled, service)
+    again = await get_edge_elevation(compiled, service)
+
+    edges = route_edges(compiled, route)
+    profile = elevation.profile(compiled, edges)
+    xs, _ = utils.route_to_x_y(street_grid, route)
+    assert again is elevation
+    assert service.backend.calls == 1
+    assert len(profile) == len(xs)
+    climbs = np.diff(profile)
+    assert elevation.totals(edges) == (
+        climbs[climbs > 0].sum(),
+        -climbs[climbs < 0].sum(),
+    )
+    assert elevation.totals(edges)[0] > 0
+
+
+@pytest.mark.asyncio
+async def test_misses_are_cached(tmp_path, redis_client):
+    write_hgt(tmp_path / "N51E019.hgt", np.array([[100, 200], [0, 100]]))
+    backend = CountingBackend(DemReader(tmp_path, max_tiles=1))
+    xs, ys = [19.5, 25.0], [51.5, 51.0]
+
+    first = await ElevationService(backend, ElevationCache(100)).elevations(xs, ys)
+    again = await ElevationService(backend, ElevationCache(100)).elevations(xs, ys)
+
+    assert np.isnan(first).tolist() == np.isnan(again).tolist() == [False, True]
+    assert backend.points == 2
+    assert redis_client.data[ElevationCache.key("test", 2500000, 5100000)] == "nan"
+
+
+@pytest.mark.asyncio
+async def test_unknown_points_are_filled_within_their_edge(street_grid, redis_client):
+    compiled = get_compiled_graph(street_grid)
+    # Only the bottom row of the grid is known, rising 100 m a block eastwards
+    service = ElevationService(
+        FunctionBackend(
+            lambda xs, ys: np.where(ys < 51.6005, (xs - 19.2) * 1e5, np.nan)
+        ),
+        ElevationCache(max_points=1000),
+    )
+
+    elevation = await get_edge_elevation(compiled, service)
+
+    # Only the bottom row climbs; no edge borrows its neighbours' elevations
+    assert elevation.totals(np.arange(compiled.num_edges)) == (400, 400)
+    profile = elevation.profile(compiled, route_edges(compiled, [1, 2, 7, 8]))
+    assert set(profile) == {0, 100}
+
+
+@pytest.mark.asyncio
+async def test_graph_without_elevation_is_remembered(street_grid, redis_client):
+    compiled = get_compiled_graph(street_grid)
+    service = ElevationService(
+        FunctionBackend(lambda xs, ys: np.full(len(xs), np.nan)),
+        ElevationCache(max_points=1000),
+    )
+
+    with patch.object(service, "elevations", wraps=service.elevations) as lookup:
+        assert await get_edge_elevation(compiled, service) is None
+        assert await get_edge_elevation(compiled, service) is None
+
+    # Not even the cache is asked again for every point of the graph
+    assert lookup.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_is_read_and_written_in_batches(
+    tmp_path, redis_client, monkeypatch
+):
+    monkeypatch.setattr(elevation, "REDIS_BATCH_SIZE", 2)
+    write_hgt(tmp_path / "N51E019.hgt", np.array([[100, 200], [0, 100]]))
+    backend = CountingBackend(DemReader(tmp_path, max_tiles=1))
+    xs, ys = [19.25, 19.5, 19.75, 25.0, 19.5], [51.5, 51.5, 51.5, 51.0, 51.25]
+
+    first = await ElevationService(backend, ElevationCache(100)).elevations(xs, ys)
+    again = await ElevationService(backend, ElevationCache(100)).elevations(xs, ys)
+
+    assert len(redis_client.data) == 5
+    assert backend.points == 5
+    np.testing.assert_array_equal(first, again)
+
+
+@pytest.mark.asyncio
+async def test_graph_lookup_skips_the_point_cache(street_grid, redis_client):
+    compiled = get_compiled_graph(street_grid)
+    cache = ElevationCache(max_points=1000)
+    service = ElevationService(FunctionBackend(lambda xs, ys: ys * 0 + 100), cache)
+
+    assert await get_edge_elevation(compiled, service) is not None
+
+    assert redis_client.data == {}
+    assert not cache._points
+
+
+@pytest.mark.asyncio
+async def test_edge_elevation_is_kept_in_the_graph_store(
+    tmp_path, street_grid, redis_client
+):
+    store = GraphStore(tmp_path)
+    bbox = (19.15, 51.55, 19.25, 51.65)
+    store.save(bbox, "walk", street_grid)
+    backend = FunctionBackend(lambda xs, ys: (ys - 51.6) * 1e5)
+
+    first = await get_edge_elevation(
+        get_compiled_graph(store.load(bbox, "walk")),
+        ElevationService(backend, ElevationCache(max_points=1000)),
+        store,
+        (bbox, "walk"),
+    )
+    # Another worker: its own compiled graph, same store
+    second = await get_edge_elevation(
+        get_compiled_graph(store.load(bbox, "walk")),
+        ElevationService(backend, ElevationCache(max_points=1000)),
+        store,
+        (bbox, "walk"),
+    )
+
+    assert backend.calls == 1
+    assert second is not first
+    np.testing.assert_array_equal(second.ascent, first.ascent)
+    np.testing.assert_array_equal(second.points, first.points)
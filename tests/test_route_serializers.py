@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from app.models import Segment
+from app.serializers.route import (
+    RouteFormat,
+    decode_polyline,
+    delta_decode,
+    delta_encode,
+    encode_polyline,
+    negotiate_format,
+    segment_spans,
+)
+
+
+def test_encodes_google_polyline():
+    # Example from Google's encoded polyline format documentation
+    lats, lngs = [38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]
+
+    assert encode_polyline(lats, lngs) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_polyline_and_deltas_round_trip():
+    rng = np.random.default_rng(0)
+    lats = 51.6 + rng.normal(0, 0.05, 500)
+    lngs = 19.2 + rng.normal(0, 0.05, 500)
+
+    decoded_lats, decoded_lngs = decode_polyline(encode_polyline(lats, lngs))
+
+    assert np.allclose(decoded_lats, lats, atol=1e-5)
+    assert np.allclose(decoded_lngs, lngs, atol=1e-5)
+    assert np.allclose(delta_decode(delta_encode(lngs, 6), 6), lngs, atol=1e-6)
+
+
+def test_run_length_encodes_segments():
+    segments = [Segment(new=n, distance=10.0) for n in (True, True, False, True)]
+
+    spans = segment_spans(segments)
+
+    assert [(s.new, s.edges, s.distance) for s in spans] == [
+        (True, 2, 20.0),
+        (False, 1, 10.0),
+        (True, 1, 10.0),
+    ]
+
+
+@pytest.mark.parametrize(
+    ("accept", "format", "expected"),
+    [
+        (None, None, RouteFormat.json),
+        ("text/html, */*", None, RouteFormat.json),
+        (
+            "application/vnd.travelmap.polyline+json;q=0.5, application/json",
+            None,
+            RouteFormat.json,
+        ),
+        ("application/msgpack", None, RouteFormat.json),
+        (
+            "application/vnd.travelmap.delta+json",
+            RouteFormat.polyline,
+            RouteFormat.polyline,
+        ),
+    ],
+)
+def test_negotiates_format(accept, format, expected):
+    assert negotiate_format(accept, format) == expected
@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+import gpxpy.gpx
+import pytest
+
+from app.graph.store import GraphStore
+from app.strava_import import GpxImporter
+
+BBOX = (19.15, 51.55, 19.25, 51.65)
+
+
+class FakeCollection:
+    """The few collection methods GpxImporter uses, keyed on one field."""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.docs: dict = {}
+        self.bulk_writes = 0
+
+    def create_index(self, field: str) -> None:
+        pass
+
+    def find(self, query: dict, projection: dict):
+        fields = [f for f, on in projection.items() if on]
+        return [{f: doc[f] for f in fields if f in doc} for doc in self.docs.values()]
+
+    def find_one(self, query: dict, projection: dict):
+        doc = self.docs.get(query[self.key])
+        return dict(doc) if doc else None
+
+    def insert_one(self, doc: dict) -> None:
+        self.docs[doc[self.key]] = dict(doc)
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False) -> None:
+        self.docs.setdefault(query[self.key], dict(query)).update(update["$set"])
+
+    def bulk_write(self, requests: list, ordered: bool = True):
+        self.bulk_writes += 1
+        upserted = matched = 0
+        for request in requests:
+            key = request._filter[self.key]
+            matched += key in self.docs
+            upserted += key not in self.docs
+            self.update_one(request._filter, request._doc, request._upsert)
+        return SimpleNamespace(upserted_count=upserted, matched_count=matched)
+
+
+def write_gpx(path, G, route: list[int]) -> None:
+    gpx = gpxpy.gpx.GPX()
+    track = gpxpy.gpx.GPXTrack(name=f"Walk {path.stem}")
+    segment = gpxpy.gpx.GPXTrackSegment()
+    for node in route:
+        segment.points.append(
+            gpxpy.gpx.GPXTrackPoint(G.nodes[node]["y"], G.nodes[node]["x"])
+        )
+    track.segments.append(segment)
+    gpx.tracks.append(track)
+    path.write_text(gpx.to_xml())
+
+
+@pytest.fixture
+def importer(tmp_path):
+    return GpxImporter(
+        routes=FakeCollection("id"),
+        jobs=FakeCollection("job_id"),
+        store_root=tmp_path / "graphs",
+        workers=1,
+    )
+
+
+def test_imports_matched_routes_and_skips_unchanged(tmp_path, street_grid, importer):
+    write_gpx(tmp_path / "1.gpx", street_grid, [1, 2, 3])
+    write_gpx(tmp_path / "2.gpx", street_grid, [5, 10, 15])
+    (tmp_path / "3.gpx").write_text("not a gpx")
+    paths = sorted(tmp_path.glob("*.gpx"))
+
+    job = importer.run(importer.create_job(len(paths)), street_grid, paths)
+
+    assert (job.status, job.processed, job.inserted) == ("done", 3, 2)
+    assert list(job.errors) == ["3"]
+    assert importer.routes.docs[1]["nodes"] == [1, 2, 3]
+    assert importer.routes.docs[2]["name"] == "Walk 2"
+    assert importer.get(job.job_id) == job
+
+    write_gpx(tmp_path / "2.gpx", street_grid, [5, 10])
+    again = importer.run(importer.create_job(len(paths)), street_grid, paths)
+
+    assert (again.inserted, again.updated, again.unchanged) == (0, 1, 1)
+    assert importer.routes.docs[2]["nodes"] == [5, 10]
+
+
+def test_matches_in_worker_processes(tmp_path, street_grid, importer):
+    GraphStore(importer.store_root).save(BBOX, "walk", street_grid)
+    street_grid.graph.update(bbox=BBOX, network_type="walk")
+    for i in range(4):
+        write_gpx(tmp_path / f"{i + 1}.gpx", street_grid, [1, 2, 7])
+    importer.workers = 2
+
+    paths = sorted(tmp_path.glob("*.gpx"))
+
+    job = importer.run(importer.create_job(len(paths)), street_grid, paths)
+
+    assert (job.status, job.inserted) == ("done", 4)
+    assert all(doc["nodes"] == [1, 2, 7] for doc in importer.routes.docs.values())
+
+
+def test_matches_in_job_thread_when_graph_is_not_stored(
+    tmp_path, street_grid, importer
+):
+    street_grid.graph.update(bbox=BBOX, network_type="walk")
+    for i in range(2):
+        write_gpx(tmp_path / f"{i + 1}.gpx", street_grid, [1, 2, 7])
+    importer.workers = 2
+    paths = sorted(tmp_path.glob("*.gpx"))
+
+    job = importer.run(importer.create_job(len(paths)), street_grid, paths)
+
+    assert (job.status, job.inserted, job.errors) == ("done", 2, {})
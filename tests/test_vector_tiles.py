@@ -0,0 +1,121 @@
+import math
+
+import numpy as np
+
+from app.graph.compiled import get_compiled_graph
+from app.vector_tiles import (
+    EXTENT,
+    LAYER,
+    TileCache,
+    encode_geometry,
+    tile_bounds,
+    visited_tile,
+)
+from app.visited_edges import VisitedEdges
+
+
+def tile_at(z: int, lon: float, lat: float) -> tuple[int, int, int]:
+    n = 2**z
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return z, int((lon + 180) / 360 * n), int(y)
+
+
+def read_fields(data: bytes) -> list[tuple[int, int | bytes]]:
+    """Top-level protobuf fields as ``(field, varint or bytes)``."""
+
+    def varint(i: int) -> tuple[int, int]:
+        value = shift = 0
+        while True:
+            value |= (data[i] & 0x7F) << shift
+            shift += 7
+            i += 1
+            if data[i - 1] < 0x80:
+                return value, i
+
+    fields, i = [], 0
+    while i < len(data):
+        key, i = varint(i)
+        if key & 7 == 0:
+            value, i = varint(i)
+        else:
+            size, i = varint(i)
+            value, i = data[i : i + size], i + size
+        fields.append((key >> 3, value))
+    return fields
+
+
+def read_varints(data: bytes) -> list[int]:
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def decode_geometry(commands: list[int]) -> list[list[tuple[int, int]]]:
+    lines, x, y, i = [], 0, 0, 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == 1:
+            lines.append([])
+        for _ in range(count):
+            dx, dy = commands[i], commands[i + 1]
+            x += (dx >> 1) ^ -(dx & 1)
+            y += (dy >> 1) ^ -(dy & 1)
+            lines[-1].append((x, y))
+            i += 2
+    return lines
+
+
+def test_encode_geometry_round_trips():
+    coords = np.array([[5, 5], [10, 2], [0, 0], [-3, 7], [-3, 9], [1, 1]])
+    offsets = np.array([0, 2, 6])
+
+    lines = decode_geometry(encode_geometry(coords, offsets).tolist())
+
+    assert lines == [[(5, 5), (10, 2)], [(0, 0), (-3, 7), (-3, 9), (1, 1)]]
+
+
+def test_visited_tile_has_clipped_visited_streets(street_grid):
+    compiled = get_compiled_graph(street_grid)
+    visited = VisitedEdges()
+    visited.mark_edges_visited([1, 2, 3, 8])
+    z, x, y = tile_at(15, 19.2, 51.6)
+
+    [(field, layer)] = read_fields(visited_tile(compiled, visited, z, x, y))
+    layer = dict(read_fields(layer))
+    feature = dict(read_fields(layer[2]))
+    lines = decode_geometry(read_varints(feature[4]))
+
+    assert field == 3
+    assert layer[1].decode() == LAYER and layer[5] == EXTENT
+    assert feature[3] == 2
+    # 1-2-3 is one straight street and 3-8 turns north; both directions once
+    assert sum(len(line) - 1 for line in lines) == 3
+    west, _, east, _ = tile_bounds(z, x, y)
+    x1 = (street_grid.nodes[1]["x"] - west) / (east - west) * EXTENT
+    assert lines[0][0][0] == round(x1)
+
+
+def test_visited_tile_is_empty_without_visited_streets(street_grid):
+    compiled = get_compiled_graph(street_grid)
+
+    assert visited_tile(compiled, VisitedEdges(), *tile_at(16, 19.2, 51.6)) == b""
+
+
+def test_tile_cache_drops_stale_versions():
+    cache = TileCache(max_tiles=2)
+    cache.put("a", 1, b"a1")
+    cache.put("b", 1, b"b1")
+
+    assert cache.get("a", 1) == b"a1"
+    assert cache.get("a", 2) is None
+
+    cache.put("c", 1, b"c1")
+
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == b"a1"
@@ -0,0 +1,165 @@
+import pickle
+from unittest.mock import patch
+from uuid import uuid4
+
+import numpy as np
+import pytest
+from redis.exceptions import ConnectionError
+
+from app import visited_edges
+from app.graph.compiled import get_compiled_graph
+from app.visited_edges import VisitedEdges, VisitedStore
+
+
+class FakeRedis:
+    """The few byte-string commands VisitedStore uses."""
+
+    def __init__(self) -> None:
+        self.data: dict[str, bytes] = {}
+
+    def append(self, key: str, value: bytes) -> int:
+        self.data[key] = self.data.get(key, b"") + value
+        return len(self.data[key])
+
+    def strlen(self, key: str) -> int:
+        return len(self.data.get(key, b""))
+
+    def getrange(self, key: str, start: int, end: int) -> bytes:
+        return self.data.get(key, b"")[start:]
+
+    def delete(self, key: str) -> None:
+        self.data.pop(key, None)
+
+
+@pytest.fixture
+def redis_client():
+    client = FakeRedis()
+    with patch.object(visited_edges, "get_sync_binary_redis", return_value=client):
+        yield client
+
+
+def test_union_updates_cached_mask(street_grid):
+    compiled = get_compiled_graph(street_grid)
+    v_edges = VisitedEdges()
+    mask = v_edges.edge_mask(compiled)
+    assert not mask.any()
+
+    added = v_edges.union([(1, 2), (1, 2), (2, 3), (99, 100)])
+    again = v_edges.union([(2, 3)])
+
+    assert len(added) == 3 and len(again) == 0
+    assert v_edges.edge_mask(compiled) is mask
+    assert mask.sum() == 4
+
+
+def test_coverage_stats_update_incrementally(street_grid):
+    compiled = get_compiled_graph(street_grid)
+    v_edges = VisitedEdges(pairs=np.array([[1, 2]]))
+    before = v_edges.coverage_stats(street_grid)
+
+    v_edges.mark_edges_visited([2, 3, 2, 1])
+    after = v_edges.coverage_stats(street_grid)
+
+    assert before.total_distance == after.total_distance == compiled.lengths.sum()
+    assert before.visited_distance == 2 * street_grid[1][2][0]["length"]
+    assert after.visited_distance == pytest.approx(
+        compiled.lengths[v_edges.edge_mask(compiled)].sum()
+    )
+    assert after.visited_distance == pytest.approx(
+        VisitedEdges(pairs=v_edges.pairs).coverage_stats(street_grid).visited_distance
+    )
+    assert 0 < before.visited_percent < after.visited_percent < 100
+
+
+def test_pickles_without_masks(street_grid):
+    v_edges = VisitedEdges("visited:x", np.array([[1, 2]]), np.array([3]))
+    v_edges.edge_mask(get_compiled_graph(street_grid))
+
+    copy = pickle.loads(pickle.dumps(v_edges))
+
+    assert copy.key == "visited:x"
+    assert list(copy) == [(1, 2)]
+    assert copy.counts.tolist() == [3]
+
+
+def test_edge_visits_count_walks(street_grid):
+    compiled = get_compiled_graph(street_grid)
+    v_edges = VisitedEdges()
+    assert not v_edges.edge_visits(compiled).any()
+
+    v_edges.mark_edges_visited([1, 2, 1, 2])
+    version = v_edges.version
+    v_edges.mark_edges_visited([1, 2])
+    visits = v_edges.edge_visits(compiled)
+
+    assert visits[compiled.find_edge(1, 2)] == 3
+    assert visits[compiled.find_edge(2, 1)] == 1
+    # Walking a street again leaves the version, and so tiles, alone
+    assert v_edges.version == version
+    # Never walked from 3 to 2, so it counts the walks the other way
+    v_edges.union([(2, 3)], [2])
+    assert v_edges.edge_visits(compiled)[compiled.find_edge(3, 2)] == 2
+    assert v_edges.version != version
+
+
+def test_store_shares_edges_between_workers(redis_client):
+    user = uuid4()
+    first, second = VisitedStore(max_users=10), VisitedStore(max_users=10)
+    assert len(second.get(user)) == 0
+
+    first.mark_route(first.get(user), [1, 2, 3])
+    first.mark(first.get(user), [(1, 2)])
+
+    assert list(second.get(user)) == [(1, 2), (2, 3)]
+    assert second.get(user).counts.tolist() == [2, 1]
+    assert len(second.get(None)) == 0
+    assert len(redis_client.data[VisitedStore.key(user)]) == 3 * 16
+
+
+def test_store_counts_interleaved_walks_once(redis_client):
+    user = uuid4()
+    first, second = VisitedStore(max_users=10), VisitedStore(max_users=10)
+    visited = first.get(user)
+
+    # The other worker appends before this one does
+    second.mark(second.get(user), [(2, 3)])
+    first.mark(visited, [(1, 2)])
+    first.mark(visited, [(1, 2)])
+
+    assert list(first.get(user)) == [(1, 2), (2, 3)]
+    assert first.get(user).counts.tolist() == [2, 1]
+    assert second.get(user).counts.tolist() == [2, 1]
+
+
+def test_store_evicts_least_recently_used_user(redis_client):
+    store = VisitedStore(max_users=1)
+    a, b = uuid4(), uuid4()
+    store.mark(store.get(a), [(1, 2)])
+    store.get(b)
+
+    # Reloaded from Redis after eviction
+    assert list(store.get(a)) == [(1, 2)]
+
+
+def test_store_works_without_redis(redis_client):
+    store = VisitedStore(max_users=10)
+    with patch.object(redis_client, "strlen", side_effect=ConnectionError()):
+        visited = store.get(None)
+    store.mark(visited, [(1, 2)])
+
+    assert list(store.get(None)) == [(1, 2)]
+    assert redis_client.data == {}
+
+
+def test_streets_draw_two_way_streets_once(street_grid):
+    compiled = get_compiled_graph(street_grid)
+    visited = VisitedEdges(pairs=np.array([[1, 2], [2, 1], [2, 3]]))
+
+    streets = visited.streets(compiled)
+    in_view = visited.streets(compiled, np.array([compiled.find_edge(2, 3)]))
+
+    pairs = compiled.node_ids[
+        np.column_stack((compiled.sources[streets], compiled.targets[streets]))
+    ]
+    assert sorted(map(sorted, pairs.tolist())) == [[1, 2], [2, 3]]
+    assert len(in_view) == 1
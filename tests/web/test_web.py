@@ -5,7 +5,7 @@ import pytest
 
 from app.api.common import graphs
 from app.serializers.geocode import GeocodeItem
-from app.visited_edges import visited_edges
+from app.visited_edges import visited_store
 
 pytestmark = [pytest.mark.asyncio]
 
@@ -33,10 +33,10 @@ def mock_route_generator():
 @pytest.fixture(autouse=True)
 def clear_graphs_and_edges():
     graphs.clear()
-    visited_edges.clear()
+    visited_store.clear(visited_store.get(None))
     yield
     graphs.clear()
-    visited_edges.clear()
+    visited_store.clear(visited_store.get(None))
 
 
 async def test_index_page(client):
@@ -53,7 +53,7 @@ async def test_index_page(client):
 
 
 @patch("app.api.route_generation.get_or_create_graph")
-@patch("app.api.route_generation.ox.nearest_nodes")
+@patch("app.api.route_generation.nearest_nodes")
 async def test_htmx_route_returns_fragment(
     mock_nearest_nodes,
     mock_get_graph,
@@ -62,7 +62,7 @@ async def test_htmx_route_returns_fragment(
     mock_route_generator,
 ):
     mock_get_graph.return_value = mock_graph
-    mock_nearest_nodes.side_effect = [1, 3]
+    mock_nearest_nodes.return_value = [1, 3]
 
     res = await client.get("/htmx/route?algorithm=random&distance=4000")
 
@@ -76,12 +76,13 @@ async def test_htmx_route_returns_fragment(
 
 async def test_htmx_visited_routes(client, mock_graph):
     with patch("app.api.route_generation.get_or_create_graph", return_value=mock_graph):
-        visited_edges.add((1, 2))
+        visited_store.mark(visited_store.get(None), [(1, 2)])
 
         res = await client.get("/htmx/visited-routes")
 
     assert res.status_code == 200, res.text
-    assert "window.TravelMap.drawVisited" in res.text
+    assert "1 visited segment loaded" in res.text
+    assert 'drawVisited("/api/tiles/visited/{z}/{x}/{y}.mvt")' in res.text
 
 
 async def test_htmx_geocode_results(client):